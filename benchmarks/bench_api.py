@@ -0,0 +1,269 @@
+"""End-to-end benchmarks of billy client against a local fake billy server
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/bench_api.py
+
+Results are compared with benchmarks/baseline.json, pass --record to
+overwrite the baseline with new results. Numbers only compare meaningfully
+against a baseline recorded on the same machine with the same options.
+Requests go through HTTP by default, pass --in-process to route them to
+the fake server directly and measure the client alone
+
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+
+from billy_client import BillyAPI
+from billy_client import Company
+from billy_client import Customer
+from billy_client import Invoice
+from billy_client import NO_RETRY
+from billy_client.fake import FakeBilly
+from billy_client.fake import FakeServer
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def measure(func, ops):
+    """Call func ops times, and return the throughput and latency
+
+    """
+    latencies = []
+    started = time.time()
+    for i in range(ops):
+        op_started = time.time()
+        func(i)
+        latencies.append(time.time() - op_started)
+    elapsed = time.time() - started
+    return summarize(ops, elapsed, latencies)
+
+
+def summarize(ops, elapsed, latencies=None):
+    latencies = sorted(latencies or [])
+    result = dict(
+        ops=ops,
+        seconds=round(elapsed, 4),
+        ops_per_sec=round(ops / elapsed, 1),
+    )
+    if latencies:
+        result['p50_ms'] = round(_percentile(latencies, 0.5) * 1000, 3)
+        result['p95_ms'] = round(_percentile(latencies, 0.95) * 1000, 3)
+    return result
+
+
+def _guids(billy, collection, count):
+    return [record['guid'] for record in billy.records[collection][:count]]
+
+
+def bench_get(api, billy, ops):
+    guids = _guids(billy, 'invoices', ops)
+    return measure(lambda i: api.get_invoice(guids[i]), ops)
+
+
+def bench_create(api, billy, ops):
+    company = Company(api, dict(guid=_guids(billy, 'companies', 1)[0]))
+    customer = Customer(api, dict(guid=_guids(billy, 'customers', 1)[0]))
+
+    def create(i):
+        if i % 2:
+            customer.invoice(amount=1000, title='Benchmark')
+        else:
+            company.create_customer()
+    return measure(create, ops)
+
+
+def bench_paginate(api, billy, ops, **kwargs):
+    started = time.time()
+    count = 0
+    for _ in api.list_invoices(page_size=billy.max_page_size, **kwargs):
+        count += 1
+    elapsed = time.time() - started
+    return summarize(count, elapsed)
+
+
+def bench_paginate_parallel(api, billy, ops):
+    return bench_paginate(api, billy, ops, workers=4)
+
+
+def bench_get_many(api, billy, ops):
+    guids = _guids(billy, 'invoices', ops)
+    started = time.time()
+    api.get_many(Invoice, guids)
+    return summarize(ops, time.time() - started)
+
+
+def bench_invoice_many(api, billy, ops):
+    customer_guid = _guids(billy, 'customers', 1)[0]
+    specs = (
+        dict(customer_guid=customer_guid, amount=1000, external_id=str(i))
+        for i in range(ops)
+    )
+    started = time.time()
+    for _ in api.invoice_many(specs):
+        pass
+    return summarize(ops, time.time() - started)
+
+
+#: Benchmarks to run in order, pagination benchmarks walk through all
+#  invoices and report records instead of operations
+BENCHMARKS = [
+    ('get', bench_get),
+    ('create', bench_create),
+    ('paginate', bench_paginate),
+    ('paginate_parallel', bench_paginate_parallel),
+    ('get_many', bench_get_many),
+    ('invoice_many', bench_invoice_many),
+]
+
+
+def populate(billy, records):
+    """Create a company with records customers and invoices, return the
+    API key of the company
+
+    """
+    company = billy.create_company('MOCK_PROCESSOR_KEY')
+    customer_guids = [
+        billy.create_customer(company['guid'], {})['guid']
+        for _ in range(records)
+    ]
+    for customer_guid in customer_guids:
+        billy.create_invoice(
+            company['guid'],
+            dict(customer_guid=customer_guid, amount='1000'),
+        )
+    return company['api_key']
+
+
+def _run(api, billy, ops, names):
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results[name] = func(api, billy, ops)
+    return results
+
+
+def run(ops, records, latency, page_size, names=None, in_process=False):
+    billy = FakeBilly(latency=latency, max_page_size=page_size)
+    api_key = populate(billy, max(ops, records))
+    if in_process:
+        api = BillyAPI(
+            api_key,
+            endpoint='http://billy.test',
+            retry_policy=NO_RETRY,
+        )
+        billy.install(api)
+        return _run(api, billy, ops, names)
+    with FakeServer(billy) as server:
+        api = BillyAPI(
+            api_key,
+            endpoint=server.endpoint,
+            retry_policy=NO_RETRY,
+        )
+        try:
+            return _run(api, billy, ops, names)
+        finally:
+            api.close()
+
+
+def compare(results, baseline):
+    """Format results side by side with baseline
+
+    """
+    lines = ['{:<20} {:>12} {:>12} {:>9}'.format(
+        'benchmark', 'ops/s', 'baseline', 'change',
+    )]
+    for name, _ in BENCHMARKS:
+        if name not in results:
+            continue
+        ops_per_sec = results[name]['ops_per_sec']
+        base = baseline.get(name, {}).get('ops_per_sec')
+        if base:
+            change = '{:+.1f}%'.format((ops_per_sec - base) / base * 100)
+        else:
+            change = '-'
+        lines.append('{:<20} {:>12} {:>12} {:>9}'.format(
+            name, ops_per_sec, base or '-', change,
+        ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=500)
+    parser.add_argument(
+        '--records',
+        type=int,
+        default=20000,
+        help='customers and invoices, walked by pagination benchmarks',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='seconds the server sleeps before each response',
+    )
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument(
+        '--in-process',
+        action='store_true',
+        help='skip HTTP and call the fake server directly',
+    )
+    parser.add_argument('--only', action='append', help='benchmark to run')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument(
+        '--record',
+        action='store_true',
+        help='save results as the new baseline',
+    )
+    parser.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args(argv)
+
+    results = run(
+        ops=args.ops,
+        records=args.records,
+        latency=args.latency,
+        page_size=args.page_size,
+        names=args.only,
+        in_process=args.in_process,
+    )
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(compare(results, baseline))
+    if args.record:
+        with open(args.baseline, 'wb') as baseline_file:
+            json.dump(dict(
+                options=dict(
+                    ops=args.ops,
+                    records=args.records,
+                    latency=args.latency,
+                    page_size=args.page_size,
+                    in_process=args.in_process,
+                ),
+                python=sys.version.split()[0],
+                results=results,
+            ), baseline_file, indent=2, sort_keys=True, separators=(',', ': '))
+            baseline_file.write(b'\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
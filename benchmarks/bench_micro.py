@@ -0,0 +1,318 @@
+"""Micro-benchmarks of pure Python hot paths of billy client
+
+Run from the root of the repository:
+
+    PYTHONPATH=. python benchmarks/bench_micro.py
+
+Every benchmark is timed on fixed synthetic payloads without any network
+I/O, and reported in nanoseconds per operation, the best of several
+repeats. The repeats of all benchmarks are interleaved, and every result is
+also divided by the time of a fixed reference workload measured the same
+way, so that the relative numbers are stable across machines and noisy
+neighbours. The run fails if the relative number of any benchmark is
+larger than the one in benchmarks/micro_baseline.json by more than
+--threshold percent, pass --record to overwrite the baseline
+
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import os
+import sys
+import json
+import timeit
+import argparse
+
+from billy_client import BillyAPI
+from billy_client import Customer
+from billy_client import Invoice
+from billy_client.api import Resource
+from billy_client.api import Page
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__),
+    'micro_baseline.json',
+)
+
+#: Fields of the synthetic invoice record
+INVOICE = dict(
+    guid='IV0000000000000000000000',
+    invoice_type='subscription',
+    transaction_type='debit',
+    status='settled',
+    customer_guid='CU0000000000000000000000',
+    subscription_guid='SU0000000000000000000000',
+    external_id='external-0',
+    title='Synthetic invoice',
+    amount=1000,
+    effective_amount=1000,
+    total_adjustment_amount=0,
+    funding_instrument_uri='/v1/cards/CC0000000000000000000000',
+    appears_on_statement_as='BILLY',
+    items=[dict(name='item', amount=1000)],
+    adjustments=[],
+    scheduled_at='2014-01-01T00:00:00.000000Z',
+    created_at='2014-01-01T00:00:00.000000Z',
+    updated_at='2014-01-01T00:00:00.000000Z',
+)
+
+
+class _Response(object):
+
+    status_code = 200
+    content = b''
+
+    def __init__(self, json_data):
+        self.json_data = json_data
+
+    def json(self):
+        return self.json_data
+
+
+class _Session(object):
+    """Session serves pre-decoded pages, so that only the client side of
+    page iteration is measured
+
+    """
+
+    def __init__(self, records, page_size):
+        self.pages = []
+        for offset in range(0, records + 1, page_size):
+            self.pages.append(_Response(dict(
+                offset=offset,
+                limit=page_size,
+                items=[
+                    dict(INVOICE, guid='IV{:022}'.format(i))
+                    for i in range(offset, min(offset + page_size, records))
+                ],
+            )))
+        self.page_size = page_size
+
+    def get(self, url, **kwargs):
+        offset = 0
+        query = url.partition('?')[2]
+        for pair in query.split('&'):
+            key, _, value = pair.partition('=')
+            if key == 'offset':
+                offset = int(value)
+        return self.pages[offset // self.page_size]
+
+    def close(self):
+        pass
+
+
+def bench_resource_init(api):
+    def run():
+        Invoice(api, INVOICE)
+    return run, 1
+
+
+def bench_resource_getattr(api):
+    invoice = Invoice(api, INVOICE)
+
+    def run():
+        invoice.guid
+        invoice.status
+        invoice.amount
+        invoice.customer_guid
+    return run, 4
+
+
+def bench_resource_getattr_missing(api):
+    resource = Resource(api, INVOICE)
+
+    def run():
+        getattr(resource, 'missing', None)
+    return run, 1
+
+
+def bench_encode_params(api):
+    customer = Customer(api, dict(guid='CU0000000000000000000000'))
+    items = [
+        dict(name='item {}'.format(i), amount=i * 100, quantity=i)
+        for i in range(10)
+    ]
+
+    def run():
+        customer._encode_params('item_', items)
+    return run, 1
+
+
+def bench_url_for(api):
+    def run():
+        api._url_for('/v1/invoices/IV0000000000000000000000')
+    return run, 1
+
+
+def _bench_page(api, records=1000, page_size=100, **kwargs):
+    session = _Session(records, page_size)
+    page_api = BillyAPI(
+        'MOCK_API_KEY',
+        endpoint='http://localhost',
+        session=session,
+        **kwargs
+    )
+
+    def run():
+        for _ in Page(
+            page_api,
+            'http://localhost/v1/invoices',
+            Invoice,
+            page_size=page_size,
+        ):
+            pass
+    return run, records
+
+
+def bench_page_iter(api):
+    return _bench_page(api)
+
+
+def bench_page_iter_compact(api):
+    return _bench_page(api, compact=True)
+
+
+def bench_reference(api):
+    """Fixed pure Python workload every benchmark is relative to
+
+    """
+    keys = ['key{}'.format(i) for i in range(10)]
+
+    def run():
+        data = {}
+        for key in keys:
+            data[key] = key.upper()
+        '&'.join('{}={}'.format(k, v) for k, v in sorted(data.items()))
+    return run, 1
+
+
+#: Benchmarks to run in order
+BENCHMARKS = [
+    ('resource_init', bench_resource_init),
+    ('resource_getattr', bench_resource_getattr),
+    ('resource_getattr_missing', bench_resource_getattr_missing),
+    ('encode_params', bench_encode_params),
+    ('url_for', bench_url_for),
+    ('page_iter', bench_page_iter),
+    ('page_iter_compact', bench_page_iter_compact),
+]
+
+
+def _calibrate(timer, min_time):
+    """Return the number of calls taking at least min_time seconds
+
+    """
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return number
+
+
+def run(names=None, repeat=5, min_time=0.1):
+    """Run benchmarks, return a dict maps names to nanoseconds per 
+    operation, and a dict maps names to the ratios to the reference 
+    workload
+
+    """
+    api = BillyAPI('MOCK_API_KEY', endpoint='http://localhost')
+    benchmarks = [('reference', bench_reference)] + [
+        (name, setup) for name, setup in BENCHMARKS
+        if not names or name in names
+    ]
+    timers = []
+    for name, setup in benchmarks:
+        func, ops = setup(api)
+        timer = timeit.Timer(func)
+        timers.append((name, timer, _calibrate(timer, min_time), ops))
+    best = {}
+    for _ in range(repeat):
+        for name, timer, number, ops in timers:
+            elapsed = timer.timeit(number) / number / ops * 1e9
+            best[name] = min(best.get(name, elapsed), elapsed)
+    reference = best.pop('reference')
+    nanoseconds = dict(
+        (name, round(value, 1)) for name, value in best.iteritems()
+    )
+    ratios = dict(
+        (name, round(value / reference, 4)) for name, value in best.iteritems()
+    )
+    return nanoseconds, ratios
+
+
+def check(nanoseconds, ratios, baseline, threshold):
+    """Compare relative results with baseline, return lines of report and 
+    names of benchmarks regressed beyond threshold percent
+
+    """
+    lines = ['{:<26} {:>10} {:>10} {:>10} {:>9}'.format(
+        'benchmark', 'ns/op', 'relative', 'baseline', 'change',
+    )]
+    regressions = []
+    for name, _ in BENCHMARKS:
+        if name not in ratios:
+            continue
+        value = ratios[name]
+        base = baseline.get(name)
+        change = '-'
+        if base:
+            percent = (value - base) / base * 100
+            change = '{:+.1f}%'.format(percent)
+            if percent > threshold:
+                regressions.append(name)
+                change += ' !'
+        lines.append('{:<26} {:>10} {:>10} {:>10} {:>9}'.format(
+            name, nanoseconds[name], value, base or '-', change,
+        ))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', action='append', help='benchmark to run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=20.0,
+        help='percentage of slowdown considered as a regression',
+    )
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument(
+        '--record',
+        action='store_true',
+        help='save results as the new baseline',
+    )
+    args = parser.parse_args(argv)
+
+    nanoseconds, ratios = run(names=args.only, repeat=args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)['relative']
+    lines, regressions = check(nanoseconds, ratios, baseline, args.threshold)
+    print('\n'.join(lines))
+    if args.record:
+        with open(args.baseline, 'wb') as baseline_file:
+            json.dump(
+                dict(
+                    python=sys.version.split()[0],
+                    nanoseconds=nanoseconds,
+                    relative=ratios,
+                ),
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+                separators=(',', ': '),
+            )
+            baseline_file.write(b'\n')
+        return 0
+    if regressions:
+        print('Regressed beyond {}%: {}'.format(
+            args.threshold,
+            ', '.join(regressions),
+        ))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,49 @@
 from .api import BillyAPI
+from .api import ThreadedBillyAPI
 from .api import BillyError
 from .api import NotFoundError
 from .api import DuplicateExternalIDError
+from .api import CircuitOpenError
+from .api import BillyTimeoutError
 from .api import Company
 from .api import Customer
 from .api import Plan
 from .api import Subscription
 from .api import Invoice
 from .api import Transaction
+from .api import InvoiceResult
+from .api import ResourceCache
+from .api import CompactResource
+from .api import RetryPolicy
+from .api import NO_RETRY
+from .api import RateLimiter
+from .api import CircuitBreaker
+from .api import RequestEvent
+from .api import PageEvent
+from .metrics import MetricsRegistry
 
 __all__ = [
     BillyAPI,
+    ThreadedBillyAPI,
     BillyError,
     NotFoundError,
     DuplicateExternalIDError,
+    CircuitOpenError,
+    BillyTimeoutError,
     Company,
     Customer,
     Plan,
     Subscription,
     Invoice,
     Transaction,
+    InvoiceResult,
+    ResourceCache,
+    CompactResource,
+    RetryPolicy,
+    NO_RETRY,
+    RateLimiter,
+    CircuitBreaker,
+    RequestEvent,
+    PageEvent,
+    MetricsRegistry,
 ]
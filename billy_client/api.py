@@ -1,7 +1,20 @@
 from __future__ import unicode_literals
+import sys
+import time
+import random
 import logging
+import datetime
+import collections
+import contextlib
+import json
+import operator
+import itertools
 import urlparse
 import urllib
+import email.utils
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
 
 import requests
 
@@ -24,15 +37,703 @@ class DuplicateExternalIDError(BillyError):
     """
 
 
+class BillyTimeoutError(BillyError):
+    """Request timed out, or the deadline of the operation was exceeded
+
+    """
+
+
+class CircuitOpenError(BillyError):
+    """Request refused without being sent because the circuit breaker is 
+    open
+
+    """
+
+
+def _bounded_map(func, iterable, workers, window=None, ordered=True):
+    """Call func with every element of iterable on a pool of worker threads 
+    and yield the results, in the order of iterable when ordered is True, 
+    otherwise in the order they are done. No more than window elements are 
+    taken from iterable ahead of the consumer, so that a slow consumer or a 
+    huge iterable doesn't pile up pending calls and results in memory. If 
+    func raises, the exception is raised to the consumer
+
+    """
+    if window is None:
+        window = workers * 2
+    pool = ThreadPool(workers)
+    done = Queue.Queue()
+    iterator = iter(iterable)
+    buffered = {}
+    submitted = 0
+    yielded = 0
+    exhausted = False
+
+    def run(index, element):
+        try:
+            done.put((index, True, func(element)))
+        except Exception:
+            done.put((index, False, sys.exc_info()))
+
+    try:
+        while True:
+            while not exhausted and submitted - yielded < window:
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pool.apply_async(run, (submitted, element))
+                submitted += 1
+            if exhausted and yielded == submitted:
+                break
+            if ordered and yielded in buffered:
+                ok, value = buffered.pop(yielded)
+            else:
+                index, ok, value = done.get()
+                if ordered and index != yielded:
+                    buffered[index] = (ok, value)
+                    continue
+            yielded += 1
+            if not ok:
+                raise value[0], value[1], value[2]
+            yield value
+    finally:
+        pool.terminate()
+
+
+def _get_validators(resp):
+    """Get cache validators from the headers of a response
+
+    """
+    validators = {}
+    etag = resp.headers.get('ETag')
+    if etag:
+        validators['etag'] = etag
+    last_modified = resp.headers.get('Last-Modified')
+    if last_modified:
+        validators['last_modified'] = last_modified
+    return validators
+
+
+class _JSONStream(object):
+    """Incremental reader of JSON text from chunks of a response, only the 
+    data not consumed yet and the latest chunk are kept in memory
+
+    """
+
+    WHITESPACE = b' \t\r\n'
+    DELIMITERS = WHITESPACE + b',:]}'
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """Skip whitespaces and return the next character
+
+        """
+        while True:
+            buffer = self.buffer
+            while self.pos < len(buffer) and buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(buffer):
+                return buffer[self.pos]
+            if not self._read_more():
+                raise ValueError('Unexpected end of JSON data')
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars, and 
+        return it
+
+        """
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(
+                'Expected one of {!r} at {}, got {!r}'
+                .format(chars, self.pos, char)
+            )
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next JSON value
+
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self._read_more():
+                    raise
+                continue
+            # a number could be cut in the middle by the end of buffer, make 
+            # sure the value is followed by a delimiter
+            complete = end < len(self.buffer) and self.buffer[end] in self.DELIMITERS
+            if not complete and self._read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_json_items(chunks, meta, key='items'):
+    """Decode a JSON object from chunks of text incrementally, yield each 
+    element of the array under key as soon as it's decoded, and put the 
+    other members of the object into meta
+
+    """
+    stream = _JSONStream(chunks)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        name = stream.value()
+        stream.expect(':')
+        if name == key:
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        else:
+            meta[name] = stream.value()
+        if stream.expect(',}') == '}':
+            break
+
+
+def _has_link(page):
+    """Whether a page result tells where the next page is
+
+    """
+    return 'next_url' in page or 'next_cursor' in page
+
+
+class _RecentSet(object):
+    """Set which only remembers the latest maxlen elements added
+
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._elements = set()
+        self._order = collections.deque()
+
+    def __contains__(self, element):
+        return element in self._elements
+
+    def add(self, element):
+        if element in self._elements:
+            return
+        self._elements.add(element)
+        self._order.append(element)
+        if len(self._order) > self.maxlen:
+            self._elements.discard(self._order.popleft())
+
+
+class InvoiceResult(
+    collections.namedtuple('InvoiceResult', ['spec', 'status', 'invoice', 'error'])
+):
+    """Outcome of one invoice spec submitted by :meth:`BillyAPI.invoice_many`
+
+    """
+
+    #: The invoice was created
+    STATUS_CREATED = 'created'
+    #: An invoice with the same external ID already exists
+    STATUS_DUPLICATE = 'duplicate'
+    #: Failed to create the invoice
+    STATUS_ERROR = 'error'
+
+
+class RequestEvent(
+    collections.namedtuple('RequestEvent', [
+        'method_name', 'http_method', 'url_template', 'url', 'retries', 
+        'status', 'latency', 'request_size', 'response_size', 'error',
+    ])
+):
+    """Payload of before_request, after_response and on_error hooks. 
+    method_name is the logical operation, e.g. get_customer, url_template is 
+    the path with guids replaced by {guid}, retries is the number of 
+    attempts made before this one. status, latency (in seconds), 
+    response_size and error are None when they are not known yet or not 
+    applicable
+
+    """
+
+
+class PageEvent(
+    collections.namedtuple('PageEvent', [
+        'method_name', 'url', 'offset', 'limit', 'count', 'latency', 'size',
+    ])
+):
+    """Payload of on_page hooks, count is the number of records in the page, 
+    latency is the time spent on fetching it in seconds, and size is the 
+    size of response body in bytes if known
+
+    """
+
+
+class ResourceCache(object):
+    """In-memory cache of records fetched by guid, keyed by resource class 
+    and guid. The least recently used records are evicted when there are 
+    more than max_size of them, and records expire after the TTL (in 
+    seconds) given for their class in ttls, or default_ttl if the class is 
+    not in it. A TTL of None means the records never expire
+
+    """
+
+    #: Default max number of cached records
+    DEFAULT_MAX_SIZE = 1000
+    #: Default TTL in seconds
+    DEFAULT_TTL = 60
+
+    def __init__(
+        self, 
+        max_size=DEFAULT_MAX_SIZE, 
+        ttls=None, 
+        default_ttl=DEFAULT_TTL,
+        timer=time.time,
+    ):
+        self.max_size = max_size
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._records = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, resource_cls, guid):
+        """Get cached record, return None if there is no such record or it 
+        is expired
+
+        """
+        key = (resource_cls, guid)
+        with self._lock:
+            entry = self._records.pop(key, None)
+            if entry is None or (
+                entry[0] is not None and entry[0] <= self.timer()
+            ):
+                self.misses += 1
+                return None
+            # move to the most recently used end
+            self._records[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, record):
+        """Put a record into the cache
+
+        """
+        resource_cls = type(record)
+        if issubclass(resource_cls, CompactResource):
+            resource_cls = resource_cls.RESOURCE_CLS
+        ttl = self.ttls.get(resource_cls, self.default_ttl)
+        expires_at = None if ttl is None else self.timer() + ttl
+        key = (resource_cls, record.guid)
+        with self._lock:
+            self._records.pop(key, None)
+            self._records[key] = (expires_at, record)
+            while len(self._records) > self.max_size:
+                self._records.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, resource_cls, guid):
+        """Remove a record from the cache
+
+        """
+        with self._lock:
+            self._records.pop((resource_cls, guid), None)
+
+    def clear(self):
+        """Remove all records from the cache
+
+        """
+        with self._lock:
+            self._records.clear()
+
+    def stats(self):
+        """Return hit, miss and eviction counts and current size
+
+        """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._records),
+            )
+
+
+class RetryPolicy(object):
+    """Policy of retrying requests failed with connection errors or 
+    retryable status codes. The delay before the nth retry is a random 
+    value between zero and backoff * 2 ** (n - 1), capped by max_backoff 
+    (full jitter), unless the server tells how long to wait with 
+    Retry-After. No more retry is made after max_attempts attempts, or when 
+    the total time of the request including next delay would exceed budget 
+    seconds. Requests which are not safe to repeat are only retried when 
+    the server refused to process them (429 Too Many Requests)
+
+    """
+
+    #: Default status codes to retry
+    DEFAULT_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+    #: Status codes which mean the request was not processed
+    REFUSED_STATUSES = frozenset([429])
+
+    def __init__(
+        self, 
+        max_attempts=3, 
+        backoff=0.5, 
+        max_backoff=30,
+        budget=60,
+        retry_statuses=DEFAULT_RETRY_STATUSES,
+        sleep=time.sleep,
+        random=random.random,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.retry_statuses = retry_statuses
+        self.sleep = sleep
+        self.random = random
+
+    def should_retry(self, attempt, idempotent, resp=None, error=None):
+        """Determine whether to retry after given attempt failed with a 
+        response or a connection error
+
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if resp is not None:
+            if resp.status_code not in self.retry_statuses:
+                return False
+            return idempotent or resp.status_code in self.REFUSED_STATUSES
+        return idempotent and isinstance(
+            error, 
+            (requests.ConnectionError, requests.Timeout),
+        )
+
+    def _retry_after(self, resp):
+        """Get seconds to wait from Retry-After header of response, return 
+        None if there is no such header
+
+        """
+        value = resp.headers.get('Retry-After')
+        if not isinstance(value, basestring):
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+    def delay(self, attempt, resp=None):
+        """Get seconds to wait before retrying after given attempt
+
+        """
+        if resp is not None and resp.status_code in (429, 503):
+            retry_after = self._retry_after(resp)
+            if retry_after is not None:
+                return retry_after
+        upper = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return self.random() * upper
+
+    def wait(self, attempt, started, resp=None, deadline=None):
+        """Sleep before retrying, return False without sleeping if the 
+        budget or the deadline would be exceeded
+
+        """
+        delay = self.delay(attempt, resp)
+        if self.budget is not None:
+            if time.time() - started + delay > self.budget:
+                return False
+        if deadline is not None and delay >= deadline.remaining():
+            return False
+        self.sleep(delay)
+        return True
+
+
+#: Retry policy which never retries
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allows rate requests per second on average 
+    and bursts of up to burst requests
+
+    """
+
+    def __init__(self, rate, burst=1, timer=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.timer = timer
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated_at = timer()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket, return the seconds to wait before 
+        they are available. The tokens are taken even if they are not 
+        available yet, so that waiting callers are served in order
+
+        """
+        with self._lock:
+            now = self.timer()
+            elapsed = max(0, now - self._updated_at)
+            self._tokens = min(
+                self.burst, 
+                self._tokens + elapsed * self.rate,
+            )
+            self._updated_at = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available and take them, return True. If 
+        they are not available in timeout seconds, give them back and return 
+        False without waiting
+
+        """
+        delay = self.reserve(tokens)
+        if timeout is not None and delay > timeout:
+            with self._lock:
+                self._tokens += tokens
+            return False
+        if delay > 0:
+            self.sleep(delay)
+        return True
+
+
+class CircuitBreaker(object):
+    """Circuit breaker trips open when failure_threshold (a ratio) of the 
+    latest window requests failed, once there were at least min_requests of 
+    them. Requests failing with connection errors or 5xx status codes are 
+    failures, so are requests slower than slow_threshold seconds if it's 
+    given. While open, requests fail fast with :class:`CircuitOpenError`. 
+    After reset_timeout seconds it becomes half-open and lets up to probes 
+    requests through at the same time, it's closed again if they succeed, 
+    otherwise opened again. Outcomes of requests allowed before the latest 
+    state change are ignored, so a slow request sent while closed cannot 
+    close the circuit by finishing during the half-open probes
+
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self, 
+        failure_threshold=0.5, 
+        min_requests=10, 
+        window=20,
+        slow_threshold=None,
+        reset_timeout=30,
+        probes=1,
+        timer=time.time,
+    ):
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.slow_threshold = slow_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.timer = timer
+        self.state = self.CLOSED
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._probing = 0
+        self._probe_successes = 0
+        # increased on every state change
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        self._generation += 1
+
+    def _open(self):
+        self._set_state(self.OPEN)
+        self._opened_at = self.timer()
+        self._probing = 0
+        self._probe_successes = 0
+
+    def _close(self):
+        self._set_state(self.CLOSED)
+        self._outcomes.clear()
+
+    def before_request(self, method_name):
+        """Check whether a request is allowed, raise 
+        :class:`CircuitOpenError` if it's not. Return a token to pass to 
+        :meth:`record` or :meth:`release` once the request is done
+
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return self._generation
+            if self.state == self.OPEN:
+                if self.timer() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(
+                        'Circuit open, refused to process {}'
+                        .format(method_name)
+                    )
+                self._set_state(self.HALF_OPEN)
+            if self._probing >= self.probes:
+                raise CircuitOpenError(
+                    'Circuit half-open, refused to process {}'
+                    .format(method_name)
+                )
+            self._probing += 1
+            return self._generation
+
+    def release(self, token):
+        """Release an allowed request without recording its outcome, e.g. 
+        when it failed for a reason unrelated to the server
+
+        """
+        with self._lock:
+            if token == self._generation and self.state == self.HALF_OPEN:
+                self._probing -= 1
+
+    def record(self, token, failed, elapsed):
+        """Record the outcome of an allowed request with the token 
+        :meth:`before_request` returned
+
+        """
+        if self.slow_threshold is not None and elapsed > self.slow_threshold:
+            failed = True
+        with self._lock:
+            if token != self._generation or self.state == self.OPEN:
+                return
+            if self.state == self.HALF_OPEN:
+                self._probing -= 1
+                if failed:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self._close()
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) < self.min_requests:
+                return
+            failures = sum(self._outcomes)
+            if failures >= self.failure_threshold * len(self._outcomes):
+                self._open()
+
+
+class RateLimiter(object):
+    """Client-side rate limiter with token buckets for reads (GET) and 
+    writes (other methods). Writes share the read bucket if write_rate is 
+    None. It can be shared by multiple API objects and threads
+
+    """
+
+    def __init__(
+        self, 
+        rate, 
+        burst=1, 
+        write_rate=None, 
+        write_burst=1,
+        timer=time.time,
+        sleep=time.sleep,
+    ):
+        self.read_bucket = TokenBucket(rate, burst, timer=timer, sleep=sleep)
+        if write_rate is None:
+            self.write_bucket = self.read_bucket
+        else:
+            self.write_bucket = TokenBucket(
+                write_rate, 
+                write_burst, 
+                timer=timer, 
+                sleep=sleep,
+            )
+
+    def acquire(self, method, timeout=None):
+        """Block until a request with given HTTP method is allowed and return 
+        True, or return False if it's not allowed in timeout seconds
+
+        """
+        if method == 'GET':
+            return self.read_bucket.acquire(timeout=timeout)
+        return self.write_bucket.acquire(timeout=timeout)
+
+
+class _Deadline(object):
+    """Point of time an operation must finish by
+
+    """
+
+    def __init__(self, timeout, timer=time.time):
+        self.timer = timer
+        self.expires_at = timer() + timeout
+
+    def remaining(self):
+        return self.expires_at - self.timer()
+
+    @classmethod
+    def earliest(cls, *deadlines):
+        deadlines = [d for d in deadlines if d is not None]
+        if not deadlines:
+            return None
+        return min(deadlines, key=lambda d: d.expires_at)
+
+
+def _cap_timeout(timeout, remaining):
+    """Cap a requests timeout, a number or a (connect, read) tuple, by the 
+    remaining seconds of a deadline
+
+    """
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(
+            remaining if t is None else min(t, remaining) for t in timeout
+        )
+    return min(timeout, remaining)
+
+
 class Resource(object):
     """Resource object from the billy server
 
     """
+    # attributes are kept in slots, the __dict__ is only allocated when 
+    # something else is assigned to the object
+    __slots__ = ('api', 'json_data', 'validators', '__dict__')
+
     BASE_URI = None
 
-    def __init__(self, api, json_data):
+    def __init__(self, api, json_data, validators=None):
         self.api = api
         self.json_data = json_data
+        #: cache validators (ETag and Last-Modified) of the response
+        self.validators = validators
 
     def __unicode__(self):
         return str(self)
@@ -47,14 +748,49 @@ class Resource(object):
         try:
             return self.json_data[key]
         except KeyError:
-            return super(Resource. self).__getattre__(key)
+            raise AttributeError(key)
 
-    def _list_resources(self, resource_cls, resource_path, external_id=None):
-        """List relative resources under of resource
+    def refresh(self):
+        """Fetch this record from the server again and update json_data, 
+        return whether it is changed. If the last response had ETag or 
+        Last-Modified, a conditional request is made, and the data is kept 
+        as it is when the server replies 304 Not Modified
 
         """
         assert self.BASE_URI is not None
+        url = self.api._url_for('{}/{}'.format(self.BASE_URI, self.guid))
         kwargs = {}
+        validators = self.validators or {}
+        headers = {}
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+        if headers:
+            kwargs['headers'] = headers
+        resp = self.api._request('GET', url, 'refresh', **kwargs)
+        if resp.status_code == requests.codes.not_modified:
+            return False
+        self.api._check_response('refresh', resp)
+        json_data = resp.json()
+        changed = json_data != self.json_data
+        self.json_data = json_data
+        self.validators = _get_validators(resp)
+        self.api._cache_set(self)
+        return changed
+
+    def _list_resources(
+        self, 
+        resource_cls, 
+        resource_path, 
+        external_id=None, 
+        **kwargs
+    ):
+        """List relative resources under of resource, extra keyword arguments 
+        are passed to :class:`Page`
+
+        """
+        assert self.BASE_URI is not None
         if external_id:
             kwargs['extra_query'] = dict(external_id=external_id)
         return Page(
@@ -68,38 +804,567 @@ class Resource(object):
 
 
 class Page(object):
-    """Object for iterating over records via API
+    """Object for iterating over records via API, when prefetch is given, up 
+    to that many following pages are fetched on a background thread while 
+    the records of the current page are being consumed
+
+    When workers is greater than 1, the remaining pages are fetched 
+    concurrently by that many threads once the first page is known, records 
+    are yielded in order, or as soon as their page arrives if ordered is 
+    False. This takes precedence over prefetch
+
+    When stream is True, responses are read in chunks and each record is 
+    yielded as soon as it is decoded, instead of decoding whole pages first, 
+    so that memory usage is bounded by one record rather than one page. It 
+    cannot be used together with prefetch or workers
+
+    The number of records per request is page_size, or the server default 
+    if it's None. When adaptive is True, the page size is adjusted after 
+    each page, grown or shrunk by up to a factor of 2, so that each request 
+    takes about target_time seconds and its response body is no larger than 
+    max_page_bytes, within min_page_size and max_page_size. Parallel 
+    fetching uses the size of the first page for all pages
+
+    Records can also be accessed randomly, page[start:stop] fetches records 
+    in the range starting from offset start directly, and page[index] 
+    fetches a single record. count() returns the total number of records 
+    reported by server with a minimal request. Negative indexes or open 
+    ended slices cost one extra request for the count
+
+    The position of iteration is available as a serializable cursor, a dict 
+    of url, extra_query, offset, limit and done, where offset is the offset 
+    of the first record which is not consumed yet, and done tells the last 
+    page of linked pages is consumed. If checkpoint is given, it is called 
+    with the cursor every time all records of a page are consumed. A page 
+    can be created from a saved cursor with :meth:`from_cursor` to resume 
+    the iteration, or by passing the offset to start from. A page created 
+    with done set to True yields no records
+
+    When the server provides a `next_url` link or a `next_cursor` keyset 
+    cursor in page results, they are followed instead of offsets, and 
+    iteration stops when they are null. Otherwise, because records inserted 
+    during iteration shift the offsets, records already seen among the 
+    latest dedupe_window ones are skipped by guid. Set dedupe_window to 0 to 
+    turn it off
+
+    If timeout is given, iterating over all records, counting or indexing 
+    must finish in timeout seconds, otherwise :class:`BillyTimeoutError` is 
+    raised. The deadline of :meth:`BillyAPI.deadline` applies as well
 
     """
 
-    def __init__(self, api, url, resource_cls, extra_query=None, logger=None):
+    #: Size of chunks to read from response in stream mode
+    STREAM_CHUNK_SIZE = 8192
+    #: Default target time of a page request in adaptive mode
+    DEFAULT_TARGET_TIME = 0.5
+    #: Default minimum page size in adaptive mode
+    DEFAULT_MIN_PAGE_SIZE = 1
+    #: Default maximum page size in adaptive mode
+    DEFAULT_MAX_PAGE_SIZE = 1000
+    #: Default number of latest guids to remember for skipping duplicates
+    DEFAULT_DEDUPE_WINDOW = 10000
+
+    def __init__(
+        self, 
+        api, 
+        url, 
+        resource_cls, 
+        extra_query=None, 
+        logger=None, 
+        prefetch=0,
+        workers=1,
+        ordered=True,
+        stream=False,
+        page_size=None,
+        adaptive=False,
+        target_time=DEFAULT_TARGET_TIME,
+        min_page_size=DEFAULT_MIN_PAGE_SIZE,
+        max_page_size=DEFAULT_MAX_PAGE_SIZE,
+        max_page_bytes=None,
+        offset=None,
+        checkpoint=None,
+        dedupe_window=DEFAULT_DEDUPE_WINDOW,
+        timeout=None,
+        done=False,
+    ):
+        if stream and (prefetch or workers > 1):
+            raise ValueError('stream cannot be used with prefetch or workers')
+        if checkpoint is not None and not ordered:
+            raise ValueError('checkpoint cannot be used with unordered pages')
         self.logger = logger or logging.getLogger(__name__)
         self.api = api
         self.url = url
         self.resource_cls = resource_cls
+        #: name of the operation for errors, e.g. list_invoices
+        self.method_name = 'list_{}s'.format(resource_cls.__name__.lower())
         self.extra_query = extra_query
+        self.prefetch = prefetch
+        self.workers = workers
+        self.ordered = ordered
+        self.stream = stream
+        self.page_size = page_size
+        self.adaptive = adaptive
+        self.target_time = target_time
+        self.min_page_size = min_page_size
+        self.max_page_size = max_page_size
+        self.max_page_bytes = max_page_bytes
+        self.offset = offset
+        self.done = done
+        self.checkpoint = checkpoint
+        #: offset of the next record to be consumed
+        self.position = offset or 0
+        #: limit of the latest page
+        self.limit = page_size
+        self.dedupe_window = dedupe_window
+        self.timeout = timeout
+        # the URL and query of next page given by server in keyset mode
+        self._link = None
+        # whether the server told there is no next page in keyset mode
+        self._finished = done
+        # deadline of current iteration, count or indexing
+        self._deadline = None
+
+    @classmethod
+    def from_cursor(cls, api, resource_cls, cursor, **kwargs):
+        """Create a page which resumes iteration from a cursor
 
-    def __iter__(self):
+        """
+        return cls(
+            api=api,
+            url=cursor['url'],
+            resource_cls=resource_cls,
+            extra_query=cursor['extra_query'],
+            offset=cursor['offset'],
+            page_size=cursor['limit'],
+            done=cursor.get('done', False),
+            **kwargs
+        )
+
+    @property
+    def cursor(self):
+        if self._finished:
+            # resuming from an offset would start over in keyset mode
+            return dict(
+                url=self.url,
+                extra_query=self.extra_query,
+                offset=None,
+                limit=self.limit,
+                done=True,
+            )
+        if self._link is not None:
+            url, query = self._link
+            return dict(
+                url=url,
+                extra_query=query,
+                offset=None,
+                limit=self.limit,
+                done=False,
+            )
+        return dict(
+            url=self.url,
+            extra_query=self.extra_query,
+            offset=self.position,
+            limit=self.limit,
+            done=False,
+        )
+
+    def _initial_query(self):
         data = self.extra_query.copy() if self.extra_query else {}
+        if self.offset:
+            data['offset'] = self.offset
+        if self.page_size is not None:
+            data['limit'] = self.page_size
+        return data
+
+    def _next_limit(self, limit, elapsed, size):
+        """Determine the limit of next page from the limit, elapsed time and 
+        response body size of last page
+
+        """
+        if not self.adaptive:
+            return limit
+        scale = self.target_time / max(elapsed, 0.001)
+        if self.max_page_bytes is not None and size:
+            scale = min(scale, float(self.max_page_bytes) / size)
+        scale = max(0.5, min(2.0, scale))
+        new_limit = int(limit * scale)
+        new_limit = max(self.min_page_size, min(self.max_page_size, new_limit))
+        self.logger.debug(
+            'Page size changed from %s to %s, elapsed=%.3f, size=%s', 
+            limit, 
+            new_limit,
+            elapsed,
+            size,
+        )
+        return new_limit
+
+    def _page_url(self, data, url=None):
+        self.logger.debug(
+            'Page for %s getting %s', 
+            self.resource_cls.__name__,
+            data,
+        )
+        query = urllib.urlencode(data)
+        return (url or self.url) + '?' + query
+
+    def _fetch(self, data, stats=None, url=None):
+        """Fetch one page with given query and return the JSON result, if 
+        stats is given, the size of response body is put into it
+
+        """
+        url = self._page_url(data, url)
+        started = time.time()
+        with self.api._using_deadline(self._deadline):
+            resp = self.api._request('GET', url, self.method_name)
+        self.api._check_response(self.method_name, resp)
+        if stats is not None:
+            stats['size'] = len(resp.content)
+        json_data = resp.json()
+        self.logger.debug('Page result %r', json_data)
+        if self.api.hooks['on_page']:
+            self.api._emit('on_page', PageEvent(
+                method_name=self.method_name,
+                url=url,
+                offset=json_data.get('offset'),
+                limit=json_data.get('limit'),
+                count=len(json_data['items']),
+                latency=time.time() - started,
+                size=len(resp.content),
+            ))
+        return json_data
+
+    def _link_request(self, url, data, page):
+        """Get the URL and query of next page from the next_url or 
+        next_cursor in page, return None if there is no next page
+
+        """
+        next_url = page.get('next_url')
+        if next_url:
+            next_url = urlparse.urljoin(url, next_url)
+            base, _, query = next_url.partition('?')
+            return base, dict(urlparse.parse_qsl(query))
+        next_cursor = page.get('next_cursor')
+        if next_cursor:
+            query = data.copy()
+            query.pop('offset', None)
+            query['cursor'] = next_cursor
+            return url, query
+        return None
+
+    def _next_request(self, url, data, page, elapsed, size):
+        """Get the URL and query of next page, return None if there is no 
+        next page
+
+        """
+        if _has_link(page):
+            return self._link_request(url, data, page)
+        query = data.copy()
+        query['offset'] = page['offset'] + page['limit']
+        query['limit'] = self._next_limit(page['limit'], elapsed, size)
+        return url, query
+
+    def _iter_pages(self, start=None):
+        """Iterate over JSON results of all non-empty pages, starting from 
+        the request start, a tuple of URL and query
+
+        """
+        url, data = start or (self.url, self._initial_query())
+        while True:
+            stats = {} if self.adaptive else None
+            started = time.time()
+            json_data = self._fetch(data, stats, url)
+            elapsed = time.time() - started
+            if not json_data['items']:
+                break
+            yield json_data
+            next_request = self._next_request(
+                url, 
+                data, 
+                json_data, 
+                elapsed, 
+                stats and stats['size'],
+            )
+            if next_request is None:
+                break
+            url, data = next_request
+
+    def _iter_streamed_pages(self):
+        """Iterate over pages like _iter_pages, but the items of each page is 
+        a generator decoding records from the response stream. The next page 
+        is requested after all items of current page are consumed
+
+        """
+        url, data = self.url, self._initial_query()
         while True:
+            started = time.time()
+            with self.api._using_deadline(self._deadline):
+                resp = self.api._request(
+                    'GET', 
+                    self._page_url(data, url), 
+                    self.method_name, 
+                    stream=True,
+                )
+            self.api._check_response(self.method_name, resp)
+            page = {}
+            # time spent on reading the response, excluding the time spent 
+            # by consumer on the records
+            counter = dict(count=0, size=0, elapsed=time.time() - started)
+
+            def iter_chunks(chunks):
+                while True:
+                    started = time.time()
+                    chunk = next(chunks, None)
+                    counter['elapsed'] += time.time() - started
+                    if chunk is None:
+                        break
+                    counter['size'] += len(chunk)
+                    yield chunk
+
+            def iter_items(items):
+                for item in items:
+                    counter['count'] += 1
+                    yield item
+
+            try:
+                chunks = iter(resp.iter_content(self.STREAM_CHUNK_SIZE))
+                page['items'] = iter_items(_iter_json_items(
+                    iter_chunks(chunks), 
+                    page,
+                ))
+                yield page
+                # make sure the whole page is read
+                for _ in page['items']:
+                    pass
+            finally:
+                resp.close()
             self.logger.debug(
-                'Page for %s getting %s', 
-                self.resource_cls.__name__,
-                data,
+                'Page result offset=%s, limit=%s, %s items', 
+                page.get('offset'), 
+                page.get('limit'), 
+                counter['count'],
             )
-            query = urllib.urlencode(data)
-            url = self.url + '?' + query
-            resp = requests.get(url, **self.api._auth_args())
-            json_data = resp.json()
-            self.logger.debug('Page result %r', json_data)
-            # TODO: we should improve the API to make iteration more efficient
-            #       add a next_url field or something like that
-            if not json_data['items']:
+            if self.api.hooks['on_page']:
+                self.api._emit('on_page', PageEvent(
+                    method_name=self.method_name,
+                    url=self._page_url(data, url),
+                    offset=page.get('offset'),
+                    limit=page.get('limit'),
+                    count=counter['count'],
+                    latency=counter['elapsed'],
+                    size=counter['size'],
+                ))
+            if not counter['count']:
+                break
+            next_request = self._next_request(
+                url, 
+                data, 
+                page, 
+                counter['elapsed'], 
+                counter['size'],
+            )
+            if next_request is None:
+                break
+            url, data = next_request
+
+    def _iter_prefetched_pages(self):
+        """Iterate over pages like _iter_pages, but run the fetching on a 
+        background thread which stays up to `prefetch` pages ahead
+
+        """
+        pages = Queue.Queue(self.prefetch)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for json_data in self._iter_pages():
+                    if not put((True, json_data)):
+                        return
+            except Exception:
+                put((False, sys.exc_info()))
+            else:
+                put((True, None))
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                ok, value = pages.get()
+                if not ok:
+                    raise value[0], value[1], value[2]
+                if value is None:
+                    break
+                yield value
+        finally:
+            stopped.set()
+
+    def _iter_parallel_pages(self):
+        """Iterate over pages, fetch the first one, then fan out the 
+        remaining offset windows to `workers` threads. The end of collection 
+        is the `total` reported by the server if there is one, otherwise it 
+        is found by the first short page. If the server links pages, they 
+        are followed sequentially instead
+
+        """
+        data = self._initial_query()
+        json_data = self._fetch(data)
+        if not json_data['items']:
+            return
+        yield json_data
+        if _has_link(json_data):
+            next_request = self._link_request(self.url, data, json_data)
+            if next_request is not None:
+                for page in self._iter_pages(next_request):
+                    yield page
+            return
+        limit = json_data['limit']
+        # use a dict so that the offsets generator sees the updates
+        state = dict(end=json_data.get('total'))
+        if len(json_data['items']) < limit:
+            state['end'] = json_data['offset'] + len(json_data['items'])
+
+        def iter_offsets():
+            offset = json_data['offset'] + limit
+            while state['end'] is None or offset < state['end']:
+                yield offset
+                offset += limit
+
+        def fetch(offset):
+            query = data.copy()
+            query['offset'] = offset
+            query['limit'] = limit
+            return self._fetch(query)
+
+        pages = _bounded_map(
+            fetch, 
+            iter_offsets(), 
+            workers=self.workers,
+            ordered=self.ordered,
+        )
+        for page in pages:
+            items = page['items']
+            if len(items) < limit:
+                end = page['offset'] + len(items)
+                if state['end'] is None or end < state['end']:
+                    state['end'] = end
+            if items:
+                yield page
+
+    def _start_deadline(self):
+        self._deadline = self.api._make_deadline(self.timeout)
+
+    def count(self):
+        """Return the total number of records reported by server
+
+        """
+        self._start_deadline()
+        return self._count()
+
+    def _count(self):
+        data = self._initial_query()
+        data['limit'] = 1
+        json_data = self._fetch(data)
+        if 'total' not in json_data:
+            raise BillyError(
+                'Server did not report total count of {}'
+                .format(self.resource_cls.__name__)
+            )
+        return json_data['total']
+
+    def _fetch_range(self, start, stop):
+        """Fetch records from offset start to stop, more than one request is 
+        made only if server returns fewer records than asked
+
+        """
+        resource_cls = self.api._record_cls(self.resource_cls)
+        data = self._initial_query()
+        records = []
+        offset = start
+        while offset < stop:
+            data['offset'] = offset
+            data['limit'] = stop - offset
+            json_data = self._fetch(data)
+            items = json_data['items'][:stop - offset]
+            if not items:
                 break
+            for item in items:
+                records.append(resource_cls(self.api, item))
+            offset += len(items)
+        return records
+
+    def __getitem__(self, key):
+        self._start_deadline()
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError('Slice step is not supported')
+            start = key.start or 0
+            stop = key.stop
+            if start < 0 or stop is None or stop < 0:
+                start, stop, _ = key.indices(self._count())
+            return self._fetch_range(start, stop)
+        index = key
+        if index < 0:
+            index += self._count()
+        records = self._fetch_range(index, index + 1) if index >= 0 else []
+        if not records:
+            raise IndexError('Page index out of range')
+        return records[0]
+
+    def __iter__(self):
+        self._start_deadline()
+        self._link = None
+        self._finished = self.done
+        if self.done:
+            return
+        if self.stream:
+            pages = self._iter_streamed_pages()
+        elif self.workers > 1:
+            pages = self._iter_parallel_pages()
+        elif self.prefetch:
+            pages = self._iter_prefetched_pages()
+        else:
+            pages = self._iter_pages()
+        resource_cls = self.api._record_cls(self.resource_cls)
+        self.position = self.offset or 0
+        seen = _RecentSet(self.dedupe_window) if self.dedupe_window else None
+        keyset = False
+        for json_data in pages:
+            page_start = self.position
+            # in stream mode, whether the page has links is only known after 
+            # the items are read, so it's decided by previous pages
+            dedupe = seen is not None and not keyset
             for item in json_data['items']:
-                yield self.resource_cls(self.api, item)
-            data['offset'] = json_data['offset'] + json_data['limit']
-            data['limit'] = json_data['limit']
+                if dedupe:
+                    guid = item.get('guid')
+                    if guid is not None:
+                        if guid in seen:
+                            self.position += 1
+                            continue
+                        seen.add(guid)
+                yield resource_cls(self.api, item)
+                self.position += 1
+            # in stream mode, limit is only known after the items are read, 
+            # and the last empty page is yielded as well
+            self.limit = json_data.get('limit', self.limit)
+            if _has_link(json_data):
+                keyset = True
+                self._link = self._link_request(
+                    self.url, 
+                    self.extra_query or {}, 
+                    json_data,
+                )
+                self._finished = self._link is None
+            if self.checkpoint is not None and self.position != page_start:
+                self.checkpoint(self.cursor)
 
 
 class Company(Resource):
@@ -117,7 +1382,7 @@ class Company(Resource):
         data = {}
         if processor_uri is not None:
             data['processor_uri'] = processor_uri
-        resp = requests.post(url, data=data, **self.api._auth_args())
+        resp = self.api._request('POST', url, 'create_customer', data=data)
         self.api._check_response('create_customer', resp)
         return Customer(self.api, resp.json())
 
@@ -132,7 +1397,7 @@ class Company(Resource):
             amount=amount,
             interval=interval,
         )
-        resp = requests.post(url, data=data, **self.api._auth_args())
+        resp = self.api._request('POST', url, 'create_plan', data=data)
         self.api._check_response('create_plan', resp)
         return Plan(self.api, resp.json())
 
@@ -184,8 +1449,22 @@ class Customer(Resource):
         if adjustments is not None:
             params = self._encode_params('adjustment_', adjustments)
             data.update(params)
-        resp = requests.post(url, data=data, **self.api._auth_args())
+        # the server rejects a second invoice with the same external ID, so 
+        # it's safe to repeat the request
+        resp = self.api._request(
+            'POST', 
+            url, 
+            'invoice', 
+            idempotent=external_id is not None, 
+            data=data,
+        )
         if resp.status_code == requests.codes.conflict:
+            # a failed attempt before may have created the invoice on the 
+            # server, in that case the conflicting invoice is our own
+            if resp.attempts > 1:
+                invoices = self.list_invoices(external_id=external_id)
+                for invoice in invoices:
+                    return invoice
             raise DuplicateExternalIDError(
                 'Invoice with the same external ID of this customer already exists',
                 resp.status_code,
@@ -194,7 +1473,7 @@ class Customer(Resource):
         self.api._check_response('invoice', resp)
         return Invoice(self.api, resp.json())
 
-    def list_subscriptions(self, external_id=None):
+    def list_subscriptions(self, external_id=None, **kwargs):
         """List subscriptions
 
         """
@@ -202,9 +1481,10 @@ class Customer(Resource):
             resource_cls=Subscription, 
             resource_path='subscriptions',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_invoices(self, external_id=None):
+    def list_invoices(self, external_id=None, **kwargs):
         """List invoices
 
         """
@@ -212,9 +1492,10 @@ class Customer(Resource):
             resource_cls=Invoice, 
             resource_path='invoices',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_transactions(self, external_id=None):
+    def list_transactions(self, external_id=None, **kwargs):
         """List transactions
 
         """
@@ -222,6 +1503,7 @@ class Customer(Resource):
             resource_cls=Transaction, 
             resource_path='transactions',
             external_id=external_id,
+            **kwargs
         )
 
 
@@ -281,11 +1563,11 @@ class Plan(Resource):
             data['appears_on_statement_as'] = appears_on_statement_as 
         if started_at is not None:
             data['started_at'] = started_at.isoformat()
-        resp = requests.post(url, data=data, **self.api._auth_args())
+        resp = self.api._request('POST', url, 'subscribe', data=data)
         self.api._check_response('subscribe', resp)
         return Subscription(self.api, resp.json())
 
-    def list_customers(self, external_id=None):
+    def list_customers(self, external_id=None, **kwargs):
         """List customers
 
         """
@@ -293,9 +1575,10 @@ class Plan(Resource):
             resource_cls=Customer, 
             resource_path='customers',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_subscriptions(self, external_id=None):
+    def list_subscriptions(self, external_id=None, **kwargs):
         """List subscriptions
 
         """
@@ -303,9 +1586,10 @@ class Plan(Resource):
             resource_cls=Subscription, 
             resource_path='subscriptions',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_invoices(self, external_id=None):
+    def list_invoices(self, external_id=None, **kwargs):
         """List invoices
 
         """
@@ -313,9 +1597,10 @@ class Plan(Resource):
             resource_cls=Invoice, 
             resource_path='invoices',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_transactions(self, external_id=None):
+    def list_transactions(self, external_id=None, **kwargs):
         """List transactions
 
         """
@@ -323,6 +1608,7 @@ class Plan(Resource):
             resource_cls=Transaction, 
             resource_path='transactions',
             external_id=external_id,
+            **kwargs
         )
 
 
@@ -338,11 +1624,13 @@ class Subscription(Resource):
 
         """
         url = self.api._url_for('{}/{}/cancel'.format(self.BASE_URI, self.guid))
-        resp = requests.post(url, **self.api._auth_args())
+        resp = self.api._request('POST', url, 'cancel', idempotent=True)
         self.api._check_response('cancel', resp)
-        return Subscription(self.api, resp.json())
+        subscription = Subscription(self.api, resp.json())
+        self.api._cache_set(subscription)
+        return subscription
 
-    def list_invoices(self, external_id=None):
+    def list_invoices(self, external_id=None, **kwargs):
         """List invoices
 
         """
@@ -350,9 +1638,10 @@ class Subscription(Resource):
             resource_cls=Invoice, 
             resource_path='invoices',
             external_id=external_id,
+            **kwargs
         )
 
-    def list_transactions(self, external_id=None):
+    def list_transactions(self, external_id=None, **kwargs):
         """List transactions
 
         """
@@ -360,6 +1649,7 @@ class Subscription(Resource):
             resource_cls=Transaction, 
             resource_path='transactions',
             external_id=external_id,
+            **kwargs
         )
 
 
@@ -376,11 +1666,12 @@ class Invoice(Resource):
         """
         url = self.api._url_for('{}/{}/refund'.format(self.BASE_URI, self.guid))
         data = dict(amount=amount)
-        resp = requests.post(url, data=data, **self.api._auth_args())
+        resp = self.api._request('POST', url, 'refund', data=data)
         self.api._check_response('refund', resp)
+        self.api._cache_invalidate(Invoice, self.guid)
         return Subscription(self.api, resp.json())
 
-    def list_transactions(self, external_id=None):
+    def list_transactions(self, external_id=None, **kwargs):
         """List transactions
 
         """
@@ -388,6 +1679,7 @@ class Invoice(Resource):
             resource_cls=Transaction, 
             resource_path='transactions',
             external_id=external_id,
+            **kwargs
         )
 
 
@@ -396,6 +1688,289 @@ class Transaction(Resource):
 
     """
 
+    BASE_URI = '/v1/transactions'
+
+
+def _decode_datetime(value):
+    """Decode an ISO 8601 timestamp from billy server into a naive UTC 
+    datetime, the value is returned as it is if it's not in known formats
+
+    """
+    if not isinstance(value, basestring):
+        return value
+    text = value
+    for suffix in ['Z', '+00:00']:
+        if text.endswith(suffix):
+            text = text[:-len(suffix)]
+            break
+    for fmt in ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return value
+
+
+def _decode_amount(value):
+    """Decode an amount in cents into int
+
+    """
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+
+class _LazyField(object):
+    """Attribute of compact resource, which decodes the raw value on first 
+    access and keeps the result in a slot
+
+    """
+
+    def __init__(self, name, decode):
+        self.raw_name = str('_raw_' + name)
+        self.decoded_name = str('_decoded_' + name)
+        self.decode = decode
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.decoded_name)
+        except AttributeError:
+            pass
+        value = self.decode(getattr(obj, self.raw_name))
+        setattr(obj, self.decoded_name, value)
+        return value
+
+
+def _make_loader(raw_names):
+    """Generate a function which gets all fields of a record at once and 
+    assigns them to their slots with plain attribute assignments, which is 
+    several times faster than setattr calls in a loop. KeyError is raised 
+    if a field is missing
+
+    """
+    if not raw_names:
+        return lambda self, json_data: None
+    # itemgetter of a single key returns the value instead of a tuple, so 
+    # the targets are only unpacked when there are more than one
+    source = 'def _load_fields(self, json_data):\n    {} = _get(json_data)'.format(
+        ', '.join('self.' + raw_name for _, raw_name in raw_names)
+    )
+    namespace = dict(_get=operator.itemgetter(
+        *[field for field, _ in raw_names]
+    ))
+    exec source in namespace
+    return namespace['_load_fields']
+
+
+class _CompactMeta(type):
+    """Metaclass of compact resources, generates slots for FIELDS, lazy 
+    decoding attributes for LAZY_FIELDS, and the function loading them
+
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        fields = attrs.get('FIELDS')
+        if fields is not None:
+            lazy_fields = attrs.get('LAZY_FIELDS', {})
+            slots = []
+            raw_names = {}
+            for field in fields:
+                if field in lazy_fields:
+                    field_attr = _LazyField(field, lazy_fields[field])
+                    attrs[field] = field_attr
+                    slots.extend([field_attr.raw_name, field_attr.decoded_name])
+                    raw_names[field] = field_attr.raw_name
+                else:
+                    slots.append(str(field))
+                    raw_names[field] = str(field)
+            attrs['__slots__'] = tuple(slots)
+            attrs['_RAW_NAMES'] = raw_names
+            attrs['_FIELD_COUNT'] = len(fields)
+            attrs['_load_fields'] = _make_loader(
+                [(field, raw_names[field]) for field in fields]
+            )
+            attrs['_DECODED_NAMES'] = tuple(
+                attrs[field].decoded_name for field in lazy_fields
+            )
+            attrs['RESOURCE_CLS'] = [
+                base for base in bases if not issubclass(base, CompactResource)
+            ][0]
+        return super(_CompactMeta, mcs).__new__(mcs, name, bases, attrs)
+
+
+class CompactResource(Resource):
+    """Compact resource, the known fields of the record are stored in slots 
+    instead of a dict, and timestamps and amounts are decoded on first 
+    access. Unknown fields are kept in a dict which is only created when 
+    there are some. Subclasses declare FIELDS and the decoders of 
+    LAZY_FIELDS
+
+    Copying fields into slots makes building a compact record several 
+    times slower than a dict-backed one, which only keeps a reference to 
+    the decoded JSON dict, so compact records trade some CPU time of 
+    iterating pages for much less memory held by records
+
+    """
+    __metaclass__ = _CompactMeta
+    __slots__ = ('_extra', )
+
+    #: Names of fields stored in slots
+    FIELDS = None
+    #: Decoders of fields to be decoded on first access
+    LAZY_FIELDS = {}
+    #: The dict-backed resource class of this compact one
+    RESOURCE_CLS = None
+
+    def __init__(self, api, json_data, validators=None):
+        self.api = api
+        self.validators = validators
+        self._load(json_data)
+
+    def _load(self, json_data):
+        try:
+            self._load_fields(json_data)
+        except KeyError:
+            pass
+        else:
+            if len(json_data) == self._FIELD_COUNT:
+                self._extra = None
+                return
+        # some fields are missing or unknown, go through them one by one
+        extra = None
+        for key, value in json_data.iteritems():
+            raw_name = self._RAW_NAMES.get(key)
+            if raw_name is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+            else:
+                setattr(self, raw_name, value)
+        self._extra = extra
+
+    def _reset(self):
+        for name in self._RAW_NAMES.values() + list(self._DECODED_NAMES):
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+
+    def __getattr__(self, key):
+        if not key.startswith('_'):
+            extra = self._extra
+            if extra is not None and key in extra:
+                return extra[key]
+        raise AttributeError(key)
+
+    @property
+    def json_data(self):
+        data = dict(self._extra) if self._extra else {}
+        for field, raw_name in self._RAW_NAMES.iteritems():
+            try:
+                data[field] = getattr(self, raw_name)
+            except AttributeError:
+                pass
+        return data
+
+    @json_data.setter
+    def json_data(self, json_data):
+        self._reset()
+        self._load(json_data)
+
+
+_TIMESTAMP_FIELDS = dict(
+    created_at=_decode_datetime,
+    updated_at=_decode_datetime,
+)
+
+
+class CompactCustomer(CompactResource, Customer):
+    """Compact customer entity object
+
+    """
+    FIELDS = (
+        'guid', 'company_guid', 'processor_uri', 'deleted', 
+        'created_at', 'updated_at',
+    )
+    LAZY_FIELDS = _TIMESTAMP_FIELDS
+
+
+class CompactPlan(CompactResource, Plan):
+    """Compact plan entity object
+
+    """
+    FIELDS = (
+        'guid', 'company_guid', 'plan_type', 'frequency', 'amount', 
+        'interval', 'deleted', 'created_at', 'updated_at',
+    )
+    LAZY_FIELDS = dict(_TIMESTAMP_FIELDS, amount=_decode_amount)
+
+
+class CompactSubscription(CompactResource, Subscription):
+    """Compact subscription entity object
+
+    """
+    FIELDS = (
+        'guid', 'plan_guid', 'customer_guid', 'funding_instrument_uri', 
+        'amount', 'effective_amount', 'appears_on_statement_as', 
+        'invoice_count', 'canceled', 'canceled_at', 'started_at', 
+        'next_invoice_at', 'created_at', 'updated_at',
+    )
+    LAZY_FIELDS = dict(
+        _TIMESTAMP_FIELDS,
+        amount=_decode_amount,
+        effective_amount=_decode_amount,
+        canceled_at=_decode_datetime,
+        started_at=_decode_datetime,
+        next_invoice_at=_decode_datetime,
+    )
+
+
+class CompactInvoice(CompactResource, Invoice):
+    """Compact invoice entity object
+
+    """
+    FIELDS = (
+        'guid', 'invoice_type', 'transaction_type', 'status', 
+        'customer_guid', 'subscription_guid', 'external_id', 'title', 
+        'amount', 'effective_amount', 'total_adjustment_amount', 
+        'funding_instrument_uri', 'appears_on_statement_as', 'items', 
+        'adjustments', 'scheduled_at', 'created_at', 'updated_at',
+    )
+    LAZY_FIELDS = dict(
+        _TIMESTAMP_FIELDS,
+        amount=_decode_amount,
+        effective_amount=_decode_amount,
+        total_adjustment_amount=_decode_amount,
+        scheduled_at=_decode_datetime,
+    )
+
+
+class CompactTransaction(CompactResource, Transaction):
+    """Compact transaction entity object
+
+    """
+    FIELDS = (
+        'guid', 'invoice_guid', 'transaction_type', 'submit_status', 
+        'status', 'amount', 'processor_uri', 'appears_on_statement_as', 
+        'failure_count', 'failures', 'created_at', 'updated_at',
+    )
+    LAZY_FIELDS = dict(_TIMESTAMP_FIELDS, amount=_decode_amount)
+
+
+#: Map resource classes to their compact classes
+COMPACT_CLASSES = {
+    Customer: CompactCustomer,
+    Plan: CompactPlan,
+    Subscription: CompactSubscription,
+    Invoice: CompactInvoice,
+    Transaction: CompactTransaction,
+}
+
 
 class BillyAPI(object):
     """Billy API is the object provides easy-to-use interface to Billy recurring
@@ -405,15 +1980,91 @@ class BillyAPI(object):
 
     DEFAULT_ENDPOINT = 'https://billing.balancedpayments.com'
 
+    #: Default number of per-host connection pools to cache
+    DEFAULT_POOL_CONNECTIONS = 10
+    #: Default number of keep-alive connections to keep in each pool
+    DEFAULT_POOL_MAXSIZE = 10
+    #: Default number of threads for concurrent bulk operations
+    DEFAULT_WORKERS = 10
+    #: Default connect and read timeouts in seconds
+    DEFAULT_TIMEOUT = (10, 60)
+    #: Names of events hooks can be added for
+    HOOK_EVENTS = ('before_request', 'after_response', 'on_error', 'on_page')
+
     def __init__(
         self, 
         api_key,
         endpoint=DEFAULT_ENDPOINT, 
         logger=None,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        pool_block=False,
+        session=None,
+        cache=None,
+        compact=False,
+        retry_policy=None,
+        rate_limiter=None,
+        circuit_breaker=None,
+        timeout=DEFAULT_TIMEOUT,
+        metrics=None,
     ):
         self.logger = logger or logging.getLogger(__name__)
         self.api_key = api_key
         self.endpoint = endpoint
+        #: optional :class:`ResourceCache` for records fetched by guid
+        self.cache = cache
+        #: build compact records (see :class:`CompactResource`) for fetched 
+        #  customers, plans, subscriptions, invoices and transactions
+        self.compact = compact
+        #: :class:`RetryPolicy` of requests, pass :data:`NO_RETRY` to 
+        #  disable retrying
+        self.retry_policy = retry_policy or RetryPolicy()
+        #: optional :class:`RateLimiter` every request attempt waits for
+        self.rate_limiter = rate_limiter
+        #: optional :class:`CircuitBreaker` guarding every request attempt
+        self.circuit_breaker = circuit_breaker
+        #: timeout of every request attempt, seconds or a (connect, read) 
+        #  tuple like requests accepts
+        self.timeout = timeout
+        self._local = threading.local()
+        #: map event names to lists of hooks, see :meth:`add_hook`
+        self.hooks = dict((event, []) for event in self.HOOK_EVENTS)
+        #: optional :class:`billy_client.metrics.MetricsRegistry` collecting 
+        #  request metrics through hooks
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.install(self)
+        if session is None:
+            session = self._make_session(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=pool_block,
+            )
+        self.session = session
+
+    def _make_session(self, pool_connections, pool_maxsize, pool_block):
+        """Create a keep-alive session with a connection pool, 
+        pool_connections is the number of hosts to cache pools for, 
+        pool_maxsize is the number of connections kept alive per host, 
+        and pool_block makes callers wait for a free connection instead 
+        of opening extra throwaway ones when the pool is exhausted
+
+        """
+        session = requests.Session()
+        for prefix in ['http://', 'https://']:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=pool_block,
+            )
+            session.mount(prefix, adapter)
+        return session
+
+    def close(self):
+        """Close all pooled connections
+
+        """
+        self.session.close()
 
     def _url_for(self, path):
         """Generate URL for a given path
@@ -424,6 +2075,257 @@ class BillyAPI(object):
     def _auth_args(self):
         return dict(auth=(self.api_key, ''))
 
+    def add_hook(self, event, hook):
+        """Add a hook to be called with a :class:`RequestEvent` before every 
+        request attempt (before_request), after every response 
+        (after_response) and when an attempt fails with an exception 
+        (on_error), or with a :class:`PageEvent` after every page of 
+        records is fetched (on_page). Exceptions raised by hooks are logged 
+        and ignored
+
+        """
+        if event not in self.hooks:
+            raise ValueError('Unknown hook event {!r}'.format(event))
+        self.hooks[event].append(hook)
+
+    def remove_hook(self, event, hook):
+        """Remove a hook added by :meth:`add_hook`
+
+        """
+        self.hooks[event].remove(hook)
+
+    def _emit(self, event, payload):
+        for hook in tuple(self.hooks[event]):
+            try:
+                hook(payload)
+            except Exception:
+                self.logger.exception('Hook %r for %s failed', hook, event)
+
+    def _url_template(self, url):
+        """Get the path of url with guids replaced by {guid}, e.g. 
+        /v1/customers/{guid}/invoices
+
+        """
+        parts = urlparse.urlparse(url).path.split('/')
+        if 'v1' not in parts:
+            return '/'.join(parts)
+        # the path alternates between collection names and guids
+        for index in range(parts.index('v1') + 2, len(parts), 2):
+            parts[index] = '{guid}'
+        return '/'.join(parts)
+
+    def _request_event(
+        self, 
+        method, 
+        url, 
+        method_name, 
+        attempt, 
+        kwargs, 
+        resp=None, 
+        latency=None, 
+        error=None,
+    ):
+        """Build the :class:`RequestEvent` of a request attempt
+
+        """
+        data = kwargs.get('data') or {}
+        request_size = len(urllib.urlencode([
+            (key, value.encode('utf8') if isinstance(value, unicode) else value)
+            for key, value in data.iteritems()
+        ]))
+        status = None
+        response_size = None
+        if resp is not None:
+            status = resp.status_code
+            if kwargs.get('stream'):
+                # reading the content would consume the stream
+                length = resp.headers.get('Content-Length')
+                if isinstance(length, basestring) and length.isdigit():
+                    response_size = int(length)
+            else:
+                response_size = len(resp.content)
+        return RequestEvent(
+            method_name=method_name,
+            http_method=method,
+            url_template=self._url_template(url),
+            url=url,
+            retries=attempt - 1,
+            status=status,
+            latency=latency,
+            request_size=request_size,
+            response_size=response_size,
+            error=error,
+        )
+
+    @contextlib.contextmanager
+    def deadline(self, timeout):
+        """Context manager limits all requests made by current thread in the 
+        block, including retries, page fetches, bulk operations and calls 
+        submitted to :class:`ThreadedBillyAPI`, to finish in timeout seconds. 
+        :class:`BillyTimeoutError` is raised when the deadline is exceeded
+
+        """
+        with self._using_deadline(_Deadline(timeout)):
+            yield
+
+    def _current_deadline(self):
+        return getattr(self._local, 'deadline', None)
+
+    def _make_deadline(self, timeout=None):
+        """Make a deadline in timeout seconds, or the deadline of current 
+        thread if it's earlier
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = _Deadline(timeout)
+        return _Deadline.earliest(self._current_deadline(), deadline)
+
+    @contextlib.contextmanager
+    def _using_deadline(self, deadline):
+        """Apply a deadline to requests made by current thread in the block
+
+        """
+        previous = self._current_deadline()
+        self._local.deadline = _Deadline.earliest(previous, deadline)
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _bind_deadline(self, func, timeout=None):
+        """Wrap func to run under the deadline of current thread, and in 
+        timeout seconds if given, when it's called from other threads
+
+        """
+        deadline = self._make_deadline(timeout)
+        if deadline is None:
+            return func
+
+        def bound(*args, **kwargs):
+            with self._using_deadline(deadline):
+                return func(*args, **kwargs)
+        return bound
+
+    def _request(
+        self, 
+        method, 
+        url, 
+        method_name, 
+        idempotent=None, 
+        auth=True, 
+        **kwargs
+    ):
+        """Send a request and return the response, retry according to the 
+        retry policy. GET requests are idempotent, other requests are only 
+        retried as idempotent ones if idempotent is True. The number of 
+        attempts made is set as the attempts attribute of the response
+
+        """
+        if idempotent is None:
+            idempotent = method == 'GET'
+        if auth:
+            kwargs.update(self._auth_args())
+        send = getattr(self.session, method.lower())
+        policy = self.retry_policy
+        hooks = self.hooks
+        deadline = self._current_deadline()
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self.timeout
+            breaker = self.circuit_breaker
+            try:
+                # wait for the rate limiter first, the remaining time of the 
+                # deadline is only known after waiting
+                if self.rate_limiter is not None:
+                    allowed = self.rate_limiter.acquire(
+                        method, 
+                        timeout=deadline and deadline.remaining(),
+                    )
+                    if not allowed:
+                        raise BillyTimeoutError(
+                            'Deadline exceeded waiting for rate limit of {}'
+                            .format(method_name)
+                        )
+                if deadline is not None:
+                    remaining = deadline.remaining()
+                    if remaining <= 0:
+                        raise BillyTimeoutError(
+                            'Deadline exceeded before processing {}'
+                            .format(method_name)
+                        )
+                    timeout = _cap_timeout(timeout, remaining)
+                if breaker is not None:
+                    token = breaker.before_request(method_name)
+            except BillyError as error:
+                if hooks['on_error']:
+                    self._emit('on_error', self._request_event(
+                        method, url, method_name, attempt, kwargs, 
+                        error=error,
+                    ))
+                raise
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+            if hooks['before_request']:
+                self._emit('before_request', self._request_event(
+                    method, url, method_name, attempt, kwargs,
+                ))
+            sent_at = time.time()
+            try:
+                resp = send(url, **kwargs)
+            except requests.RequestException as error:
+                latency = time.time() - sent_at
+                if breaker is not None:
+                    breaker.record(token, True, latency)
+                if hooks['on_error']:
+                    self._emit('on_error', self._request_event(
+                        method, url, method_name, attempt, kwargs, 
+                        latency=latency, 
+                        error=error,
+                    ))
+                retry = policy.should_retry(attempt, idempotent, error=error)
+                if retry:
+                    retry = policy.wait(attempt, started, deadline=deadline)
+                if not retry:
+                    if isinstance(error, requests.Timeout):
+                        raise BillyTimeoutError(
+                            'Timed out processing {}: {}'
+                            .format(method_name, error)
+                        )
+                    raise
+                self.logger.warning(
+                    'Retrying %s after attempt %s failed with %r', 
+                    method_name, attempt, error,
+                )
+                continue
+            except BaseException:
+                # not a failure of the server, but the probe slot is freed
+                if breaker is not None:
+                    breaker.release(token)
+                raise
+            latency = time.time() - sent_at
+            resp.attempts = attempt
+            if breaker is not None:
+                breaker.record(token, resp.status_code >= 500, latency)
+            if hooks['after_response']:
+                self._emit('after_response', self._request_event(
+                    method, url, method_name, attempt, kwargs, 
+                    resp=resp, 
+                    latency=latency,
+                ))
+            if not policy.should_retry(attempt, idempotent, resp=resp):
+                return resp
+            if not policy.wait(attempt, started, resp=resp, deadline=deadline):
+                return resp
+            self.logger.warning(
+                'Retrying %s after attempt %s failed with code %s', 
+                method_name, attempt, resp.status_code,
+            )
+            if kwargs.get('stream'):
+                resp.close()
+
     def _check_response(self, method_name, resp):
         """Check response from server, raise error if necessary
 
@@ -448,17 +2350,136 @@ class BillyAPI(object):
 
         """
         url = self._url_for('/v1/companies')
-        resp = requests.post(url, data=dict(processor_key=processor_key))
+        resp = self._request(
+            'POST', 
+            url, 
+            'create_company', 
+            auth=False, 
+            data=dict(processor_key=processor_key),
+        )
         self._check_response('create_company', resp)
         company = Company(self, resp.json())
         self.api_key = company.api_key
         return company
 
-    def _get_record(self, guid, path_name, method_name):
+    def _record_cls(self, resource_cls):
+        """Get the class for building fetched records of resource_cls
+
+        """
+        if self.compact:
+            return COMPACT_CLASSES.get(resource_cls, resource_cls)
+        return resource_cls
+
+    def _cache_set(self, record):
+        if self.cache is not None:
+            self.cache.set(record)
+
+    def _cache_invalidate(self, resource_cls, guid):
+        if self.cache is not None:
+            self.cache.invalidate(resource_cls, guid)
+
+    def _get_record(self, guid, path_name, method_name, resource_cls):
+        if self.cache is not None:
+            record = self.cache.get(resource_cls, guid)
+            if record is not None:
+                return record
         url = self._url_for('/v1/{}/{}'.format(path_name, guid))
-        resp = requests.get(url, **self._auth_args())
+        resp = self._request('GET', url, method_name)
         self._check_response(method_name, resp)
-        return Company(self, resp.json())
+        record = self._record_cls(resource_cls)(
+            self, 
+            resp.json(), 
+            validators=_get_validators(resp),
+        )
+        self._cache_set(record)
+        return record
+
+    def get_many(
+        self, 
+        resource_cls, 
+        guids, 
+        workers=DEFAULT_WORKERS, 
+        timeout=None,
+    ):
+        """Find records of resource_cls for all given guids concurrently with 
+        `workers` threads, and return a dict maps guid to the record. 
+        Repeated guids are only looked up once, and if a record doesn't 
+        exist, the NotFoundError is put in the dict instead of being raised. 
+        If timeout is given, all the lookups must finish in timeout seconds
+
+        """
+        path_name = resource_cls.BASE_URI.rsplit('/', 1)[1]
+
+        def get(guid):
+            try:
+                record = self._get_record(
+                    guid=guid,
+                    path_name=path_name,
+                    method_name='get_many',
+                    resource_cls=resource_cls,
+                )
+            except NotFoundError as e:
+                record = e
+            return guid, record
+
+        unique_guids = []
+        seen = set()
+        for guid in guids:
+            if guid not in seen:
+                seen.add(guid)
+                unique_guids.append(guid)
+        return dict(_bounded_map(
+            self._bind_deadline(get, timeout), 
+            unique_guids, 
+            workers=workers, 
+            ordered=False,
+        ))
+
+    def invoice_many(
+        self, 
+        specs, 
+        workers=DEFAULT_WORKERS, 
+        window=None,
+        ordered=True,
+        timeout=None,
+    ):
+        """Create invoices for all specs concurrently with `workers` threads, 
+        and yield an :class:`InvoiceResult` for each of them. A spec is a dict 
+        with `customer_guid` and the arguments of :meth:`Customer.invoice`. 
+        Specs are consumed lazily, no more than `window` (twice the workers 
+        by default) are in flight or waiting to be yielded at the same time. 
+        Results come in the order of specs if ordered is True, otherwise as 
+        soon as they are done. If timeout is given, invoices not created in 
+        timeout seconds get results with :class:`BillyTimeoutError`. Any 
+        other error, including an invalid spec, gets a result with the error 
+        instead of being raised
+
+        """
+        def create(spec):
+            try:
+                kwargs = spec.copy()
+                guid = kwargs.pop('customer_guid')
+                customer = Customer(self, dict(guid=guid))
+                invoice = customer.invoice(**kwargs)
+            except DuplicateExternalIDError as e:
+                return InvoiceResult(
+                    spec, InvoiceResult.STATUS_DUPLICATE, None, e,
+                )
+            except Exception as e:
+                # an invalid spec must not stop the results of the invoices 
+                # still in flight from being reported
+                return InvoiceResult(spec, InvoiceResult.STATUS_ERROR, None, e)
+            return InvoiceResult(
+                spec, InvoiceResult.STATUS_CREATED, invoice, None,
+            )
+
+        return _bounded_map(
+            self._bind_deadline(create, timeout), 
+            specs, 
+            workers=workers, 
+            window=window, 
+            ordered=ordered,
+        )
 
     def get_company(self, guid):
         """Find a company and return, if no such company exist, 
@@ -469,6 +2490,7 @@ class BillyAPI(object):
             guid=guid, 
             path_name='companies',
             method_name='get_company',
+            resource_cls=Company,
         )
 
     def get_customer(self, guid):
@@ -480,13 +2502,13 @@ class BillyAPI(object):
             guid=guid, 
             path_name='customers',
             method_name='get_customer',
+            resource_cls=Customer,
         )
 
-    def list_customers(self, external_id=None):
+    def list_customers(self, external_id=None, **kwargs):
         """List customers
 
         """
-        kwargs = {}
         if external_id:
             kwargs['extra_query'] = dict(external_id=external_id)
         return Page(
@@ -505,9 +2527,10 @@ class BillyAPI(object):
             guid=guid, 
             path_name='plans',
             method_name='get_plans',
+            resource_cls=Plan,
         )
 
-    def list_plans(self):
+    def list_plans(self, **kwargs):
         """List plans
 
         """
@@ -515,6 +2538,7 @@ class BillyAPI(object):
             api=self, 
             url=self._url_for('/v1/plans'),
             resource_cls=Plan,
+            **kwargs
         )
 
     def get_subscription(self, guid):
@@ -526,9 +2550,10 @@ class BillyAPI(object):
             guid=guid, 
             path_name='subscriptions',
             method_name='get_subscriptions',
+            resource_cls=Subscription,
         )
 
-    def list_subscriptions(self):
+    def list_subscriptions(self, **kwargs):
         """List subscriptions
 
         """
@@ -536,6 +2561,7 @@ class BillyAPI(object):
             api=self, 
             url=self._url_for('/v1/subscriptions'),
             resource_cls=Subscription,
+            **kwargs
         )
 
     def get_invoice(self, guid):
@@ -547,13 +2573,13 @@ class BillyAPI(object):
             guid=guid, 
             path_name='invoices',
             method_name='get_invoice',
+            resource_cls=Invoice,
         )
 
-    def list_invoices(self, external_id=None):
+    def list_invoices(self, external_id=None, **kwargs):
         """List invoices
 
         """
-        kwargs = {}
         if external_id:
             kwargs['extra_query'] = dict(external_id=external_id)
         return Page(
@@ -572,9 +2598,10 @@ class BillyAPI(object):
             guid=guid, 
             path_name='transactions',
             method_name='get_transactions',
+            resource_cls=Transaction,
         )
 
-    def list_transactions(self):
+    def list_transactions(self, **kwargs):
         """List transactions
 
         """
@@ -582,4 +2609,151 @@ class BillyAPI(object):
             api=self, 
             url=self._url_for('/v1/transactions'),
             resource_cls=Transaction,
+            **kwargs
+        )
+
+
+class ThreadedBillyAPI(object):
+    """Concurrent front-end of :class:`BillyAPI`, calls are dispatched onto a 
+    bounded pool of worker threads sharing one pooled session, and a 
+    `multiprocessing.pool.AsyncResult` is returned immediately instead of 
+    blocking the caller
+
+    This is not an asyncio client, results cannot be awaited, every call in 
+    progress occupies one of the max_workers threads, and waiting for a 
+    result with its get method blocks the calling thread
+
+    """
+
+    #: Default number of calls running at the same time
+    DEFAULT_MAX_WORKERS = 10
+
+    def __init__(
+        self, 
+        api_key=None,
+        endpoint=BillyAPI.DEFAULT_ENDPOINT, 
+        logger=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        api=None,
+        **kwargs
+    ):
+        if api is None:
+            kwargs.setdefault('pool_maxsize', max_workers)
+            api = BillyAPI(api_key, endpoint=endpoint, logger=logger, **kwargs)
+        self.api = api
+        self.max_workers = max_workers
+        self.pool = ThreadPool(max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __getattr__(self, key):
+        return getattr(_ThreadedProxy(self, self.api), key)
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the worker pool and return an 
+        `AsyncResult` of it
+
+        """
+        func = self.api._bind_deadline(func)
+        return self.pool.apply_async(func, args, kwargs)
+
+    def map(self, func, iterable):
+        """Run func for every element of iterable on the worker pool and 
+        return an `AsyncResult` of the result list
+
+        """
+        func = self.api._bind_deadline(func)
+        return self.pool.map_async(func, iterable)
+
+    def wrap(self, resource):
+        """Wrap a resource object, so that its methods are dispatched onto 
+        the worker pool as well
+
+        """
+        return _ThreadedProxy(self, resource)
+
+    def close(self):
+        """Wait for pending calls to finish and release the worker pool and 
+        pooled connections
+
+        """
+        self.pool.close()
+        self.pool.join()
+        self.api.close()
+
+
+class ThreadedPage(object):
+    """Blocking iterator over records of a :class:`Page`, records are read 
+    in batches of a page on the worker pool of :class:`ThreadedBillyAPI`, 
+    one batch ahead of the consumer, so that the calling thread only waits 
+    when the next batch is not ready yet, and the whole collection is not 
+    loaded into memory. The page is available as `page`, e.g. for its cursor
+
+    """
+
+    #: Number of records per batch until the page size is known
+    DEFAULT_BATCH_SIZE = 20
+
+    def __init__(self, threaded_api, page):
+        self._threaded_api = threaded_api
+        self.page = page
+
+    def _next_batch(self, records):
+        size = self.page.limit or self.DEFAULT_BATCH_SIZE
+        return self._threaded_api.submit(
+            lambda: list(itertools.islice(records, size))
         )
+
+    def __iter__(self):
+        # the record generator is only advanced by one worker at a time
+        records = iter(self.page)
+        pending = self._next_batch(records)
+        while True:
+            batch = pending.get()
+            if not batch:
+                return
+            pending = self._next_batch(records)
+            for record in batch:
+                yield record
+
+
+class _ThreadedProxy(object):
+    """Proxy of a :class:`BillyAPI` or :class:`Resource`, methods sending 
+    requests return `AsyncResult`, and `list_*` methods return 
+    :class:`ThreadedPage`. Other attributes and methods, e.g. add_hook, 
+    deadline or invoice_many, are passed through as they are
+
+    """
+
+    #: Names of methods which send requests and are dispatched onto the 
+    #  worker pool, besides get_* and list_* methods
+    POOLED_METHODS = frozenset([
+        'create_company',
+        'create_customer',
+        'create_plan',
+        'invoice',
+        'subscribe',
+        'cancel',
+        'refund',
+        'refresh',
+    ])
+
+    def __init__(self, threaded_api, target):
+        self._threaded_api = threaded_api
+        self._target = target
+
+    def __getattr__(self, key):
+        value = getattr(self._target, key)
+        if key.startswith('list_'):
+            def list_records(*args, **kwargs):
+                return ThreadedPage(self._threaded_api, value(*args, **kwargs))
+            return list_records
+        if key.startswith('get_') or key in self.POOLED_METHODS:
+            def call(*args, **kwargs):
+                return self._threaded_api.submit(value, *args, **kwargs)
+            return call
+        return value
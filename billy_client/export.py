@@ -0,0 +1,351 @@
+from __future__ import unicode_literals
+import os
+import sys
+import csv
+import json
+import gzip
+import time
+import logging
+import argparse
+
+from .api import BillyAPI
+from .api import Page
+from .api import Customer
+from .api import Plan
+from .api import Subscription
+from .api import Invoice
+from .api import Transaction
+
+#: Map collection names to resource classes
+COLLECTIONS = {
+    'customers': Customer,
+    'plans': Plan,
+    'subscriptions': Subscription,
+    'invoices': Invoice,
+    'transactions': Transaction,
+}
+
+#: Map parent type names to resource classes
+PARENTS = {
+    'customer': Customer,
+    'plan': Plan,
+    'subscription': Subscription,
+    'invoice': Invoice,
+}
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+
+class NDJSONWriter(object):
+    """Write records as newline delimited JSON
+
+    """
+
+    #: newline delimited JSON has no columns to record in checkpoints
+    columns = None
+
+    def __init__(self, output, columns=None):
+        self.output = output
+
+    def write(self, json_data):
+        self.output.write(json.dumps(json_data, sort_keys=True))
+        self.output.write(b'\n')
+
+
+class CSVWriter(object):
+    """Write records as CSV, the columns are the fields of the first record,
+    nested values are encoded as JSON. If columns is given, the header of
+    them was written before being interrupted, and records are written with
+    the same columns
+
+    """
+
+    def __init__(self, output, columns=None):
+        self.writer = csv.writer(output)
+        self.columns = columns
+
+    def _encode(self, value):
+        if value is None:
+            return b''
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, sort_keys=True)
+        if isinstance(value, unicode):
+            return value.encode('utf8')
+        return value
+
+    def write(self, json_data):
+        if self.columns is None:
+            self.columns = sorted(json_data)
+            self.writer.writerow([
+                column.encode('utf8') for column in self.columns
+            ])
+        self.writer.writerow([
+            self._encode(json_data.get(column)) for column in self.columns
+        ])
+
+
+WRITERS = {
+    FORMAT_NDJSON: NDJSONWriter,
+    FORMAT_CSV: CSVWriter,
+}
+
+
+class Progress(object):
+    """Report number of exported records and throughput periodically
+
+    """
+
+    def __init__(self, output, interval=1.0, timer=time.time):
+        self.output = output
+        self.interval = interval
+        self.timer = timer
+        self.count = 0
+        self.started = timer()
+        self.last_report = self.started
+
+    def update(self, count=1):
+        self.count += count
+        now = self.timer()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = self.timer() - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        self.output.write(
+            '{} records, {:.1f} records/s\n'.format(self.count, rate)
+        )
+        self.output.flush()
+
+
+def save_checkpoint(path, cursor, position=None, columns=None):
+    """Save a cursor to path atomically and durably, with the size of output
+    written so far, and the CSV columns
+
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as checkpoint_file:
+        json.dump(
+            dict(cursor=cursor, position=position, columns=columns),
+            checkpoint_file,
+        )
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.rename(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """Load a checkpoint dict with cursor, position and columns from path,
+    return None if there is no such file
+
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def make_page(api, args, cursor=None):
+    """Make the page of records to export from parsed arguments
+
+    """
+    resource_cls = COLLECTIONS[args.collection]
+    page_kwargs = dict(
+        workers=args.workers,
+        prefetch=args.prefetch,
+        stream=args.stream,
+    )
+    if cursor is not None:
+        # the page size is recorded in the cursor
+        return Page.from_cursor(api, resource_cls, cursor, **page_kwargs)
+    if args.page_size is not None:
+        page_kwargs['page_size'] = args.page_size
+    if args.parent is not None:
+        parent_type, _, parent_guid = args.parent.partition(':')
+        if parent_type not in PARENTS or not parent_guid:
+            raise ValueError('Invalid parent {!r}'.format(args.parent))
+        target = PARENTS[parent_type](api, dict(guid=parent_guid))
+    else:
+        target = api
+    method = getattr(target, 'list_' + args.collection, None)
+    if method is None:
+        raise ValueError(
+            'Cannot list {} of {}'.format(args.collection, args.parent)
+        )
+    if args.external_id is not None:
+        page_kwargs['external_id'] = args.external_id
+    return method(**page_kwargs)
+
+
+def export(
+    page, 
+    output, 
+    fmt=FORMAT_NDJSON, 
+    progress=None, 
+    columns=None, 
+    checkpoint=None,
+):
+    """Write all records of page to output in given format, return number of
+    exported records. columns are the CSV columns of the interrupted export
+    to resume. If checkpoint is given, it's called with the cursor of page
+    and the columns after all records of each page are written
+
+    """
+    writer = WRITERS[fmt](output, columns=columns)
+    if checkpoint is not None:
+        page.checkpoint = lambda cursor: checkpoint(cursor, writer.columns)
+    count = 0
+    for record in page:
+        writer.write(record.json_data)
+        count += 1
+        if progress is not None:
+            progress.update()
+    return count
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='billy-export',
+        description='Export a collection of billy records to NDJSON or CSV',
+    )
+    parser.add_argument(
+        'collection',
+        choices=sorted(COLLECTIONS),
+        help='collection to export',
+    )
+    parser.add_argument(
+        '--api-key',
+        default=os.environ.get('BILLY_API_KEY'),
+        help='API key, BILLY_API_KEY environment variable by default',
+    )
+    parser.add_argument(
+        '--endpoint',
+        default=os.environ.get('BILLY_ENDPOINT', BillyAPI.DEFAULT_ENDPOINT),
+        help='URL of billy server',
+    )
+    parser.add_argument(
+        '--parent',
+        help='export records under a parent, e.g. customer:<guid>',
+    )
+    parser.add_argument('--external-id', help='filter by external ID')
+    parser.add_argument(
+        '-f', '--format',
+        choices=sorted(WRITERS),
+        default=FORMAT_NDJSON,
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='output file, standard output by default',
+    )
+    parser.add_argument(
+        '--gzip',
+        action='store_true',
+        help='compress output with gzip',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of pages to fetch concurrently',
+    )
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=0,
+        help='number of pages to fetch ahead in background',
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='decode records from responses incrementally',
+    )
+    parser.add_argument('--page-size', type=int, help='records per request')
+    parser.add_argument(
+        '--checkpoint',
+        help='file to save the cursor to after each page',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='resume from the cursor in checkpoint file, and append to output',
+    )
+    parser.add_argument(
+        '--progress',
+        action='store_true',
+        help='report progress to standard error',
+    )
+    args = parser.parse_args(argv)
+    if args.resume and not (args.checkpoint and args.output):
+        parser.error('--resume requires --checkpoint and --output')
+    if args.resume and args.gzip:
+        # a gzip member cut off in the middle cannot be appended to
+        parser.error('--resume cannot be used with --gzip')
+    return args
+
+
+def main(argv=None, stdout=None, stderr=None):
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    logging.basicConfig(level=logging.WARNING, stream=stderr)
+    args = parse_args(argv)
+
+    api = BillyAPI(
+        args.api_key,
+        endpoint=args.endpoint,
+        pool_maxsize=max(args.workers, BillyAPI.DEFAULT_POOL_MAXSIZE),
+    )
+    checkpoint = None
+    if args.resume:
+        checkpoint = load_checkpoint(args.checkpoint)
+    if checkpoint is None:
+        checkpoint = dict(cursor=None, position=None, columns=None)
+    page = make_page(api, args, cursor=checkpoint['cursor'])
+
+    if args.output is None:
+        raw_output = stdout
+    elif checkpoint['cursor'] is not None:
+        # drop what was written after the last checkpoint
+        raw_output = open(args.output, 'r+b')
+        raw_output.seek(checkpoint['position'] or 0)
+        raw_output.truncate()
+    else:
+        raw_output = open(args.output, 'wb')
+    output = raw_output
+    if args.gzip:
+        output = gzip.GzipFile(fileobj=raw_output, mode='wb')
+
+    def save(cursor, columns):
+        # the cursor must not get ahead of records still in buffers
+        output.flush()
+        position = None
+        if raw_output is not stdout:
+            raw_output.flush()
+            os.fsync(raw_output.fileno())
+            position = raw_output.tell()
+        save_checkpoint(args.checkpoint, cursor, position, columns)
+
+    progress = Progress(stderr) if args.progress else None
+    try:
+        export(
+            page, 
+            output, 
+            args.format, 
+            progress=progress, 
+            columns=checkpoint['columns'],
+            checkpoint=save if args.checkpoint else None,
+        )
+    finally:
+        if output is not raw_output:
+            output.close()
+        if raw_output is not stdout:
+            raw_output.close()
+        api.close()
+    if progress is not None:
+        progress.report()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,687 @@
+"""In-memory fake of billy server, for tests and load testing without a real
+server. It can be plugged into a :class:`BillyAPI` directly as a transport
+
+    billy = FakeBilly()
+    api = BillyAPI(None, endpoint='http://billy.test')
+    billy.install(api)
+    company = api.create_company('MOCK_PROCESSOR_KEY')
+
+or run as a local HTTP server
+
+    python -m billy_client.fake --port 8000
+
+"""
+from __future__ import unicode_literals
+import io
+import sys
+import json
+import time
+import uuid
+import base64
+import urlparse
+import datetime
+import argparse
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+
+import requests
+
+#: Collections of records, and the prefix of their guids
+COLLECTIONS = dict(
+    companies='CP',
+    customers='CU',
+    plans='PL',
+    subscriptions='SU',
+    invoices='IV',
+    transactions='TX',
+)
+
+#: Collections which can be listed under a record of a collection
+NESTED_COLLECTIONS = dict(
+    customers=('subscriptions', 'invoices', 'transactions'),
+    plans=('customers', 'subscriptions', 'invoices', 'transactions'),
+    subscriptions=('invoices', 'transactions'),
+    invoices=('transactions', ),
+)
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    # clamp the day to the end of shorter months
+    day = value.day
+    while True:
+        try:
+            return value.replace(year=year, month=month, day=day)
+        except ValueError:
+            day -= 1
+
+
+def _next_time(value, frequency, interval):
+    if frequency == 'daily':
+        return value + datetime.timedelta(days=interval)
+    if frequency == 'weekly':
+        return value + datetime.timedelta(weeks=interval)
+    if frequency == 'monthly':
+        return _add_months(value, interval)
+    return _add_months(value, 12 * interval)
+
+
+def _parse_int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise FakeError(400, 'Invalid {} {!r}'.format(name, value))
+
+
+def _decode_items(form, prefix):
+    """Decode items encoded by :meth:`Customer._encode_params`, e.g.
+    item_name0 and item_amount0, into a list of dicts
+
+    """
+    items = {}
+    for key, value in form.iteritems():
+        if not key.startswith(prefix):
+            continue
+        name = key[len(prefix):].rstrip('0123456789')
+        index = key[len(prefix) + len(name):]
+        if not name or not index:
+            continue
+        if name in ('amount', 'quantity'):
+            value = _parse_int(value, key)
+        items.setdefault(int(index), {})[name] = value
+    return [items[i] for i in sorted(items)]
+
+
+class FakeError(Exception):
+    """Error response of the fake server
+
+    """
+
+    def __init__(self, status_code, message):
+        super(FakeError, self).__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class FakeBilly(object):
+    """In-memory fake of billy server. Records are kept per company (the
+    company of the API key in requests), lists are paginated by offset and
+    limit, newest first. Creating an invoice with an external ID another
+    invoice of the same customer has returns 409, and unknown records
+    return 404. Invoices are settled immediately with a debit transaction.
+    latency is the seconds to sleep before every response, and limits
+    larger than max_page_size are capped
+
+    """
+
+    #: Default number of records in a page
+    DEFAULT_LIMIT = 20
+
+    def __init__(
+        self,
+        latency=0,
+        max_page_size=None,
+        clock=datetime.datetime.utcnow,
+    ):
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.clock = clock
+        self.records = dict((collection, []) for collection in COLLECTIONS)
+        self._index = {}
+        # map guid to the guid of the company owns it
+        self._owners = {}
+        # map (company guid, collection) to records in creation order
+        self._company_records = collections.defaultdict(list)
+        # map (parent guid, collection) to records under the parent in
+        # creation order, for listing nested collections
+        self._children = collections.defaultdict(list)
+        # (plan guid, customer guid) of subscriptions
+        self._subscribed = set()
+        # (customer guid, external ID) of invoices
+        self._external_ids = set()
+        # map API key to company guid
+        self._api_keys = {}
+        self._lock = threading.RLock()
+
+    def _now(self):
+        return self.clock().strftime(TIME_FORMAT)
+
+    def _add(self, collection, owner_guid, parents=(), **fields):
+        now = self._now()
+        record = dict(
+            guid=COLLECTIONS[collection] + uuid.uuid4().hex[:22],
+            created_at=now,
+            updated_at=now,
+        )
+        record.update(fields)
+        self.records[collection].append(record)
+        self._index[record['guid']] = (collection, record)
+        owner_guid = owner_guid or record['guid']
+        self._owners[record['guid']] = owner_guid
+        self._company_records[(owner_guid, collection)].append(record)
+        for parent_guid in parents:
+            self._children[(parent_guid, collection)].append(record)
+        return record
+
+    def _get(self, company_guid, collection, guid):
+        """Get a record of a company, raise 404 error if there is no such
+        record
+
+        """
+        entry = self._index.get(guid)
+        if entry is None or entry[0] != collection:
+            raise FakeError(404, 'No such {} {}'.format(collection, guid))
+        if self._owners[guid] != company_guid:
+            raise FakeError(404, 'No such {} {}'.format(collection, guid))
+        return entry[1]
+
+    def _get_ref(self, company_guid, collection, form, key):
+        """Get the record referred by a form field, raise 400 error if it's
+        missing or there is no such record
+
+        """
+        guid = form.get(key)
+        if not guid:
+            raise FakeError(400, 'Missing {}'.format(key))
+        try:
+            return self._get(company_guid, collection, guid)
+        except FakeError:
+            raise FakeError(400, 'No such {} {}'.format(collection, guid))
+
+    def create_company(self, processor_key):
+        with self._lock:
+            api_key = uuid.uuid4().hex
+            company = self._add(
+                'companies',
+                None,
+                api_key=api_key,
+                processor_key=processor_key,
+            )
+            self._api_keys[api_key] = company['guid']
+            return company
+
+    def create_customer(self, company_guid, form):
+        with self._lock:
+            return self._add(
+                'customers',
+                company_guid,
+                company_guid=company_guid,
+                processor_uri=form.get('processor_uri'),
+                deleted=False,
+            )
+
+    def create_plan(self, company_guid, form):
+        for key in ['plan_type', 'frequency', 'amount']:
+            if key not in form:
+                raise FakeError(400, 'Missing {}'.format(key))
+        with self._lock:
+            return self._add(
+                'plans',
+                company_guid,
+                company_guid=company_guid,
+                plan_type=form['plan_type'],
+                frequency=form['frequency'],
+                amount=_parse_int(form['amount'], 'amount'),
+                interval=_parse_int(form.get('interval', 1), 'interval'),
+                deleted=False,
+            )
+
+    def _invoice_parents(self, invoice):
+        """Return guids of the invoice and the records it's under
+
+        """
+        parents = [invoice['guid'], invoice['customer_guid']]
+        if invoice['subscription_guid'] is not None:
+            _, subscription = self._index[invoice['subscription_guid']]
+            parents.extend([subscription['guid'], subscription['plan_guid']])
+        return parents
+
+    def _settle(self, company_guid, invoice):
+        """Settle an invoice with a debit transaction
+
+        """
+        if not invoice['effective_amount']:
+            return
+        self._add(
+            'transactions',
+            company_guid,
+            parents=self._invoice_parents(invoice),
+            invoice_guid=invoice['guid'],
+            transaction_type='debit',
+            submit_status='done',
+            status='succeeded',
+            amount=invoice['effective_amount'],
+            processor_uri='/v1/debits/' + uuid.uuid4().hex,
+            appears_on_statement_as=invoice['appears_on_statement_as'],
+            failure_count=0,
+            failures=[],
+        )
+
+    def _add_invoice(self, company_guid, customer_guid, amount, **fields):
+        adjustments = fields.pop('adjustments', [])
+        total_adjustment_amount = sum(
+            adjustment.get('amount', 0) for adjustment in adjustments
+        )
+        fields.setdefault('subscription_guid', None)
+        fields.setdefault('external_id', None)
+        fields.setdefault('title', None)
+        fields.setdefault('funding_instrument_uri', None)
+        fields.setdefault('appears_on_statement_as', None)
+        fields.setdefault('items', [])
+        if fields['external_id'] is not None:
+            self._external_ids.add((customer_guid, fields['external_id']))
+        parents = [customer_guid]
+        if fields['subscription_guid'] is not None:
+            _, subscription = self._index[fields['subscription_guid']]
+            parents.extend([subscription['guid'], subscription['plan_guid']])
+        invoice = self._add(
+            'invoices',
+            company_guid,
+            parents=parents,
+            customer_guid=customer_guid,
+            invoice_type='subscription' if fields['subscription_guid'] else 'customer',
+            transaction_type='debit',
+            status='settled',
+            amount=amount,
+            effective_amount=amount + total_adjustment_amount,
+            total_adjustment_amount=total_adjustment_amount,
+            adjustments=adjustments,
+            scheduled_at=self._now(),
+            **fields
+        )
+        self._settle(company_guid, invoice)
+        return invoice
+
+    def create_invoice(self, company_guid, form):
+        if 'amount' not in form:
+            raise FakeError(400, 'Missing amount')
+        with self._lock:
+            customer = self._get_ref(
+                company_guid, 'customers', form, 'customer_guid',
+            )
+            external_id = form.get('external_id')
+            if (customer['guid'], external_id) in self._external_ids:
+                raise FakeError(
+                    409,
+                    'Invoice with external ID {} already exists'
+                    .format(external_id),
+                )
+            return self._add_invoice(
+                company_guid,
+                customer['guid'],
+                _parse_int(form['amount'], 'amount'),
+                external_id=external_id,
+                title=form.get('title'),
+                funding_instrument_uri=form.get('funding_instrument_uri'),
+                appears_on_statement_as=form.get('appears_on_statement_as'),
+                items=_decode_items(form, 'item_'),
+                adjustments=_decode_items(form, 'adjustment_'),
+            )
+
+    def create_subscription(self, company_guid, form):
+        with self._lock:
+            plan = self._get_ref(company_guid, 'plans', form, 'plan_guid')
+            customer = self._get_ref(
+                company_guid, 'customers', form, 'customer_guid',
+            )
+            amount = _parse_int(form.get('amount', plan['amount']), 'amount')
+            now = self.clock()
+            started_at = now
+            if form.get('started_at'):
+                try:
+                    started_at = datetime.datetime.strptime(
+                        form['started_at'][:19], '%Y-%m-%dT%H:%M:%S',
+                    )
+                except ValueError:
+                    raise FakeError(
+                        400,
+                        'Invalid started_at {!r}'.format(form['started_at']),
+                    )
+            subscription = self._add(
+                'subscriptions',
+                company_guid,
+                parents=(plan['guid'], customer['guid']),
+                plan_guid=plan['guid'],
+                customer_guid=customer['guid'],
+                funding_instrument_uri=form.get('funding_instrument_uri'),
+                amount=amount,
+                effective_amount=amount,
+                appears_on_statement_as=form.get('appears_on_statement_as'),
+                invoice_count=0,
+                canceled=False,
+                canceled_at=None,
+                started_at=started_at.strftime(TIME_FORMAT),
+                next_invoice_at=started_at.strftime(TIME_FORMAT),
+            )
+            if (plan['guid'], customer['guid']) not in self._subscribed:
+                self._subscribed.add((plan['guid'], customer['guid']))
+                self._children[(plan['guid'], 'customers')].append(customer)
+            # the first invoice is due immediately unless it starts later
+            if started_at <= now:
+                self._add_invoice(
+                    company_guid,
+                    customer['guid'],
+                    amount,
+                    subscription_guid=subscription['guid'],
+                    funding_instrument_uri=subscription['funding_instrument_uri'],
+                    appears_on_statement_as=subscription['appears_on_statement_as'],
+                )
+                subscription['invoice_count'] = 1
+                subscription['next_invoice_at'] = _next_time(
+                    started_at,
+                    plan['frequency'],
+                    plan['interval'],
+                ).strftime(TIME_FORMAT)
+            return subscription
+
+    def cancel_subscription(self, company_guid, guid):
+        with self._lock:
+            subscription = self._get(company_guid, 'subscriptions', guid)
+            if not subscription['canceled']:
+                subscription['canceled'] = True
+                subscription['canceled_at'] = self._now()
+                subscription['updated_at'] = subscription['canceled_at']
+            return subscription
+
+    def refund_invoice(self, company_guid, guid, form):
+        if 'amount' not in form:
+            raise FakeError(400, 'Missing amount')
+        amount = _parse_int(form['amount'], 'amount')
+        with self._lock:
+            invoice = self._get(company_guid, 'invoices', guid)
+            refunded = sum(
+                transaction['amount']
+                for transaction in self._children[(guid, 'transactions')]
+                if transaction['transaction_type'] == 'refund'
+            )
+            if refunded + amount > invoice['effective_amount']:
+                raise FakeError(400, 'Refund amount exceeds invoice amount')
+            self._add(
+                'transactions',
+                company_guid,
+                parents=self._invoice_parents(invoice),
+                invoice_guid=guid,
+                transaction_type='refund',
+                submit_status='done',
+                status='succeeded',
+                amount=amount,
+                processor_uri='/v1/refunds/' + uuid.uuid4().hex,
+                appears_on_statement_as=invoice['appears_on_statement_as'],
+                failure_count=0,
+                failures=[],
+            )
+            return invoice
+
+    def list_records(self, company_guid, collection, query, parent=None):
+        """List records of a company newest first, under a parent record
+        (collection and guid) if it's given
+
+        """
+        offset = _parse_int(query.get('offset', 0), 'offset')
+        limit = _parse_int(query.get('limit', self.DEFAULT_LIMIT), 'limit')
+        if offset < 0 or limit < 0:
+            raise FakeError(400, 'Invalid offset or limit')
+        if self.max_page_size is not None:
+            limit = min(limit, self.max_page_size)
+        external_id = query.get('external_id')
+        with self._lock:
+            if parent is None:
+                records = self._company_records[(company_guid, collection)]
+            else:
+                parent_collection, parent_guid = parent
+                self._get(company_guid, parent_collection, parent_guid)
+                records = self._children[(parent_guid, collection)]
+            if external_id is None:
+                # slice the newest first page without copying all records
+                stop = max(len(records) - offset, 0)
+                return dict(
+                    offset=offset,
+                    limit=limit,
+                    total=len(records),
+                    items=records[max(stop - limit, 0):stop][::-1],
+                )
+            matched = [
+                record for record in reversed(records)
+                if record.get('external_id') == external_id
+            ]
+            return dict(
+                offset=offset,
+                limit=limit,
+                total=len(matched),
+                items=matched[offset:offset + limit],
+            )
+
+    def handle(self, method, path, query, form, api_key=None):
+        """Handle a request, return the status code and JSON result
+
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return 200, self._route(method, path, query, form, api_key)
+        except FakeError as e:
+            return e.status_code, dict(error=e.message)
+
+    def _route(self, method, path, query, form, api_key):
+        parts = path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'v1' or parts[1] not in COLLECTIONS:
+            raise FakeError(404, 'Not found')
+        collection = parts[1]
+        if method == 'POST' and parts[1:] == ['companies']:
+            if not form.get('processor_key'):
+                raise FakeError(400, 'Missing processor_key')
+            return self.create_company(form['processor_key'])
+        company_guid = self._api_keys.get(api_key)
+        if company_guid is None:
+            raise FakeError(403, 'Invalid API key')
+        if len(parts) == 2:
+            if method == 'GET':
+                return self.list_records(company_guid, collection, query)
+            if method == 'POST' and collection != 'transactions':
+                creator = getattr(self, 'create_' + collection[:-1])
+                return creator(company_guid, form)
+            raise FakeError(405, 'Method not allowed')
+        guid = parts[2]
+        if len(parts) == 3 and method == 'GET':
+            return self._get(company_guid, collection, guid)
+        if len(parts) == 4:
+            action = parts[3]
+            if method == 'GET' and action in NESTED_COLLECTIONS.get(collection, ()):
+                return self.list_records(
+                    company_guid,
+                    action,
+                    query,
+                    parent=(collection, guid),
+                )
+            if method == 'POST' and (collection, action) == ('subscriptions', 'cancel'):
+                return self.cancel_subscription(company_guid, guid)
+            if method == 'POST' and (collection, action) == ('invoices', 'refund'):
+                return self.refund_invoice(company_guid, guid, form)
+        raise FakeError(404, 'Not found')
+
+    def install(self, api):
+        """Route requests of api to this fake server, return the adapter
+
+        """
+        adapter = FakeAdapter(self)
+        api.session.mount(api.endpoint, adapter)
+        return adapter
+
+
+def _parse_form(body):
+    if not body:
+        return {}
+    if isinstance(body, unicode):
+        body = body.encode('utf8')
+    return dict(
+        (key.decode('utf8'), value.decode('utf8'))
+        for key, value in urlparse.parse_qsl(body, keep_blank_values=True)
+    )
+
+
+def _parse_api_key(authorization):
+    """Get the API key, the username of basic auth
+
+    """
+    if not authorization or not authorization.startswith('Basic '):
+        return None
+    try:
+        decoded = base64.b64decode(authorization[len('Basic '):])
+    except TypeError:
+        return None
+    return decoded.partition(':')[0].decode('utf8')
+
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+    """Transport adapter of requests which sends requests to a
+    :class:`FakeBilly` in-process
+
+    """
+
+    def __init__(self, billy):
+        super(FakeAdapter, self).__init__()
+        self.billy = billy
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        url = urlparse.urlparse(request.url)
+        status, result = self.billy.handle(
+            request.method,
+            url.path,
+            dict(urlparse.parse_qsl(url.query)),
+            _parse_form(request.body),
+            _parse_api_key(request.headers.get('Authorization')),
+        )
+        body = json.dumps(result)
+        resp = requests.Response()
+        resp.status_code = status
+        resp.headers = requests.structures.CaseInsensitiveDict({
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(body)),
+        })
+        resp.raw = io.BytesIO(body)
+        resp.encoding = 'utf-8'
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self):
+        pass
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # write the whole response at once, otherwise the headers and body in
+    # separate packets make delayed ACK dominate the latency
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, method):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, result = self.server.billy.handle(
+            method,
+            url.path,
+            dict(urlparse.parse_qsl(url.query)),
+            _parse_form(body),
+            _parse_api_key(self.headers.get('Authorization')),
+        )
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """Serve a :class:`FakeBilly` over HTTP on a local port in a background
+    thread
+
+    """
+
+    def __init__(self, billy, host='127.0.0.1', port=0):
+        self.billy = billy
+        self.server = _Server((host, port), _Handler)
+        self.server.billy = billy
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run an in-memory fake billy server',
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='seconds to sleep before every response',
+    )
+    parser.add_argument('--max-page-size', type=int)
+    parser.add_argument(
+        '--company',
+        metavar='PROCESSOR_KEY',
+        help='create a company and print its API key',
+    )
+    args = parser.parse_args(argv)
+    billy = FakeBilly(latency=args.latency, max_page_size=args.max_page_size)
+    if args.company:
+        company = billy.create_company(args.company)
+        sys.stdout.write('API key: {}\n'.format(company['api_key']))
+    server = FakeServer(billy, host=args.host, port=args.port)
+    sys.stdout.write('Serving fake billy at {}\n'.format(server.endpoint))
+    sys.stdout.flush()
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+from __future__ import unicode_literals
+import bisect
+import threading
+import collections
+
+#: Default upper bounds of latency histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram(object):
+    """Histogram with fixed buckets, a value is counted in the first bucket
+    whose upper bound is greater than or equal to it, values larger than all
+    bounds are counted in an extra +Inf bucket. It's not thread-safe by
+    itself, :class:`MetricsRegistry` guards it with a lock
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q quantile (0 to 1) by linear interpolation within
+        the bucket it falls in, like histogram_quantile of Prometheus. Return
+        None if nothing was observed
+
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    # no upper bound for the +Inf bucket
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+def _escape(value):
+    return (
+        unicode(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(**labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(key, _escape(value))
+        for key, value in sorted(labels.iteritems())
+    ) + '}'
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+class MetricsRegistry(object):
+    """Thread-safe registry of client-side metrics, collected through the
+    hooks of :class:`BillyAPI` once installed with :meth:`install` or
+    passed to BillyAPI as metrics. It keeps per operation request counts,
+    error counts by status code (or exception name), latency histograms,
+    and page counts of list operations
+
+    """
+
+    #: Prefix of metric names
+    PREFIX = 'billy_client'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._requests = collections.defaultdict(int)
+        self._errors = collections.defaultdict(int)
+        self._latencies = {}
+        self._pages = collections.defaultdict(int)
+        self._page_records = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def install(self, api):
+        """Collect metrics of requests made by api
+
+        """
+        api.add_hook('after_response', self.on_response)
+        api.add_hook('on_error', self.on_error)
+        api.add_hook('on_page', self.on_page)
+
+    def uninstall(self, api):
+        """Stop collecting metrics of api
+
+        """
+        api.remove_hook('after_response', self.on_response)
+        api.remove_hook('on_error', self.on_error)
+        api.remove_hook('on_page', self.on_page)
+
+    def _observe(self, operation, latency):
+        histogram = self._latencies.get(operation)
+        if histogram is None:
+            histogram = self._latencies[operation] = Histogram(self.buckets)
+        histogram.observe(latency)
+
+    def on_response(self, event):
+        with self._lock:
+            self._requests[event.method_name] += 1
+            self._observe(event.method_name, event.latency)
+            if event.status >= 400:
+                self._errors[(event.method_name, str(event.status))] += 1
+
+    def on_error(self, event):
+        with self._lock:
+            # requests refused before being sent have no latency
+            if event.latency is not None:
+                self._requests[event.method_name] += 1
+                self._observe(event.method_name, event.latency)
+            reason = type(event.error).__name__
+            self._errors[(event.method_name, reason)] += 1
+
+    def on_page(self, event):
+        with self._lock:
+            self._pages[event.method_name] += 1
+            self._page_records[event.method_name] += event.count
+
+    def quantiles(self, operation, qs=(0.5, 0.95, 0.99)):
+        """Return a dict maps p50, p95 and p99 (or given quantiles) to
+        estimated latencies of an operation in seconds
+
+        """
+        with self._lock:
+            histogram = self._latencies.get(operation)
+            return dict(
+                ('p{:g}'.format(q * 100), histogram and histogram.quantile(q))
+                for q in qs
+            )
+
+    def snapshot(self):
+        """Return a dict of current counts and latency quantiles by operation
+
+        """
+        with self._lock:
+            operations = sorted(set(self._requests) | set(self._pages))
+            errors = dict(self._errors)
+            result = {}
+            for operation in operations:
+                histogram = self._latencies.get(operation)
+                result[operation] = dict(
+                    requests=self._requests.get(operation, 0),
+                    errors=dict(
+                        (reason, count)
+                        for (op, reason), count in errors.iteritems()
+                        if op == operation
+                    ),
+                    pages=self._pages.get(operation, 0),
+                    p50=histogram and histogram.quantile(0.5),
+                    p95=histogram and histogram.quantile(0.95),
+                    p99=histogram and histogram.quantile(0.99),
+                )
+            return result
+
+    def render(self):
+        """Render the metrics in Prometheus text exposition format
+
+        """
+        prefix = self.PREFIX
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        with self._lock:
+            header('requests_total', 'counter', 'Requests sent to billy server')
+            for operation, count in sorted(self._requests.iteritems()):
+                lines.append('{}_requests_total{} {}'.format(
+                    prefix, _labels(operation=operation), count,
+                ))
+
+            header(
+                'errors_total',
+                'counter',
+                'Failed requests by status code or exception',
+            )
+            for (operation, reason), count in sorted(self._errors.iteritems()):
+                lines.append('{}_errors_total{} {}'.format(
+                    prefix, _labels(operation=operation, reason=reason), count,
+                ))
+
+            header(
+                'request_duration_seconds',
+                'histogram',
+                'Latency of requests to billy server',
+            )
+            for operation, histogram in sorted(self._latencies.iteritems()):
+                cumulative = 0
+                bounds = [_format_bound(b) for b in histogram.buckets]
+                for bound, count in zip(bounds + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_request_duration_seconds_bucket{} {}'.format(
+                        prefix, _labels(operation=operation, le=bound), cumulative,
+                    ))
+                labels = _labels(operation=operation)
+                lines.append('{}_request_duration_seconds_sum{} {!r}'.format(
+                    prefix, labels, histogram.sum,
+                ))
+                lines.append('{}_request_duration_seconds_count{} {}'.format(
+                    prefix, labels, histogram.count,
+                ))
+
+            header('pages_total', 'counter', 'Pages fetched by list operations')
+            for operation, count in sorted(self._pages.iteritems()):
+                lines.append('{}_pages_total{} {}'.format(
+                    prefix, _labels(operation=operation), count,
+                ))
+            header(
+                'page_records_total',
+                'counter',
+                'Records fetched by list operations',
+            )
+            for operation, count in sorted(self._page_records.iteritems()):
+                lines.append('{}_page_records_total{} {}'.format(
+                    prefix, _labels(operation=operation), count,
+                ))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,293 @@
+from __future__ import unicode_literals
+import json
+import sqlite3
+import logging
+import datetime
+
+from .api import Customer
+from .api import Plan
+from .api import Subscription
+from .api import Invoice
+from .api import Transaction
+from .api import _decode_datetime
+
+#: Tables of mirrored collections, map collection names to resource classes
+#  and the columns extracted from records for querying, every table also has
+#  guid, created_at, updated_at and the whole record as JSON in data
+TABLES = [
+    ('customers', Customer, ('external_id', 'deleted')),
+    ('plans', Plan, ('plan_type', 'frequency', 'deleted')),
+    ('subscriptions', Subscription, (
+        'customer_guid', 'plan_guid', 'canceled',
+    )),
+    ('invoices', Invoice, (
+        'customer_guid', 'subscription_guid', 'external_id', 'status',
+        'amount',
+    )),
+    ('transactions', Transaction, (
+        'invoice_guid', 'transaction_type', 'status', 'amount',
+    )),
+]
+
+#: Columns to be indexed wherever they exist
+INDEXED_COLUMNS = (
+    'external_id', 'customer_guid', 'plan_guid', 'subscription_guid',
+    'invoice_guid', 'created_at',
+)
+
+#: Format of sync timestamps
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+#: Default window before the last sync in which records created are checked
+#  for changes by incremental syncs
+DEFAULT_LOOKBACK = datetime.timedelta(days=7)
+
+
+def _encode_time(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class Mirror(object):
+    """Local SQLite mirror of records of a company, records are synced
+    incrementally from billy server and queried without touching the network.
+    Incremental syncs check records created up to lookback (a timedelta)
+    before the last sync for changes, e.g. invoices being settled
+
+    """
+
+    def __init__(
+        self,
+        api,
+        path=':memory:',
+        logger=None,
+        lookback=DEFAULT_LOOKBACK,
+        clock=datetime.datetime.utcnow,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.api = api
+        self.path = path
+        self.lookback = lookback
+        self.clock = clock
+        self.conn = sqlite3.connect(path)
+        self.tables = {}
+        for name, resource_cls, columns in TABLES:
+            self.tables[name] = (resource_cls, columns)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.conn:
+            for name, _, columns in TABLES:
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS {} ('
+                    'guid TEXT PRIMARY KEY, {}, '
+                    'created_at TEXT, updated_at TEXT, data TEXT NOT NULL'
+                    ')'.format(name, ', '.join(columns))
+                )
+                for column in columns + ('created_at', ):
+                    if column not in INDEXED_COLUMNS:
+                        continue
+                    self.conn.execute(
+                        'CREATE INDEX IF NOT EXISTS ix_{0}_{1} '
+                        'ON {0} ({1})'.format(name, column)
+                    )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'collection TEXT PRIMARY KEY, synced_at TEXT, '
+                'records INTEGER'
+                ')'
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def _store(self, collection, json_data):
+        """Insert or update a record, return True if it's new or changed
+
+        """
+        _, columns = self.tables[collection]
+        data = json.dumps(json_data, sort_keys=True)
+        row = self.conn.execute(
+            'SELECT data FROM {} WHERE guid = ?'.format(collection),
+            (json_data['guid'], ),
+        ).fetchone()
+        if row is not None and row[0] == data:
+            return False
+        names = ('guid', ) + columns + ('created_at', 'updated_at', 'data')
+        values = [json_data.get(name) for name in names[:-1]] + [data]
+        self.conn.execute(
+            'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                collection,
+                ', '.join(names),
+                ', '.join('?' for _ in names),
+            ),
+            values,
+        )
+        return True
+
+    def sync_collection(self, collection, full=False, page_size=None):
+        """Sync records of a collection from billy server, return number of
+        new or changed records
+
+        Billy server lists records newest first, so an incremental sync stops
+        at the first record which is already mirrored unchanged and was
+        created before the lookback window of the last sync. Changes to
+        records older than that are only picked up by a full sync
+
+        """
+        kwargs = {}
+        if page_size is not None:
+            kwargs['page_size'] = page_size
+        page = getattr(self.api, 'list_' + collection)(**kwargs)
+        last_synced = self.last_synced(collection)
+        stop_before = None
+        if not full and last_synced is not None:
+            stop_before = last_synced - self.lookback
+        changed = 0
+        with self.conn:
+            for record in page:
+                if self._store(collection, record.json_data):
+                    changed += 1
+                    continue
+                if stop_before is None:
+                    continue
+                created_at = _decode_datetime(record.json_data.get('created_at'))
+                if not isinstance(created_at, datetime.datetime):
+                    break
+                if created_at < stop_before:
+                    break
+            records = self.count(collection)
+            synced_at = self.clock().strftime(TIME_FORMAT)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_state '
+                '(collection, synced_at, records) VALUES (?, ?, ?)',
+                (collection, synced_at, records),
+            )
+        self.logger.info(
+            'Synced %s, %s new or changed records, %s records in total',
+            collection, changed, records,
+        )
+        return changed
+
+    def sync(self, collections=None, full=False, page_size=None):
+        """Sync given collections, all collections by default, return a dict
+        maps collection names to number of new or changed records
+
+        """
+        if collections is None:
+            collections = [name for name, _, _ in TABLES]
+        result = {}
+        for collection in collections:
+            result[collection] = self.sync_collection(
+                collection,
+                full=full,
+                page_size=page_size,
+            )
+        return result
+
+    def last_synced(self, collection):
+        """Return the UTC datetime of last sync of a collection, or None if
+        it was never synced
+
+        """
+        row = self.conn.execute(
+            'SELECT synced_at FROM sync_state WHERE collection = ?',
+            (collection, ),
+        ).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.strptime(row[0], TIME_FORMAT)
+
+    def _where(self, collection, filters, since=None, until=None, alias=None):
+        _, columns = self.tables[collection]
+        prefix = alias + '.' if alias else ''
+        clauses = []
+        params = []
+        for key, value in sorted(filters.iteritems()):
+            if key not in columns and key != 'guid':
+                raise ValueError(
+                    'Cannot filter {} by {}'.format(collection, key)
+                )
+            if value is None:
+                clauses.append('{}{} IS NULL'.format(prefix, key))
+            else:
+                clauses.append('{}{} = ?'.format(prefix, key))
+                params.append(value)
+        if since is not None:
+            clauses.append('{}created_at >= ?'.format(prefix))
+            params.append(_encode_time(since))
+        if until is not None:
+            clauses.append('{}created_at < ?'.format(prefix))
+            params.append(_encode_time(until))
+        return clauses, params
+
+    def _select(self, collection, sql, params, limit=None, alias=None):
+        resource_cls, _ = self.tables[collection]
+        prefix = alias + '.' if alias else ''
+        sql += ' ORDER BY {0}created_at DESC, {0}guid'.format(prefix)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params = list(params) + [limit]
+        return [
+            resource_cls(self.api, json.loads(data))
+            for data, in self.conn.execute(sql, params)
+        ]
+
+    def get(self, collection, guid):
+        """Get a mirrored record by guid, return None if there is no such
+        record
+
+        """
+        records = self.find(collection, guid=guid)
+        if not records:
+            return None
+        return records[0]
+
+    def find(self, collection, since=None, until=None, limit=None, **filters):
+        """Find mirrored records of a collection, newest first. Keyword
+        arguments filter records by column values, since and until filter
+        records by created_at
+
+        """
+        clauses, params = self._where(collection, filters, since, until)
+        sql = 'SELECT data FROM {}'.format(collection)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return self._select(collection, sql, params, limit=limit)
+
+    def count(self, collection, since=None, until=None, **filters):
+        """Count mirrored records of a collection
+
+        """
+        clauses, params = self._where(collection, filters, since, until)
+        sql = 'SELECT COUNT(*) FROM {}'.format(collection)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def find_invoices_for_plan(
+        self, 
+        plan_guid, 
+        since=None, 
+        until=None, 
+        limit=None, 
+        **filters
+    ):
+        """Find mirrored invoices of subscriptions to a plan
+
+        """
+        clauses, params = self._where(
+            'invoices', filters, since, until, alias='invoices',
+        )
+        clauses.append('subscriptions.plan_guid = ?')
+        params.append(plan_guid)
+        sql = (
+            'SELECT invoices.data FROM invoices '
+            'JOIN subscriptions '
+            'ON subscriptions.guid = invoices.subscription_guid '
+            'WHERE ' + ' AND '.join(clauses)
+        )
+        return self._select(
+            'invoices', sql, params, limit=limit, alias='invoices',
+        )
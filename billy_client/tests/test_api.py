@@ -1,9 +1,13 @@
 from __future__ import unicode_literals
+import sys
+import json
+import time
 import unittest
 import datetime
 import urlparse
 
 import mock
+import requests
 
 from billy_client import BillyAPI
 from billy_client import BillyError
@@ -14,6 +18,8 @@ from billy_client.api import Customer
 from billy_client.api import Plan
 from billy_client.api import Invoice
 from billy_client.api import Subscription
+from billy_client.api import Transaction
+from billy_client.api import InvoiceResult
 
 
 class TestResource(unittest.TestCase):
@@ -38,12 +44,198 @@ class TestResource(unittest.TestCase):
             print(res.no_such_thing)
 
 
+class TestCompactResource(unittest.TestCase):
+
+    def make_data(self, **kwargs):
+        data = dict(
+            guid='MOCK_TRANSACTION_GUID',
+            invoice_guid='MOCK_INVOICE_GUID',
+            transaction_type='debit',
+            submit_status='done',
+            status='succeeded',
+            amount='1000',
+            processor_uri='MOCK_PROCESSOR_URI',
+            appears_on_statement_as='hello',
+            failure_count=0,
+            failures=[],
+            created_at='2013-10-01T12:34:56.123456',
+            updated_at='2013-10-02T00:00:00Z',
+        )
+        data.update(kwargs)
+        return data
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.api import CompactTransaction
+        return CompactTransaction(*args, **kwargs)
+
+    def test_fields(self):
+        data = self.make_data(unknown_field='value')
+        transaction = self.make_one(None, data)
+        self.assertIsInstance(transaction, Transaction)
+        self.assertEqual(transaction.guid, 'MOCK_TRANSACTION_GUID')
+        self.assertEqual(transaction.status, 'succeeded')
+        self.assertEqual(transaction.unknown_field, 'value')
+        self.assertEqual(transaction.json_data, data)
+        with self.assertRaises(AttributeError):
+            print(transaction.no_such_thing)
+
+    def test_all_fields(self):
+        data = self.make_data()
+        transaction = self.make_one(None, data)
+        self.assertEqual(transaction.json_data, data)
+        self.assertEqual(transaction._extra, None)
+        self.assertEqual(transaction.failures, [])
+
+    def test_few_fields(self):
+        from billy_client.api import CompactResource
+
+        class GuidOnlyCustomer(CompactResource, Customer):
+            FIELDS = ('guid', )
+
+        class EmptyCustomer(CompactResource, Customer):
+            FIELDS = ()
+
+        customer = GuidOnlyCustomer(None, dict(guid='MOCK_GUID'))
+        self.assertEqual(customer.guid, 'MOCK_GUID')
+        self.assertEqual(customer._extra, None)
+        customer = GuidOnlyCustomer(None, dict(guid='MOCK_GUID', deleted=True))
+        self.assertEqual(customer.guid, 'MOCK_GUID')
+        self.assertEqual(customer.deleted, True)
+        customer = EmptyCustomer(None, dict(guid='MOCK_GUID'))
+        self.assertEqual(customer.guid, 'MOCK_GUID')
+        self.assertEqual(EmptyCustomer(None, {})._extra, None)
+
+    def test_lazy_decoding(self):
+        transaction = self.make_one(None, self.make_data())
+        self.assertEqual(
+            transaction.created_at, 
+            datetime.datetime(2013, 10, 1, 12, 34, 56, 123456),
+        )
+        self.assertEqual(
+            transaction.updated_at, 
+            datetime.datetime(2013, 10, 2),
+        )
+        self.assertEqual(transaction.amount, 1000)
+        # the raw value is kept
+        self.assertEqual(transaction.json_data['amount'], '1000')
+        self.assertEqual(
+            transaction.json_data['created_at'], 
+            '2013-10-01T12:34:56.123456',
+        )
+
+    def test_missing_field(self):
+        transaction = self.make_one(None, dict(guid='MOCK_GUID'))
+        with self.assertRaises(AttributeError):
+            print(transaction.created_at)
+        with self.assertRaises(AttributeError):
+            print(transaction.status)
+        self.assertEqual(transaction.json_data, dict(guid='MOCK_GUID'))
+
+    def test_set_json_data(self):
+        transaction = self.make_one(None, self.make_data(extra='value'))
+        self.assertEqual(transaction.amount, 1000)
+        transaction.json_data = dict(guid='MOCK_GUID', amount=5)
+        self.assertEqual(transaction.amount, 5)
+        self.assertEqual(transaction.json_data, dict(guid='MOCK_GUID', amount=5))
+        with self.assertRaises(AttributeError):
+            print(transaction.extra)
+
+    def test_no_dict(self):
+        transaction = self.make_one(None, self.make_data())
+        transaction.amount
+        transaction.created_at
+        self.assertEqual(transaction.__dict__, {})
+
+    def test_memory(self):
+        data = self.make_data()
+        transaction = Transaction(None, dict(data))
+        compact = self.make_one(None, dict(data))
+        full_size = sum([
+            sys.getsizeof(transaction), 
+            sys.getsizeof(transaction.json_data),
+        ])
+        compact_size = sys.getsizeof(compact)
+        self.assertLess(compact_size * 2, full_size)
+
+    @mock.patch('requests.Session.get')
+    def test_api_compact(self, get_method):
+        from billy_client.api import CompactInvoice
+        from billy_client.api import CompactTransaction
+        from billy_client import ResourceCache
+        results = [
+            dict(offset=0, limit=2, items=[self.make_data()]),
+            dict(offset=2, limit=2, items=[]),
+        ]
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+            headers={},
+        )
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            compact=True,
+            cache=ResourceCache(),
+        )
+        transactions = list(api.list_transactions())
+        self.assertEqual(len(transactions), 1)
+        self.assertIsInstance(transactions[0], CompactTransaction)
+        self.assertEqual(transactions[0].amount, 1000)
+
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_INVOICE_GUID', amount=10),
+            status_code=200,
+            headers={},
+        )
+        invoice = api.get_invoice('MOCK_INVOICE_GUID')
+        self.assertIsInstance(invoice, CompactInvoice)
+        # cached under the plain resource class
+        self.assertIs(api.get_invoice('MOCK_INVOICE_GUID'), invoice)
+        self.assertIs(api.cache.get(Invoice, 'MOCK_INVOICE_GUID'), invoice)
+        # company has no compact class
+        self.assertIs(type(api.get_company('MOCK_COMPANY_GUID')), Company)
+
+
 class TestAPI(unittest.TestCase):
 
     def make_one(self, *args, **kwargs):
         return BillyAPI(*args, **kwargs)
 
-    @mock.patch('requests.post')
+    def test_connection_pool(self):
+        api = self.make_one(
+            None,
+            endpoint='http://localhost',
+            pool_connections=3,
+            pool_maxsize=7,
+            pool_block=True,
+        )
+        for prefix in ['http://', 'https://']:
+            adapter = api.session.get_adapter(prefix + 'localhost')
+            self.assertEqual(adapter._pool_connections, 3)
+            self.assertEqual(adapter._pool_maxsize, 7)
+            self.assertEqual(adapter._pool_block, True)
+
+    def test_custom_session(self):
+        session = mock.Mock()
+        api = self.make_one(None, endpoint='http://localhost', session=session)
+        self.assertIs(api.session, session)
+        api.close()
+        session.close.assert_called_once_with()
+
+    @mock.patch('requests.Session.get')
+    def test_session_reused(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID'),
+            status_code=200,
+        )
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        session = api.session
+        api.get_customer('MOCK_GUID')
+        api.get_invoice('MOCK_GUID')
+        self.assertIs(api.session, session)
+        self.assertEqual(get_method.call_count, 2)
+
+    @mock.patch('requests.Session.post')
     def test_billy_error(self, post_method):
         mock_company_data = dict(guid='MOCK_COMPANY_GUID')
         post_method.return_value = mock.Mock(
@@ -56,7 +248,7 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(BillyError):
             api.create_company('MOCK_PROCESSOR_KEY')
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_create_company(self, post_method):
         mock_company_data = dict(
             guid='MOCK_COMPANY_GUID', 
@@ -76,9 +268,10 @@ class TestAPI(unittest.TestCase):
         post_method.assert_called_once_with(
             'http://localhost/v1/companies', 
             data=dict(processor_key='MOCK_PROCESSOR_KEY'),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def _test_get_record(self, get_method, method_name, path_name):
         mock_record_data = dict(guid='MOCK_GUID')
         mock_response = mock.Mock(
@@ -95,10 +288,11 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(record.api, api)
         get_method.assert_called_once_with(
             'http://localhost/v1/{}/MOCK_GUID'.format(path_name), 
-            auth=('MOCK_API_KEY', '')
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def _test_get_record_not_found(self, get_method, method_name, path_name):
         mock_record_data = dict(
             guid='MOCK_GUID',
@@ -117,7 +311,8 @@ class TestAPI(unittest.TestCase):
 
         get_method.assert_called_once_with(
             'http://localhost/v1/{}/MOCK_GUID'.format(path_name), 
-            auth=('MOCK_API_KEY', '')
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
     def test_get_company(self):
@@ -192,7 +387,142 @@ class TestAPI(unittest.TestCase):
             path_name='transactions',
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.get')
+    def test_get_record_class(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID'),
+            status_code=200,
+        )
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        self.assertIsInstance(api.get_company('MOCK_GUID'), Company)
+        self.assertIsInstance(api.get_customer('MOCK_GUID'), Customer)
+        self.assertIsInstance(api.get_plan('MOCK_GUID'), Plan)
+        self.assertIsInstance(api.get_subscription('MOCK_GUID'), Subscription)
+        self.assertIsInstance(api.get_invoice('MOCK_GUID'), Invoice)
+        self.assertIsInstance(api.get_transaction('MOCK_GUID'), Transaction)
+
+    @mock.patch('requests.Session.get')
+    def test_get_many(self, get_method):
+        def get(url, **kwargs):
+            guid = url.rsplit('/', 1)[1]
+            if guid.startswith('MISSING'):
+                return mock.Mock(
+                    json=lambda: dict(),
+                    status_code=404,
+                    content='Not found',
+                )
+            return mock.Mock(
+                json=lambda: dict(guid=guid),
+                status_code=200,
+            )
+
+        get_method.side_effect = get
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        guids = ['MOCK_GUID{}'.format(i) for i in range(20)]
+        records = api.get_many(
+            Invoice, 
+            guids + ['MISSING_GUID'] + guids,
+            workers=4,
+        )
+        self.assertEqual(set(records), set(guids + ['MISSING_GUID']))
+        for guid in guids:
+            self.assertIsInstance(records[guid], Invoice)
+            self.assertEqual(records[guid].guid, guid)
+        self.assertIsInstance(records['MISSING_GUID'], NotFoundError)
+        # duplicate guids are only fetched once
+        self.assertEqual(get_method.call_count, 21)
+        call_urls = sorted(args[0] for args, _ in get_method.call_args_list)
+        self.assertEqual(call_urls, sorted(
+            'http://localhost/v1/invoices/{}'.format(guid)
+            for guid in guids + ['MISSING_GUID']
+        ))
+
+    @mock.patch('requests.Session.get')
+    def test_get_many_error(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(),
+            status_code=500,
+            content='Server error',
+        )
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        with self.assertRaises(BillyError):
+            api.get_many(Transaction, ['MOCK_GUID1', 'MOCK_GUID2'])
+
+    @mock.patch('requests.Session.get')
+    def test_refresh_not_modified(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID', status='staged'),
+            status_code=200,
+            headers={'ETag': '"v1"', 'Last-Modified': 'MOCK_DATE'},
+        )
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        invoice = api.get_invoice('MOCK_GUID')
+        self.assertEqual(
+            invoice.validators, 
+            dict(etag='"v1"', last_modified='MOCK_DATE'),
+        )
+
+        get_method.return_value = mock.Mock(status_code=304, headers={})
+        self.assertEqual(invoice.refresh(), False)
+        self.assertEqual(invoice.status, 'staged')
+        get_method.assert_called_with(
+            'http://localhost/v1/invoices/MOCK_GUID',
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
+            headers={
+                'If-None-Match': '"v1"',
+                'If-Modified-Since': 'MOCK_DATE',
+            },
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_refresh_modified(self, get_method):
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        invoice = Invoice(
+            api, 
+            dict(guid='MOCK_GUID', status='staged'),
+            validators=dict(etag='"v1"'),
+        )
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID', status='settled'),
+            status_code=200,
+            headers={'ETag': '"v2"'},
+        )
+        self.assertEqual(invoice.refresh(), True)
+        self.assertEqual(invoice.status, 'settled')
+        self.assertEqual(invoice.validators, dict(etag='"v2"'))
+        get_method.assert_called_once_with(
+            'http://localhost/v1/invoices/MOCK_GUID',
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
+            headers={'If-None-Match': '"v1"'},
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_refresh_without_validators(self, get_method):
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        transaction = Transaction(api, dict(guid='MOCK_GUID', status='done'))
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID', status='done'),
+            status_code=200,
+            headers={},
+        )
+        self.assertEqual(transaction.refresh(), False)
+        get_method.assert_called_once_with(
+            'http://localhost/v1/transactions/MOCK_GUID',
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
+        )
+
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(),
+            status_code=404,
+            content='Not found',
+        )
+        with self.assertRaises(NotFoundError):
+            transaction.refresh()
+
+    @mock.patch('requests.Session.post')
     def test_create_customer(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         company = Company(api, dict(guid='MOCK_COMPANY_GUID'))
@@ -211,10 +541,11 @@ class TestAPI(unittest.TestCase):
         post_method.assert_called_once_with(
             'http://localhost/v1/customers', 
             data=dict(processor_uri='MOCK_BALANCED_CUSTOMER_URI'),
-            auth=('MOCK_API_KEY', '')
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_create_plan(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         company = Company(api, dict(guid='MOCK_COMPANY_GUID'))
@@ -242,9 +573,10 @@ class TestAPI(unittest.TestCase):
                 interval=123,
             ),
             auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_subscribe(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
@@ -277,9 +609,10 @@ class TestAPI(unittest.TestCase):
                 started_at=now.isoformat(),
             ),
             auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_cancel_subscription(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         subscription = Subscription(api, dict(guid='MOCK_SUBSCRIPTION_GUID'))
@@ -301,9 +634,10 @@ class TestAPI(unittest.TestCase):
             'http://localhost/v1/subscriptions/{}/cancel'
             .format('MOCK_SUBSCRIPTION_GUID'), 
             auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_invoice(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
@@ -359,9 +693,10 @@ class TestAPI(unittest.TestCase):
                 adjustment_reason1='you owe me',
             ),
             auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_refund_invoice(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         invoice = Invoice(api, dict(guid='MOCK_INVOICE_GUID'))
@@ -380,9 +715,10 @@ class TestAPI(unittest.TestCase):
             .format('MOCK_INVOICE_GUID'), 
             data=dict(amount=999),
             auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
         )
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_invoice_with_duplicate_external_id(self, post_method):
         api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
         customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
@@ -403,7 +739,111 @@ class TestAPI(unittest.TestCase):
                 external_id='duplaite one',
             )
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.post')
+    def test_invoice_many(self, post_method):
+        def post(url, data, **kwargs):
+            if data.get('external_id') == 'DUPLICATE':
+                return mock.Mock(
+                    json=lambda: dict(),
+                    status_code=409,
+                    content='Duplicate',
+                )
+            if data['customer_guid'] == 'BAD_CUSTOMER':
+                return mock.Mock(
+                    json=lambda: dict(),
+                    status_code=400,
+                    content='Bad request',
+                )
+            invoice_data = dict(
+                guid='MOCK_INVOICE_' + data['customer_guid'],
+                amount=data['amount'],
+            )
+            return mock.Mock(json=lambda: invoice_data, status_code=200)
+
+        post_method.side_effect = post
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        specs = [
+            dict(customer_guid='MOCK_CUSTOMER{}'.format(i), amount=i)
+            for i in range(20)
+        ]
+        specs.append(dict(
+            customer_guid='MOCK_CUSTOMER', 
+            amount=1, 
+            external_id='DUPLICATE',
+        ))
+        specs.append(dict(customer_guid='BAD_CUSTOMER', amount=1))
+        results = list(api.invoice_many(iter(specs), workers=4, window=6))
+
+        self.assertEqual([r.spec for r in results], specs)
+        for result in results[:20]:
+            self.assertEqual(result.status, InvoiceResult.STATUS_CREATED)
+            self.assertEqual(
+                result.invoice.guid, 
+                'MOCK_INVOICE_' + result.spec['customer_guid'],
+            )
+            self.assertEqual(result.error, None)
+        self.assertEqual(results[20].status, InvoiceResult.STATUS_DUPLICATE)
+        self.assertIsInstance(results[20].error, DuplicateExternalIDError)
+        self.assertEqual(results[21].status, InvoiceResult.STATUS_ERROR)
+        self.assertIsInstance(results[21].error, BillyError)
+        self.assertEqual(results[21].invoice, None)
+        self.assertEqual(post_method.call_count, 22)
+        # the specs are not modified
+        self.assertEqual(specs[0], dict(customer_guid='MOCK_CUSTOMER0', amount=0))
+
+    @mock.patch('requests.Session.post')
+    def test_invoice_many_invalid_spec(self, post_method):
+        post_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_INVOICE_GUID'),
+            status_code=200,
+        )
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        specs = [
+            dict(customer_guid='MOCK_CUSTOMER_GUID', amount=i)
+            for i in range(8)
+        ]
+        specs[3] = dict(customer_guid='MOCK_CUSTOMER_GUID', ammount=3)
+        specs[5] = dict(amount=5)
+        for ordered in [True, False]:
+            post_method.reset_mock()
+            results = list(api.invoice_many(
+                specs, 
+                workers=4, 
+                window=4, 
+                ordered=ordered,
+            ))
+            # every created invoice is reported
+            self.assertEqual(len(results), 8)
+            self.assertEqual(post_method.call_count, 6)
+            errors = dict(
+                (r.spec.get('amount', r.spec.get('ammount')), r.error)
+                for r in results 
+                if r.status == InvoiceResult.STATUS_ERROR
+            )
+            self.assertEqual(sorted(errors), [3, 5])
+            self.assertIsInstance(errors[3], TypeError)
+            self.assertIsInstance(errors[5], KeyError)
+
+    @mock.patch('requests.Session.post')
+    def test_invoice_many_backpressure(self, post_method):
+        post_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_INVOICE_GUID'),
+            status_code=200,
+        )
+        taken = []
+
+        def specs():
+            for i in range(100):
+                taken.append(i)
+                yield dict(customer_guid='MOCK_CUSTOMER_GUID', amount=i)
+
+        api = self.make_one('MOCK_API_KEY', endpoint='http://localhost')
+        results = api.invoice_many(specs(), workers=2, window=3)
+        self.assertEqual(next(results).spec['amount'], 0)
+        self.assertLessEqual(len(taken), 4)
+        results.close()
+
+    @mock.patch('requests.Session.get')
     def _test_list_records(
         self, 
         get_method, 
@@ -487,7 +927,7 @@ class TestAPI(unittest.TestCase):
         call_auths = [kwargs['auth'] for _, kwargs in get_method.call_args_list]
         self.assertEqual([('MOCK_API_KEY', '')] * 4, call_auths)
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     def _test_list_records_under_resource(
         self, 
         get_method, 
@@ -675,3 +1115,1827 @@ class TestAPI(unittest.TestCase):
             method_name='list_transactions',
             resource_url='http://localhost/v1/invoices/{}/transactions',
         )
+
+
+class TestPage(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.api import Page
+        return Page(*args, **kwargs)
+
+    def make_api(self):
+        return BillyAPI('MOCK_API_KEY', endpoint='http://localhost')
+
+    def make_results(self, count, limit):
+        results = []
+        for offset in range(0, count, limit):
+            results.append(dict(
+                offset=offset,
+                limit=limit,
+                items=[
+                    dict(guid='MOCK_GUID{}'.format(i)) 
+                    for i in range(offset, min(offset + limit, count))
+                ],
+            ))
+        results.append(dict(
+            offset=len(results) * limit, 
+            limit=limit, 
+            items=[],
+        ))
+        return results
+
+    def get_queries(self, get_method):
+        qs_list = []
+        for args, _ in get_method.call_args_list:
+            o = urlparse.urlparse(args[0])
+            query = urlparse.parse_qs(o.query)
+            for k, v in query.iteritems():
+                query[k] = v[0]
+            qs_list.append(query)
+        return qs_list
+
+    @mock.patch('requests.Session.get')
+    def test_prefetch(self, get_method):
+        results = self.make_results(count=7, limit=2)
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+        )
+        api = self.make_api()
+        page = self.make_one(
+            api, 
+            'http://localhost/v1/invoices', 
+            Invoice,
+            prefetch=2,
+        )
+        records = list(page)
+        self.assertEqual(
+            [r.guid for r in records],
+            ['MOCK_GUID{}'.format(i) for i in range(7)],
+        )
+        self.assertEqual(self.get_queries(get_method), [
+            dict(),
+            dict(offset='2', limit='2'),
+            dict(offset='4', limit='2'),
+            dict(offset='6', limit='2'),
+            dict(offset='8', limit='2'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_prefetch_from_list_method(self, get_method):
+        results = self.make_results(count=3, limit=2)
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+        )
+        api = self.make_api()
+        customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
+        page = customer.list_invoices(external_id='id', prefetch=1)
+        self.assertEqual(page.prefetch, 1)
+        self.assertEqual(
+            [r.guid for r in page],
+            ['MOCK_GUID0', 'MOCK_GUID1', 'MOCK_GUID2'],
+        )
+        self.assertEqual(self.get_queries(get_method), [
+            dict(external_id='id'),
+            dict(external_id='id', offset='2', limit='2'),
+            dict(external_id='id', offset='4', limit='2'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_prefetch_error(self, get_method):
+        results = self.make_results(count=2, limit=2)
+
+        def json():
+            if not results:
+                raise ValueError('Bad JSON')
+            return results.pop(0)
+
+        results.pop()
+        get_method.return_value = mock.Mock(json=json, status_code=200)
+        api = self.make_api()
+        page = self.make_one(
+            api, 
+            'http://localhost/v1/invoices', 
+            Invoice,
+            prefetch=1,
+        )
+        records = iter(page)
+        self.assertEqual(next(records).guid, 'MOCK_GUID0')
+        self.assertEqual(next(records).guid, 'MOCK_GUID1')
+        with self.assertRaises(ValueError):
+            next(records)
+
+    @mock.patch('requests.Session.get')
+    def test_prefetch_stop_early(self, get_method):
+        results = self.make_results(count=100, limit=2)
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+        )
+        api = self.make_api()
+        page = self.make_one(
+            api, 
+            'http://localhost/v1/invoices', 
+            Invoice,
+            prefetch=1,
+        )
+        records = iter(page)
+        self.assertEqual(next(records).guid, 'MOCK_GUID0')
+        records.close()
+        time.sleep(0.3)
+        # only the first page, the one in the queue and the one which was 
+        # waiting to be enqueued should be fetched
+        self.assertLessEqual(get_method.call_count, 3)
+
+    def make_collection_get(self, count, limit, with_total=True):
+        """Make a fake GET method which serves a collection of count records 
+        by offset and limit
+
+        """
+        def get(url, **kwargs):
+            query = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+            offset = int(query.get('offset', 0))
+            page_limit = int(query.get('limit', limit))
+            result = dict(
+                offset=offset,
+                limit=page_limit,
+                items=[
+                    dict(guid='MOCK_GUID{}'.format(i))
+                    for i in range(offset, min(offset + page_limit, count))
+                ],
+            )
+            if with_total:
+                result['total'] = count
+            return mock.Mock(json=lambda: result, status_code=200)
+        return get
+
+    def _test_parallel(self, get_method, count, with_total, ordered):
+        get_method.side_effect = self.make_collection_get(
+            count=count,
+            limit=3,
+            with_total=with_total,
+        )
+        api = self.make_api()
+        page = self.make_one(
+            api, 
+            'http://localhost/v1/transactions', 
+            Invoice,
+            workers=4,
+            ordered=ordered,
+        )
+        guids = [r.guid for r in page]
+        expected = ['MOCK_GUID{}'.format(i) for i in range(count)]
+        if ordered:
+            self.assertEqual(guids, expected)
+        else:
+            self.assertEqual(sorted(guids), sorted(expected))
+        offsets = [
+            int(query.get('offset', 0)) 
+            for query in self.get_queries(get_method)
+        ]
+        # every page is fetched exactly once
+        self.assertEqual(
+            sorted(set(offsets) & set(range(0, count, 3))), 
+            range(0, count, 3),
+        )
+        self.assertEqual(len(offsets), len(set(offsets)))
+        return offsets
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_with_total(self, get_method):
+        offsets = self._test_parallel(
+            get_method, 
+            count=50, 
+            with_total=True, 
+            ordered=True,
+        )
+        # no request beyond total
+        self.assertEqual(sorted(offsets), range(0, 50, 3))
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_unordered(self, get_method):
+        self._test_parallel(
+            get_method, 
+            count=50, 
+            with_total=True, 
+            ordered=False,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_without_total(self, get_method):
+        self._test_parallel(
+            get_method, 
+            count=50, 
+            with_total=False, 
+            ordered=True,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_without_total_unordered(self, get_method):
+        self._test_parallel(
+            get_method, 
+            count=51, 
+            with_total=False, 
+            ordered=False,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_single_page(self, get_method):
+        offsets = self._test_parallel(
+            get_method, 
+            count=2, 
+            with_total=False, 
+            ordered=True,
+        )
+        self.assertEqual(offsets, [0])
+
+    @mock.patch('requests.Session.get')
+    def test_parallel_empty(self, get_method):
+        offsets = self._test_parallel(
+            get_method, 
+            count=0, 
+            with_total=True, 
+            ordered=True,
+        )
+        self.assertEqual(offsets, [0])
+
+    def make_stream_response(self, result, chunk_size=7):
+        body = json.dumps(result)
+        resp = mock.Mock(status_code=200)
+        resp.iter_content = lambda size: (
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+        )
+        return resp
+
+    @mock.patch('requests.Session.get')
+    def test_stream(self, get_method):
+        results = self.make_results(count=5, limit=2)
+        get_method.side_effect = lambda url, **kwargs: (
+            self.make_stream_response(results.pop(0))
+        )
+        api = self.make_api()
+        page = api.list_invoices(external_id='id', stream=True)
+        records = list(page)
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID{}'.format(i) for i in range(5)],
+        )
+        self.assertIsInstance(records[0], Invoice)
+        self.assertEqual(self.get_queries(get_method), [
+            dict(external_id='id'),
+            dict(external_id='id', offset='2', limit='2'),
+            dict(external_id='id', offset='4', limit='2'),
+            dict(external_id='id', offset='6', limit='2'),
+        ])
+        for _, kwargs in get_method.call_args_list:
+            self.assertEqual(kwargs['stream'], True)
+
+    @mock.patch('requests.Session.get')
+    def test_stream_first_item(self, get_method):
+        result = dict(
+            offset=0, 
+            limit=1000,
+            items=[dict(guid='MOCK_GUID{}'.format(i)) for i in range(1000)],
+        )
+        body = json.dumps(result)
+        read = []
+
+        def iter_content(size):
+            for i in range(0, len(body), 100):
+                read.append(i)
+                yield body[i:i + 100]
+
+        resp = mock.Mock(status_code=200, iter_content=iter_content)
+        get_method.return_value = resp
+        api = self.make_api()
+        records = iter(api.list_transactions(stream=True))
+        self.assertEqual(next(records).guid, 'MOCK_GUID0')
+        # only the beginning of the response is read
+        self.assertLess(len(read) * 100, len(body) / 10)
+        records.close()
+        resp.close.assert_called_once_with()
+
+    def test_stream_with_prefetch(self):
+        api = self.make_api()
+        with self.assertRaises(ValueError):
+            api.list_transactions(stream=True, prefetch=1)
+        with self.assertRaises(ValueError):
+            api.list_transactions(stream=True, workers=4)
+
+    @mock.patch('requests.Session.get')
+    def test_page_size(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=25, limit=20)
+        api = self.make_api()
+        records = list(api.list_invoices(page_size=10))
+        self.assertEqual(len(records), 25)
+        self.assertEqual(self.get_queries(get_method), [
+            dict(limit='10'),
+            dict(offset='10', limit='10'),
+            dict(offset='20', limit='10'),
+            dict(offset='30', limit='10'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_page_size_parallel(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=25, limit=20)
+        api = self.make_api()
+        records = list(api.list_invoices(page_size=5, workers=3))
+        self.assertEqual(len(records), 25)
+        self.assertEqual(
+            sorted(q['limit'] for q in self.get_queries(get_method)), 
+            ['5'] * 5,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_adaptive(self, get_method):
+        collection_get = self.make_collection_get(count=100, limit=20)
+
+        def get(url, **kwargs):
+            resp = collection_get(url, **kwargs)
+            resp.content = 'x' * 10 * len(resp.json()['items'])
+            return resp
+
+        get_method.side_effect = get
+        api = self.make_api()
+        # requests are fast, so page size should grow up to max_page_size
+        page = api.list_invoices(
+            page_size=5, 
+            adaptive=True, 
+            target_time=10,
+            max_page_size=30,
+        )
+        self.assertEqual(len(list(page)), 100)
+        limits = [int(q['limit']) for q in self.get_queries(get_method)]
+        self.assertEqual(limits[:4], [5, 10, 20, 30])
+
+        # pages are limited by body size, 10 bytes per record
+        get_method.reset_mock()
+        page = api.list_invoices(
+            page_size=40, 
+            adaptive=True, 
+            target_time=10,
+            max_page_bytes=200,
+        )
+        self.assertEqual(len(list(page)), 100)
+        limits = [int(q['limit']) for q in self.get_queries(get_method)]
+        self.assertEqual(limits[:3], [40, 20, 20])
+
+    def test_next_limit(self):
+        page = self.make_one(
+            self.make_api(), 
+            'http://localhost/v1/invoices', 
+            Invoice,
+            adaptive=True,
+            target_time=1.0,
+            min_page_size=10,
+            max_page_size=100,
+        )
+        # too slow
+        self.assertEqual(page._next_limit(50, 2.0, None), 25)
+        self.assertEqual(page._next_limit(50, 100.0, None), 25)
+        self.assertEqual(page._next_limit(15, 100.0, None), 10)
+        # fast
+        self.assertEqual(page._next_limit(40, 0.8, None), 50)
+        self.assertEqual(page._next_limit(40, 0.01, None), 80)
+        self.assertEqual(page._next_limit(80, 0.01, None), 100)
+        # not adaptive
+        page.adaptive = False
+        self.assertEqual(page._next_limit(40, 0.01, None), 40)
+
+    @mock.patch('requests.Session.get')
+    def test_count(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=4321, limit=20)
+        api = self.make_api()
+        page = api.list_invoices(external_id='id')
+        self.assertEqual(page.count(), 4321)
+        self.assertEqual(self.get_queries(get_method), [
+            dict(external_id='id', limit='1'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_count_without_total(self, get_method):
+        get_method.side_effect = self.make_collection_get(
+            count=10, 
+            limit=20, 
+            with_total=False,
+        )
+        api = self.make_api()
+        with self.assertRaises(BillyError):
+            api.list_invoices().count()
+
+    @mock.patch('requests.Session.get')
+    def test_slice(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=5000, limit=20)
+        api = self.make_api()
+        records = api.list_invoices()[4000:4050]
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID{}'.format(i) for i in range(4000, 4050)],
+        )
+        self.assertIsInstance(records[0], Invoice)
+        self.assertEqual(self.get_queries(get_method), [
+            dict(offset='4000', limit='50'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_slice_capped_by_server(self, get_method):
+        collection_get = self.make_collection_get(count=100, limit=20)
+
+        def get(url, **kwargs):
+            # the server only returns up to 20 records
+            url = url.replace('limit=50', 'limit=20').replace('limit=30', 'limit=20')
+            return collection_get(url, **kwargs)
+
+        get_method.side_effect = get
+        api = self.make_api()
+        records = api.list_invoices()[10:60]
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID{}'.format(i) for i in range(10, 60)],
+        )
+        self.assertEqual(self.get_queries(get_method), [
+            dict(offset='10', limit='50'),
+            dict(offset='30', limit='30'),
+            dict(offset='50', limit='10'),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_slice_beyond_end(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=30, limit=20)
+        api = self.make_api()
+        records = api.list_invoices()[25:40]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(api.list_invoices()[40:50], [])
+
+    @mock.patch('requests.Session.get')
+    def test_slice_negative(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=30, limit=20)
+        api = self.make_api()
+        records = api.list_invoices()[-3:]
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID27', 'MOCK_GUID28', 'MOCK_GUID29'],
+        )
+        self.assertEqual(self.get_queries(get_method), [
+            dict(limit='1'),
+            dict(offset='27', limit='3'),
+        ])
+        with self.assertRaises(ValueError):
+            api.list_invoices()[0:10:2]
+
+    @mock.patch('requests.Session.get')
+    def test_index(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=30, limit=20)
+        api = self.make_api()
+        page = api.list_invoices()
+        self.assertEqual(page[7].guid, 'MOCK_GUID7')
+        self.assertEqual(page[-1].guid, 'MOCK_GUID29')
+        with self.assertRaises(IndexError):
+            page[30]
+        with self.assertRaises(IndexError):
+            page[-31]
+
+    @mock.patch('requests.Session.get')
+    def test_checkpoint(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=5, limit=2)
+        api = self.make_api()
+        cursors = []
+        page = api.list_invoices(external_id='id', checkpoint=cursors.append)
+        self.assertEqual(len(list(page)), 5)
+        url = 'http://localhost/v1/invoices'
+        self.assertEqual(cursors, [
+            dict(
+                url=url, 
+                extra_query=dict(external_id='id'), 
+                offset=2, 
+                limit=2, 
+                done=False,
+            ),
+            dict(
+                url=url, 
+                extra_query=dict(external_id='id'), 
+                offset=4, 
+                limit=2, 
+                done=False,
+            ),
+            dict(
+                url=url, 
+                extra_query=dict(external_id='id'), 
+                offset=5, 
+                limit=2, 
+                done=False,
+            ),
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_checkpoint_stream(self, get_method):
+        results = self.make_results(count=3, limit=2)
+        get_method.side_effect = lambda url, **kwargs: (
+            self.make_stream_response(results.pop(0))
+        )
+        api = self.make_api()
+        cursors = []
+        page = api.list_invoices(stream=True, checkpoint=cursors.append)
+        self.assertEqual(len(list(page)), 3)
+        self.assertEqual(
+            [(c['offset'], c['limit']) for c in cursors], 
+            [(2, 2), (3, 2)],
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_resume_from_cursor(self, get_method):
+        from billy_client.api import Page
+        get_method.side_effect = self.make_collection_get(count=10, limit=3)
+        api = self.make_api()
+        page = api.list_transactions()
+        records = iter(page)
+        for _ in range(4):
+            next(records)
+        # serialize and restore the cursor like an export job would
+        cursor = json.loads(json.dumps(page.cursor))
+        self.assertEqual(cursor['offset'], 3)
+        records.close()
+
+        get_method.reset_mock()
+        page = Page.from_cursor(api, Transaction, cursor)
+        self.assertEqual(
+            [r.guid for r in page], 
+            ['MOCK_GUID{}'.format(i) for i in range(3, 10)],
+        )
+        self.assertEqual(self.get_queries(get_method)[0], dict(
+            offset='3', 
+            limit='3',
+        ))
+        self.assertEqual(page.cursor['offset'], 10)
+
+    @mock.patch('requests.Session.get')
+    def test_resume_from_offset(self, get_method):
+        get_method.side_effect = self.make_collection_get(count=10, limit=3)
+        api = self.make_api()
+        records = list(api.list_transactions(offset=8))
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID8', 'MOCK_GUID9'],
+        )
+
+    def test_checkpoint_unordered(self):
+        api = self.make_api()
+        with self.assertRaises(ValueError):
+            api.list_transactions(
+                workers=2, 
+                ordered=False, 
+                checkpoint=lambda cursor: None,
+            )
+
+    def make_linked_get(self, pages):
+        """Make a fake GET method which serves pages keyed by URL
+
+        """
+        def get(url, **kwargs):
+            base, _, query = url.partition('?')
+            key = (base, tuple(sorted(urlparse.parse_qsl(query))))
+            result = pages[key]
+            return mock.Mock(json=lambda: result, status_code=200)
+        return get
+
+    @mock.patch('requests.Session.get')
+    def test_next_url(self, get_method):
+        url = 'http://localhost/v1/transactions'
+        get_method.side_effect = self.make_linked_get({
+            (url, ()): dict(
+                items=[dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID1')],
+                next_url='/v1/transactions?after=MOCK_GUID1&limit=2',
+            ),
+            (url, (('after', 'MOCK_GUID1'), ('limit', '2'))): dict(
+                items=[dict(guid='MOCK_GUID2')],
+                next_url=None,
+            ),
+        })
+        api = self.make_api()
+        for kwargs in [dict(), dict(workers=4), dict(prefetch=1)]:
+            get_method.reset_mock()
+            records = list(api.list_transactions(**kwargs))
+            self.assertEqual(
+                [r.guid for r in records], 
+                ['MOCK_GUID0', 'MOCK_GUID1', 'MOCK_GUID2'],
+            )
+            self.assertEqual(get_method.call_count, 2)
+
+    @mock.patch('requests.Session.get')
+    def test_next_cursor(self, get_method):
+        url = 'http://localhost/v1/invoices'
+        get_method.side_effect = self.make_linked_get({
+            (url, (('external_id', 'id'), ('limit', '2'))): dict(
+                limit=2,
+                items=[dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID1')],
+                next_cursor='CURSOR1',
+            ),
+            (url, (('cursor', 'CURSOR1'), ('external_id', 'id'), ('limit', '2'))): dict(
+                limit=2,
+                items=[dict(guid='MOCK_GUID2'), dict(guid='MOCK_GUID3')],
+                next_cursor='CURSOR2',
+            ),
+            (url, (('cursor', 'CURSOR2'), ('external_id', 'id'), ('limit', '2'))): dict(
+                limit=2,
+                items=[],
+                next_cursor=None,
+            ),
+        })
+        api = self.make_api()
+        cursors = []
+        page = api.list_invoices(
+            external_id='id', 
+            page_size=2, 
+            checkpoint=cursors.append,
+        )
+        self.assertEqual(
+            [r.guid for r in page], 
+            ['MOCK_GUID{}'.format(i) for i in range(4)],
+        )
+        self.assertEqual(cursors[0], dict(
+            url=url,
+            extra_query=dict(external_id='id', cursor='CURSOR1'),
+            offset=None,
+            limit=2,
+            done=False,
+        ))
+
+        # resume from the keyset cursor
+        from billy_client.api import Page
+        get_method.reset_mock()
+        page = Page.from_cursor(api, Invoice, cursors[0])
+        self.assertEqual(
+            [r.guid for r in page], 
+            ['MOCK_GUID2', 'MOCK_GUID3'],
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_resume_from_last_keyset_checkpoint(self, get_method):
+        from billy_client.api import Page
+        url = 'http://localhost/v1/invoices'
+        links = [
+            ('next_cursor', 'CURSOR1'), 
+            ('next_url', '/v1/invoices?cursor=CURSOR1&limit=2'),
+        ]
+        for name, link in links:
+            get_method.side_effect = self.make_linked_get({
+                (url, (('limit', '2'), )): {
+                    'limit': 2,
+                    'items': [dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID1')],
+                    name: link,
+                },
+                (url, (('cursor', 'CURSOR1'), ('limit', '2'))): {
+                    'limit': 2,
+                    'items': [dict(guid='MOCK_GUID2')],
+                    name: None,
+                },
+            })
+            api = self.make_api()
+            cursors = []
+            page = api.list_invoices(page_size=2, checkpoint=cursors.append)
+            self.assertEqual(len(list(page)), 3)
+            cursor = json.loads(json.dumps(cursors[-1]))
+            self.assertTrue(cursor['done'])
+            self.assertEqual(page.cursor, cursors[-1])
+
+            get_method.reset_mock()
+            page = Page.from_cursor(api, Invoice, cursor)
+            self.assertEqual(list(page), [])
+            self.assertFalse(get_method.called)
+            self.assertTrue(page.cursor['done'])
+
+    @mock.patch('requests.Session.get')
+    def test_dedupe_shifted_offsets(self, get_method):
+        results = [
+            dict(offset=0, limit=2, items=[
+                dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID1'),
+            ]),
+            # a record was inserted at the beginning, so GUID1 shows again
+            dict(offset=2, limit=2, items=[
+                dict(guid='MOCK_GUID1'), dict(guid='MOCK_GUID2'),
+            ]),
+            dict(offset=4, limit=2, items=[]),
+        ]
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+        )
+        api = self.make_api()
+        cursors = []
+        page = api.list_transactions(checkpoint=cursors.append)
+        self.assertEqual(
+            [r.guid for r in page], 
+            ['MOCK_GUID0', 'MOCK_GUID1', 'MOCK_GUID2'],
+        )
+        # skipped records still count for the offset
+        self.assertEqual(cursors[-1]['offset'], 4)
+
+    @mock.patch('requests.Session.get')
+    def test_dedupe_disabled(self, get_method):
+        results = [
+            dict(offset=0, limit=2, items=[
+                dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID0'),
+            ]),
+            dict(offset=2, limit=2, items=[]),
+        ]
+        get_method.return_value = mock.Mock(
+            json=lambda: results.pop(0),
+            status_code=200,
+        )
+        api = self.make_api()
+        records = list(api.list_transactions(dedupe_window=0))
+        self.assertEqual(len(records), 2)
+
+    def test_recent_set(self):
+        from billy_client.api import _RecentSet
+        recent = _RecentSet(3)
+        for i in range(5):
+            recent.add(i)
+        recent.add(4)
+        self.assertNotIn(0, recent)
+        self.assertNotIn(1, recent)
+        self.assertIn(2, recent)
+        self.assertIn(3, recent)
+        self.assertIn(4, recent)
+
+
+class TestIterJSONItems(unittest.TestCase):
+
+    def decode(self, body, chunk_size=1):
+        from billy_client.api import _iter_json_items
+        chunks = [
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+        ]
+        meta = {}
+        items = list(_iter_json_items(chunks, meta))
+        return items, meta
+
+    def test_decode(self):
+        data = dict(
+            limit=12345,
+            items=[
+                dict(guid='GUID1', amount=123456, items=[1, 2]),
+                dict(guid='GUID2', title='\u4e2d\u6587', ok=True, none=None),
+                3.25,
+                [],
+                'text with , ] } and "quotes"',
+            ],
+            offset=67890,
+            extra=dict(items=[1]),
+        )
+        body = json.dumps(data).encode('utf8')
+        for chunk_size in [1, 2, 3, 7, 1024]:
+            items, meta = self.decode(body, chunk_size)
+            self.assertEqual(items, data['items'])
+            self.assertEqual(meta, dict(
+                limit=12345, 
+                offset=67890, 
+                extra=dict(items=[1]),
+            ))
+
+    def test_decode_whitespace(self):
+        body = b' {\n "items" : [ 1 , 2 ] ,\n "offset" : 0 \n} '
+        items, meta = self.decode(body)
+        self.assertEqual(items, [1, 2])
+        self.assertEqual(meta, dict(offset=0))
+
+    def test_decode_empty(self):
+        self.assertEqual(self.decode(b'{}'), ([], {}))
+        self.assertEqual(
+            self.decode(b'{"items": [], "limit": 2}'), 
+            ([], dict(limit=2)),
+        )
+
+    def test_decode_truncated(self):
+        with self.assertRaises(ValueError):
+            self.decode(b'{"items": [{"guid": "GUID1"}, {"gu')
+        with self.assertRaises(ValueError):
+            self.decode(b'{"items": [1 2]}')
+
+
+class TestBoundedMap(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.api import _bounded_map
+        return _bounded_map(*args, **kwargs)
+
+    def test_ordered(self):
+        def func(i):
+            time.sleep(0.001 * (i % 3))
+            return i * 2
+        results = self.make_one(func, range(30), workers=5)
+        self.assertEqual(list(results), [i * 2 for i in range(30)])
+
+    def test_unordered(self):
+        results = self.make_one(
+            lambda i: i * 2, 
+            range(30), 
+            workers=5, 
+            ordered=False,
+        )
+        self.assertEqual(sorted(results), [i * 2 for i in range(30)])
+
+    def test_window(self):
+        taken = []
+
+        def iterable():
+            for i in range(100):
+                taken.append(i)
+                yield i
+
+        results = self.make_one(lambda i: i, iterable(), workers=2, window=4)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(taken), 5)
+        results.close()
+
+    def test_error(self):
+        def func(i):
+            if i == 3:
+                raise KeyError(i)
+            return i
+        results = self.make_one(func, range(10), workers=3)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        with self.assertRaises(KeyError):
+            next(results)
+
+
+class TestResourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def make_one(self, *args, **kwargs):
+        from billy_client import ResourceCache
+        kwargs.setdefault('timer', lambda: self.now)
+        return ResourceCache(*args, **kwargs)
+
+    def test_get_set(self):
+        cache = self.make_one()
+        customer = Customer(None, dict(guid='MOCK_GUID'))
+        self.assertEqual(cache.get(Customer, 'MOCK_GUID'), None)
+        cache.set(customer)
+        self.assertIs(cache.get(Customer, 'MOCK_GUID'), customer)
+        # keyed by resource class too
+        self.assertEqual(cache.get(Invoice, 'MOCK_GUID'), None)
+        self.assertEqual(cache.stats(), dict(
+            hits=1, 
+            misses=2, 
+            evictions=0, 
+            size=1,
+        ))
+
+    def test_ttl(self):
+        cache = self.make_one(ttls={Plan: None, Subscription: 5}, default_ttl=60)
+        cache.set(Plan(None, dict(guid='MOCK_PLAN')))
+        cache.set(Subscription(None, dict(guid='MOCK_SUBSCRIPTION')))
+        cache.set(Customer(None, dict(guid='MOCK_CUSTOMER')))
+        self.now += 10
+        self.assertNotEqual(cache.get(Plan, 'MOCK_PLAN'), None)
+        self.assertEqual(cache.get(Subscription, 'MOCK_SUBSCRIPTION'), None)
+        self.assertNotEqual(cache.get(Customer, 'MOCK_CUSTOMER'), None)
+        self.now += 100
+        self.assertNotEqual(cache.get(Plan, 'MOCK_PLAN'), None)
+        self.assertEqual(cache.get(Customer, 'MOCK_CUSTOMER'), None)
+        self.assertEqual(len(cache), 1)
+
+    def test_lru_eviction(self):
+        cache = self.make_one(max_size=2)
+        cache.set(Customer(None, dict(guid='MOCK_GUID1')))
+        cache.set(Customer(None, dict(guid='MOCK_GUID2')))
+        # touch 1, so that 2 is the least recently used one
+        cache.get(Customer, 'MOCK_GUID1')
+        cache.set(Customer(None, dict(guid='MOCK_GUID3')))
+        self.assertNotEqual(cache.get(Customer, 'MOCK_GUID1'), None)
+        self.assertEqual(cache.get(Customer, 'MOCK_GUID2'), None)
+        self.assertNotEqual(cache.get(Customer, 'MOCK_GUID3'), None)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_invalidate(self):
+        cache = self.make_one()
+        cache.set(Customer(None, dict(guid='MOCK_GUID1')))
+        cache.set(Customer(None, dict(guid='MOCK_GUID2')))
+        cache.invalidate(Customer, 'MOCK_GUID1')
+        self.assertEqual(cache.get(Customer, 'MOCK_GUID1'), None)
+        self.assertNotEqual(cache.get(Customer, 'MOCK_GUID2'), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch('requests.Session.get')
+    def test_api_get_record(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID'),
+            status_code=200,
+        )
+        cache = self.make_one()
+        api = BillyAPI('MOCK_API_KEY', endpoint='http://localhost', cache=cache)
+        customer = api.get_customer('MOCK_GUID')
+        self.assertIs(api.get_customer('MOCK_GUID'), customer)
+        self.assertEqual(get_method.call_count, 1)
+        # different resource type is not a hit
+        api.get_plan('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 2)
+
+    @mock.patch('requests.Session.get')
+    @mock.patch('requests.Session.post')
+    def test_api_mutation(self, post_method, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID', canceled=False),
+            status_code=200,
+        )
+        post_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID', canceled=True),
+            status_code=200,
+        )
+        cache = self.make_one()
+        api = BillyAPI('MOCK_API_KEY', endpoint='http://localhost', cache=cache)
+
+        subscription = api.get_subscription('MOCK_GUID')
+        subscription.cancel()
+        self.assertEqual(api.get_subscription('MOCK_GUID').canceled, True)
+        self.assertEqual(get_method.call_count, 1)
+
+        invoice = api.get_invoice('MOCK_GUID')
+        invoice.refund(amount=100)
+        self.assertEqual(cache.get(Invoice, 'MOCK_GUID'), None)
+        api.get_invoice('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 3)
+
+
+class TestThreadedAPI(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client import ThreadedBillyAPI
+        return ThreadedBillyAPI(*args, **kwargs)
+
+    @mock.patch('requests.Session.get')
+    def test_get_record(self, get_method):
+        get_method.side_effect = lambda url, **kwargs: mock.Mock(
+            json=lambda: dict(guid=url.rsplit('/', 1)[1]),
+            status_code=200,
+        )
+        with self.make_one(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost',
+            max_workers=4,
+        ) as threaded_api:
+            results = [
+                threaded_api.get_customer('MOCK_GUID{}'.format(i))
+                for i in range(20)
+            ]
+            guids = [result.get(timeout=5).guid for result in results]
+        self.assertEqual(guids, ['MOCK_GUID{}'.format(i) for i in range(20)])
+        self.assertEqual(get_method.call_count, 20)
+
+    @mock.patch('requests.Session.get')
+    def test_get_record_not_found(self, get_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(),
+            status_code=404,
+            content='Not found',
+        )
+        with self.make_one('MOCK_API_KEY', endpoint='http://localhost') as threaded_api:
+            result = threaded_api.get_invoice('MOCK_GUID')
+            with self.assertRaises(NotFoundError):
+                result.get(timeout=5)
+
+    @mock.patch('requests.Session.post')
+    def test_wrap_resource(self, post_method):
+        post_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_INVOICE_GUID'),
+            status_code=200,
+        )
+        with self.make_one('MOCK_API_KEY', endpoint='http://localhost') as threaded_api:
+            customer = Customer(threaded_api.api, dict(guid='MOCK_CUSTOMER_GUID'))
+            wrapped = threaded_api.wrap(customer)
+            self.assertEqual(wrapped.guid, 'MOCK_CUSTOMER_GUID')
+            invoice = wrapped.invoice(amount=100).get(timeout=5)
+        self.assertEqual(invoice.guid, 'MOCK_INVOICE_GUID')
+        post_method.assert_called_once_with(
+            'http://localhost/v1/invoices', 
+            data=dict(customer_guid='MOCK_CUSTOMER_GUID', amount=100),
+            auth=('MOCK_API_KEY', ''),
+            timeout=BillyAPI.DEFAULT_TIMEOUT,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_list_records(self, get_method):
+        result = [
+            dict(offset=0, limit=2, items=[dict(guid='MOCK_GUID1')]),
+            dict(offset=2, limit=2, items=[]),
+        ]
+        get_method.return_value = mock.Mock(
+            json=lambda: result.pop(0),
+            status_code=200,
+        )
+        with self.make_one('MOCK_API_KEY', endpoint='http://localhost') as threaded_api:
+            records = list(threaded_api.list_plans())
+        self.assertEqual([r.guid for r in records], ['MOCK_GUID1'])
+
+    @mock.patch('requests.Session.get')
+    def test_list_records_lazily(self, get_method):
+        import threading
+
+        def get(url, **kwargs):
+            query = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+            offset = int(query.get('offset', 0))
+            threads.add(threading.current_thread())
+            data = dict(
+                offset=offset, 
+                limit=2, 
+                items=[
+                    dict(guid='MOCK_GUID{}'.format(i)) 
+                    for i in range(offset, min(offset + 2, 100))
+                ],
+            )
+            return mock.Mock(json=lambda: data, status_code=200)
+        get_method.side_effect = get
+        threads = set()
+        with self.make_one('MOCK_API_KEY', endpoint='http://localhost') as threaded_api:
+            records = iter(threaded_api.list_plans(page_size=2))
+            guids = [next(records).guid for _ in range(3)]
+            self.assertEqual(guids, ['MOCK_GUID0', 'MOCK_GUID1', 'MOCK_GUID2'])
+            # pages are fetched one batch ahead, not all at once
+            self.assertTrue(get_method.call_count <= 3)
+            records.close()
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_pass_through(self):
+        hook = mock.Mock()
+        with self.make_one('MOCK_API_KEY', endpoint='http://localhost') as threaded_api:
+            threaded_api.add_hook('on_page', hook)
+            self.assertEqual(threaded_api.api.hooks['on_page'], [hook])
+            with threaded_api.deadline(5):
+                self.assertNotEqual(threaded_api.api._current_deadline(), None)
+            wrapped = threaded_api.wrap(Customer(threaded_api.api, dict(guid='G')))
+            self.assertEqual(wrapped.BASE_URI, Customer.BASE_URI)
+
+
+class MockResponseTestCase(unittest.TestCase):
+    """Base of test cases which mock the responses of session methods
+
+    """
+
+    def make_api(self, **kwargs):
+        from billy_client import NO_RETRY
+        kwargs.setdefault('retry_policy', NO_RETRY)
+        return BillyAPI('MOCK_API_KEY', endpoint='http://localhost', **kwargs)
+
+    def make_response(self, json_data=None, status_code=200, headers=None):
+        return mock.Mock(
+            json=lambda: json_data,
+            status_code=status_code,
+            content=json.dumps(json_data),
+            headers=headers or {},
+        )
+
+    def responses(self, *results):
+        """Make a side effect returns results in order, exceptions are raised
+
+        """
+        results = list(results)
+
+        def side_effect(*args, **kwargs):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return side_effect
+
+
+class TestRetryPolicy(MockResponseTestCase):
+
+    def make_policy(self, **kwargs):
+        from billy_client.api import RetryPolicy
+        kwargs.setdefault('sleep', mock.Mock())
+        kwargs.setdefault('random', lambda: 1.0)
+        return RetryPolicy(**kwargs)
+
+    def test_delay(self):
+        policy = self.make_policy(backoff=0.5, max_backoff=3)
+        self.assertEqual(
+            [policy.delay(attempt) for attempt in range(1, 6)], 
+            [0.5, 1, 2, 3, 3],
+        )
+        policy = self.make_policy(backoff=1, random=lambda: 0.25)
+        self.assertEqual(policy.delay(3), 1)
+
+    def test_delay_retry_after(self):
+        policy = self.make_policy()
+        resp = self.make_response(status_code=429, headers={'Retry-After': '7'})
+        self.assertEqual(policy.delay(1, resp), 7)
+        resp = self.make_response(status_code=503, headers={
+            'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        })
+        self.assertEqual(policy.delay(1, resp), 0)
+        resp = self.make_response(status_code=500, headers={'Retry-After': '7'})
+        self.assertEqual(policy.delay(1, resp), 0.5)
+
+    @mock.patch('requests.Session.get')
+    def test_retry_get(self, get_method):
+        get_method.side_effect = self.responses(
+            self.make_response(status_code=503),
+            requests.ConnectionError('connection reset'),
+            self.make_response(dict(guid='MOCK_GUID')),
+        )
+        policy = self.make_policy()
+        api = self.make_api(retry_policy=policy)
+        invoice = api.get_invoice('MOCK_GUID')
+        self.assertEqual(invoice.guid, 'MOCK_GUID')
+        self.assertEqual(get_method.call_count, 3)
+        self.assertEqual(
+            [args for args, _ in policy.sleep.call_args_list], 
+            [(0.5, ), (1.0, )],
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_retry_max_attempts(self, get_method):
+        get_method.return_value = self.make_response(status_code=502)
+        api = self.make_api(retry_policy=self.make_policy(max_attempts=4))
+        with self.assertRaises(BillyError):
+            api.get_invoice('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 4)
+
+        get_method.reset_mock()
+        get_method.side_effect = requests.ConnectionError('connection reset')
+        with self.assertRaises(requests.ConnectionError):
+            api.get_invoice('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 4)
+
+    @mock.patch('requests.Session.get')
+    def test_retry_not_retryable(self, get_method):
+        get_method.return_value = self.make_response(status_code=404)
+        api = self.make_api(retry_policy=self.make_policy())
+        with self.assertRaises(NotFoundError):
+            api.get_invoice('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 1)
+
+    @mock.patch('requests.Session.get')
+    def test_retry_budget(self, get_method):
+        get_method.return_value = self.make_response(
+            status_code=429, 
+            headers={'Retry-After': '120'},
+        )
+        policy = self.make_policy(budget=60)
+        api = self.make_api(retry_policy=policy)
+        with self.assertRaises(BillyError):
+            api.get_invoice('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 1)
+        self.assertFalse(policy.sleep.called)
+
+    @mock.patch('requests.Session.post')
+    def test_retry_unsafe_post(self, post_method):
+        post_method.return_value = self.make_response(status_code=503)
+        api = self.make_api(retry_policy=self.make_policy())
+        plan = Plan(api, dict(guid='MOCK_PLAN_GUID'))
+        with self.assertRaises(BillyError):
+            plan.subscribe('MOCK_CUSTOMER_GUID')
+        self.assertEqual(post_method.call_count, 1)
+
+        post_method.reset_mock()
+        post_method.side_effect = requests.ConnectionError('connection reset')
+        with self.assertRaises(requests.ConnectionError):
+            plan.subscribe('MOCK_CUSTOMER_GUID')
+        self.assertEqual(post_method.call_count, 1)
+
+        # refused by server, safe to repeat
+        post_method.reset_mock()
+        post_method.side_effect = self.responses(
+            self.make_response(status_code=429),
+            self.make_response(dict(guid='MOCK_GUID')),
+        )
+        subscription = plan.subscribe('MOCK_CUSTOMER_GUID')
+        self.assertEqual(subscription.guid, 'MOCK_GUID')
+        self.assertEqual(post_method.call_count, 2)
+
+    @mock.patch('requests.Session.post')
+    def test_retry_invoice_with_external_id(self, post_method):
+        api = self.make_api(retry_policy=self.make_policy())
+        customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
+        post_method.side_effect = self.responses(
+            requests.ConnectionError('connection reset'),
+            self.make_response(dict(guid='MOCK_GUID')),
+        )
+        invoice = customer.invoice(amount=100, external_id='MOCK_ID')
+        self.assertEqual(invoice.guid, 'MOCK_GUID')
+        self.assertEqual(post_method.call_count, 2)
+
+        post_method.reset_mock()
+        post_method.side_effect = requests.ConnectionError('connection reset')
+        with self.assertRaises(requests.ConnectionError):
+            customer.invoice(amount=100)
+        self.assertEqual(post_method.call_count, 1)
+
+    @mock.patch('requests.Session.get')
+    def test_retry_page(self, get_method):
+        get_method.side_effect = self.responses(
+            self.make_response(dict(
+                offset=0, 
+                limit=1, 
+                items=[dict(guid='MOCK_GUID0')],
+            )),
+            requests.ConnectionError('connection reset'),
+            self.make_response(status_code=502),
+            self.make_response(dict(
+                offset=1, 
+                limit=1, 
+                items=[dict(guid='MOCK_GUID1')],
+            )),
+            self.make_response(dict(offset=2, limit=1, items=[])),
+        )
+        api = self.make_api(retry_policy=self.make_policy())
+        records = list(api.list_invoices())
+        self.assertEqual(
+            [r.guid for r in records], 
+            ['MOCK_GUID0', 'MOCK_GUID1'],
+        )
+        self.assertEqual(get_method.call_count, 5)
+
+    @mock.patch('requests.Session.get')
+    def test_page_error(self, get_method):
+        get_method.return_value = self.make_response(status_code=500)
+        api = self.make_api()
+        with self.assertRaises(BillyError):
+            list(api.list_invoices())
+        self.assertEqual(get_method.call_count, 1)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def timer(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+    def make_one(self, *args, **kwargs):
+        from billy_client import RateLimiter
+        kwargs.setdefault('timer', self.timer)
+        kwargs.setdefault('sleep', self.sleep)
+        return RateLimiter(*args, **kwargs)
+
+    def test_token_bucket(self):
+        from billy_client.api import TokenBucket
+        bucket = TokenBucket(2, burst=3, timer=self.timer, sleep=self.sleep)
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0, 0, 0, 0.5, 1.0])
+        self.now = 1.0
+        # the waiting callers took the tokens refilled in the meantime
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.now = 10.0
+        # never more than burst tokens
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 0, 0.5])
+
+    def test_acquire(self):
+        limiter = self.make_one(10, burst=2)
+        for _ in range(4):
+            self.assertTrue(limiter.acquire('GET'))
+        self.assertEqual(self.sleeps, [0.1, 0.2])
+
+    def test_acquire_timeout(self):
+        limiter = self.make_one(10, burst=1)
+        self.assertTrue(limiter.acquire('GET', timeout=0))
+        self.assertFalse(limiter.acquire('GET', timeout=0.05))
+        self.assertEqual(self.sleeps, [])
+        # the token refused is given back
+        self.assertTrue(limiter.acquire('GET', timeout=0.1))
+        self.assertEqual(self.sleeps, [0.1])
+
+    def test_separate_write_bucket(self):
+        limiter = self.make_one(10, burst=1, write_rate=1, write_burst=1)
+        limiter.acquire('GET')
+        limiter.acquire('POST')
+        self.assertEqual(self.sleeps, [])
+        limiter.acquire('POST')
+        limiter.acquire('GET')
+        self.assertEqual(self.sleeps, [1.0, 0.1])
+
+    def test_shared_write_bucket(self):
+        limiter = self.make_one(1, burst=1)
+        limiter.acquire('GET')
+        limiter.acquire('POST')
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_threads(self):
+        import threading
+        limiter = self.make_one(100, burst=1)
+        lock = threading.Lock()
+
+        def sleep(seconds):
+            with lock:
+                self.sleeps.append(seconds)
+        limiter.read_bucket.sleep = sleep
+
+        def run():
+            for _ in range(50):
+                limiter.acquire('GET')
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every caller waits for a distinct token
+        self.assertEqual(
+            sorted(round(delay, 6) for delay in self.sleeps), 
+            [round(i * 0.01, 6) for i in range(1, 200)],
+        )
+
+    @mock.patch('requests.Session.post')
+    @mock.patch('requests.Session.get')
+    def test_api_requests(self, get_method, post_method):
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID'),
+            status_code=200,
+        )
+        post_method.return_value = get_method.return_value
+        limiter = mock.Mock()
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            rate_limiter=limiter,
+        )
+        customer = api.get_customer('MOCK_GUID')
+        customer.invoice(amount=100)
+        self.assertEqual(
+            [args for args, _ in limiter.acquire.call_args_list], 
+            [('GET', ), ('POST', )],
+        )
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+
+    def timer(self):
+        return self.now
+
+    def make_one(self, **kwargs):
+        from billy_client import CircuitBreaker
+        kwargs.setdefault('timer', self.timer)
+        return CircuitBreaker(**kwargs)
+
+    def call(self, breaker, failed=False, elapsed=0.1):
+        token = breaker.before_request('MOCK_METHOD')
+        breaker.record(token, failed, elapsed)
+
+    def test_trip_on_failure_rate(self):
+        from billy_client import CircuitOpenError
+        breaker = self.make_one(failure_threshold=0.5, min_requests=4, window=4)
+        self.call(breaker, failed=True)
+        self.call(breaker, failed=True)
+        self.call(breaker, failed=True)
+        # not enough requests yet
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.call(breaker)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('MOCK_METHOD')
+
+    def test_window(self):
+        breaker = self.make_one(failure_threshold=0.5, min_requests=4, window=4)
+        self.call(breaker, failed=True)
+        for _ in range(4):
+            self.call(breaker)
+        self.call(breaker, failed=True)
+        # failures fell out of the window
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.call(breaker, failed=True)
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+    def test_trip_on_latency(self):
+        breaker = self.make_one(min_requests=2, slow_threshold=1.0)
+        self.call(breaker, elapsed=0.5)
+        self.call(breaker, elapsed=3.0)
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+    def test_half_open(self):
+        from billy_client import CircuitOpenError
+        breaker = self.make_one(min_requests=1, reset_timeout=10, probes=2)
+        self.call(breaker, failed=True)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.now = 9.0
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('MOCK_METHOD')
+
+        self.now = 10.0
+        token1 = breaker.before_request('MOCK_METHOD')
+        token2 = breaker.before_request('MOCK_METHOD')
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        # only probes are let through
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('MOCK_METHOD')
+        breaker.record(token1, False, 0.1)
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        breaker.record(token2, True, 0.1)
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        self.now = 20.0
+        self.call(breaker)
+        self.call(breaker)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.call(breaker)
+
+    def test_ignore_outcomes_before_state_change(self):
+        from billy_client import CircuitOpenError
+        breaker = self.make_one(min_requests=1, reset_timeout=10)
+        slow_token = breaker.before_request('MOCK_METHOD')
+        self.call(breaker, failed=True)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.now = 10.0
+        probe_token = breaker.before_request('MOCK_METHOD')
+        # the slow request sent while closed is not a probe
+        breaker.record(slow_token, False, 10.0)
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('MOCK_METHOD')
+        breaker.record(probe_token, False, 0.1)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_release(self):
+        breaker = self.make_one(min_requests=1, reset_timeout=10)
+        self.call(breaker, failed=True)
+        self.now = 10.0
+        token = breaker.before_request('MOCK_METHOD')
+        breaker.release(token)
+        # the probe slot is free again
+        breaker.before_request('MOCK_METHOD')
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+
+    @mock.patch('requests.Session.get')
+    def test_api_release_on_unexpected_error(self, get_method):
+        from billy_client import NO_RETRY
+        get_method.side_effect = ValueError('boom')
+        breaker = self.make_one(min_requests=1, reset_timeout=10)
+        self.call(breaker, failed=True)
+        self.now = 10.0
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            retry_policy=NO_RETRY,
+            circuit_breaker=breaker,
+        )
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                api.get_customer('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 2)
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+
+    @mock.patch('requests.Session.get')
+    def test_api_fail_fast(self, get_method):
+        from billy_client import NO_RETRY
+        from billy_client import CircuitOpenError
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(),
+            status_code=503,
+            content='Server error',
+        )
+        breaker = self.make_one(min_requests=2, reset_timeout=10)
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            retry_policy=NO_RETRY,
+            circuit_breaker=breaker,
+        )
+        for _ in range(2):
+            with self.assertRaises(BillyError):
+                api.get_customer('MOCK_GUID')
+        with self.assertRaises(CircuitOpenError):
+            api.get_customer('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 2)
+
+        get_method.return_value = mock.Mock(
+            json=lambda: dict(guid='MOCK_GUID'),
+            status_code=200,
+        )
+        self.now = 10.0
+        self.assertEqual(api.get_customer('MOCK_GUID').guid, 'MOCK_GUID')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    @mock.patch('requests.Session.get')
+    def test_api_connection_error(self, get_method):
+        from billy_client import NO_RETRY
+        get_method.side_effect = requests.ConnectionError('connection reset')
+        breaker = self.make_one(min_requests=1)
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            retry_policy=NO_RETRY,
+            circuit_breaker=breaker,
+        )
+        with self.assertRaises(requests.ConnectionError):
+            api.get_customer('MOCK_GUID')
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+
+class TestTimeout(MockResponseTestCase):
+
+    @mock.patch('requests.Session.get')
+    def test_timeout(self, get_method):
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api(timeout=3)
+        api.get_customer('MOCK_GUID')
+        self.assertEqual(get_method.call_args[1]['timeout'], 3)
+
+        api = self.make_api(timeout=None)
+        api.get_customer('MOCK_GUID')
+        self.assertNotIn('timeout', get_method.call_args[1])
+
+    @mock.patch('requests.Session.get')
+    def test_timeout_error(self, get_method):
+        from billy_client import BillyTimeoutError
+        from billy_client.api import RetryPolicy
+        get_method.side_effect = requests.Timeout('read timed out')
+        api = self.make_api(retry_policy=RetryPolicy(sleep=lambda _: None))
+        with self.assertRaises(BillyTimeoutError):
+            api.get_customer('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 3)
+
+    @mock.patch('requests.Session.get')
+    def test_deadline(self, get_method):
+        from billy_client import BillyTimeoutError
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api()
+        with api.deadline(5):
+            api.get_customer('MOCK_GUID')
+            connect, read = get_method.call_args[1]['timeout']
+            self.assertTrue(4 < connect <= 5)
+            self.assertTrue(4 < read <= 5)
+            # nested deadline cannot extend the outer one
+            with api.deadline(60):
+                api.get_customer('MOCK_GUID')
+                connect, read = get_method.call_args[1]['timeout']
+                self.assertTrue(4 < connect <= 5)
+        api.get_customer('MOCK_GUID')
+        self.assertEqual(
+            get_method.call_args[1]['timeout'], 
+            BillyAPI.DEFAULT_TIMEOUT,
+        )
+
+        get_method.reset_mock()
+        with api.deadline(0):
+            with self.assertRaises(BillyTimeoutError):
+                api.get_customer('MOCK_GUID')
+        self.assertFalse(get_method.called)
+
+    @mock.patch('requests.Session.get')
+    def test_deadline_with_rate_limiter(self, get_method):
+        from billy_client import BillyTimeoutError
+        from billy_client import RateLimiter
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api(rate_limiter=RateLimiter(rate=0.5))
+        started = time.time()
+        with api.deadline(0.5):
+            api.get_customer('MOCK_GUID')
+            # waiting 2 seconds for the next token would exceed the deadline
+            with self.assertRaises(BillyTimeoutError):
+                api.get_customer('MOCK_GUID')
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(get_method.call_count, 1)
+
+        # the timeout is capped by the time left after waiting
+        api = self.make_api(rate_limiter=RateLimiter(rate=10))
+        with api.deadline(1):
+            api.get_customer('MOCK_GUID')
+            api.get_customer('MOCK_GUID')
+        _, read = get_method.call_args[1]['timeout']
+        self.assertTrue(read <= 0.91)
+
+    @mock.patch('requests.Session.get')
+    def test_deadline_stops_retrying(self, get_method):
+        from billy_client.api import RetryPolicy
+        get_method.return_value = self.make_response(status_code=503)
+        policy = RetryPolicy(backoff=10, random=lambda: 1.0, sleep=mock.Mock())
+        api = self.make_api(retry_policy=policy)
+        with api.deadline(5):
+            with self.assertRaises(BillyError):
+                api.get_customer('MOCK_GUID')
+        self.assertEqual(get_method.call_count, 1)
+        self.assertFalse(policy.sleep.called)
+
+    @mock.patch('requests.Session.get')
+    def test_page_timeout(self, get_method):
+        from billy_client import BillyTimeoutError
+
+        def get(url, **kwargs):
+            time.sleep(0.1)
+            return self.make_response(dict(
+                offset=0, 
+                limit=1, 
+                items=[dict(guid='MOCK_GUID')],
+            ))
+        get_method.side_effect = get
+        api = self.make_api()
+        page = api.list_invoices(timeout=0.15, dedupe_window=0)
+        records = []
+        with self.assertRaises(BillyTimeoutError):
+            for record in page:
+                records.append(record)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(get_method.call_count, 2)
+        _, read = get_method.call_args[1]['timeout']
+        self.assertTrue(read <= 0.05)
+
+    @mock.patch('requests.Session.get')
+    def test_get_many_timeout(self, get_method):
+        from billy_client import BillyTimeoutError
+
+        def get(url, **kwargs):
+            time.sleep(0.1)
+            return self.make_response(dict(guid=url.rsplit('/', 1)[1]))
+        get_method.side_effect = get
+        api = self.make_api()
+        with self.assertRaises(BillyTimeoutError):
+            api.get_many(
+                Customer, 
+                ['MOCK_GUID1', 'MOCK_GUID2', 'MOCK_GUID3'], 
+                workers=1, 
+                timeout=0.05,
+            )
+        self.assertEqual(get_method.call_count, 1)
+
+    @mock.patch('requests.Session.post')
+    def test_invoice_many_timeout(self, post_method):
+        from billy_client import BillyTimeoutError
+        post_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api()
+        with api.deadline(0):
+            results = list(api.invoice_many([
+                dict(customer_guid='MOCK_CUSTOMER_GUID', amount=100),
+            ]))
+        self.assertEqual(results[0].status, InvoiceResult.STATUS_ERROR)
+        self.assertTrue(isinstance(results[0].error, BillyTimeoutError))
+        self.assertFalse(post_method.called)
+
+    @mock.patch('requests.Session.get')
+    def test_threaded_deadline(self, get_method):
+        from billy_client import ThreadedBillyAPI
+        from billy_client import BillyTimeoutError
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        with ThreadedBillyAPI(api=self.make_api()) as threaded_api:
+            with threaded_api.api.deadline(0):
+                result = threaded_api.get_customer('MOCK_GUID')
+            with self.assertRaises(BillyTimeoutError):
+                result.get(timeout=5)
+        self.assertFalse(get_method.called)
+
+
+class TestHooks(MockResponseTestCase):
+
+    def add_hooks(self, api):
+        events = []
+        for event in BillyAPI.HOOK_EVENTS:
+            api.add_hook(
+                event, 
+                lambda payload, event=event: events.append((event, payload)),
+            )
+        return events
+
+    @mock.patch('requests.Session.get')
+    def test_request_events(self, get_method):
+        resp = self.make_response(dict(guid='MOCK_GUID'))
+        get_method.return_value = resp
+        api = self.make_api()
+        events = self.add_hooks(api)
+        api.get_customer('MOCK_GUID')
+        self.assertEqual([name for name, _ in events], [
+            'before_request', 'after_response',
+        ])
+        before, after = [payload for _, payload in events]
+        self.assertEqual(before.method_name, 'get_customer')
+        self.assertEqual(before.http_method, 'GET')
+        self.assertEqual(before.url_template, '/v1/customers/{guid}')
+        self.assertEqual(before.url, 'http://localhost/v1/customers/MOCK_GUID')
+        self.assertEqual(before.retries, 0)
+        self.assertEqual(before.status, None)
+        self.assertEqual(before.latency, None)
+        self.assertEqual(before.request_size, 0)
+        self.assertEqual(after.status, 200)
+        self.assertTrue(after.latency >= 0)
+        self.assertEqual(after.response_size, len(resp.content))
+        self.assertEqual(after.error, None)
+
+    @mock.patch('requests.Session.post')
+    def test_request_size(self, post_method):
+        post_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api()
+        events = self.add_hooks(api)
+        customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
+        customer.invoice(amount=100, title='T\xe9st')
+        _, before = events[0]
+        self.assertEqual(before.method_name, 'invoice')
+        self.assertEqual(before.url_template, '/v1/invoices')
+        self.assertEqual(before.request_size, len(
+            'customer_guid=MOCK_CUSTOMER_GUID&amount=100&title=T%C3%A9st'
+        ))
+
+    @mock.patch('requests.Session.get')
+    def test_retry_events(self, get_method):
+        from billy_client.api import RetryPolicy
+        get_method.side_effect = self.responses(
+            requests.ConnectionError('connection reset'),
+            self.make_response(status_code=503),
+            self.make_response(dict(guid='MOCK_GUID')),
+        )
+        api = self.make_api(retry_policy=RetryPolicy(sleep=lambda _: None))
+        events = self.add_hooks(api)
+        api.get_invoice('MOCK_GUID')
+        self.assertEqual(
+            [(name, payload.retries, payload.status) for name, payload in events], 
+            [
+                ('before_request', 0, None),
+                ('on_error', 0, None),
+                ('before_request', 1, None),
+                ('after_response', 1, 503),
+                ('before_request', 2, None),
+                ('after_response', 2, 200),
+            ],
+        )
+        self.assertTrue(isinstance(events[1][1].error, requests.ConnectionError))
+
+    @mock.patch('requests.Session.get')
+    def test_deadline_error_event(self, get_method):
+        from billy_client import BillyTimeoutError
+        api = self.make_api()
+        events = self.add_hooks(api)
+        with api.deadline(0):
+            with self.assertRaises(BillyTimeoutError):
+                api.get_customer('MOCK_GUID')
+        self.assertEqual(len(events), 1)
+        name, payload = events[0]
+        self.assertEqual(name, 'on_error')
+        self.assertEqual(payload.method_name, 'get_customer')
+        self.assertTrue(isinstance(payload.error, BillyTimeoutError))
+
+    @mock.patch('requests.Session.get')
+    def test_page_events(self, get_method):
+        results = [
+            dict(offset=0, limit=2, items=[dict(guid='MOCK_GUID0'), dict(guid='MOCK_GUID1')]),
+            dict(offset=2, limit=2, items=[dict(guid='MOCK_GUID2')]),
+            dict(offset=4, limit=2, items=[]),
+        ]
+        get_method.side_effect = lambda url, **kwargs: self.make_response(
+            results.pop(0),
+        )
+        api = self.make_api()
+        pages = []
+        api.add_hook('on_page', pages.append)
+        customer = Customer(api, dict(guid='MOCK_CUSTOMER_GUID'))
+        list(customer.list_invoices())
+        self.assertEqual(
+            [(p.method_name, p.offset, p.limit, p.count) for p in pages], 
+            [
+                ('list_invoices', 0, 2, 2),
+                ('list_invoices', 2, 2, 1),
+                ('list_invoices', 4, 2, 0),
+            ],
+        )
+        self.assertTrue(all(p.size > 0 and p.latency >= 0 for p in pages))
+
+    @mock.patch('requests.Session.get')
+    def test_hook_error_ignored(self, get_method):
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api()
+
+        def broken_hook(event):
+            raise ValueError('broken')
+        api.add_hook('after_response', broken_hook)
+        with mock.patch.object(api.logger, 'exception') as log_exception:
+            self.assertEqual(api.get_customer('MOCK_GUID').guid, 'MOCK_GUID')
+        self.assertEqual(log_exception.call_count, 1)
+
+    def test_add_remove_hook(self):
+        api = self.make_api()
+        hook = mock.Mock()
+        with self.assertRaises(ValueError):
+            api.add_hook('on_something', hook)
+        api.add_hook('on_page', hook)
+        self.assertEqual(api.hooks['on_page'], [hook])
+        api.remove_hook('on_page', hook)
+        self.assertEqual(api.hooks['on_page'], [])
+
+    @mock.patch('requests.Session.get')
+    def test_no_hooks(self, get_method):
+        get_method.return_value = self.make_response(dict(guid='MOCK_GUID'))
+        api = self.make_api()
+        with mock.patch.object(api, '_request_event') as request_event:
+            api.get_customer('MOCK_GUID')
+        self.assertFalse(request_event.called)
+
+    def test_url_template(self):
+        api = self.make_api()
+        self.assertEqual(
+            api._url_template('http://localhost/v1/companies'), 
+            '/v1/companies',
+        )
+        self.assertEqual(
+            api._url_template('http://localhost/v1/customers/CU1/invoices?offset=2'), 
+            '/v1/customers/{guid}/invoices',
+        )
+        self.assertEqual(
+            api._url_template('http://localhost/v1/subscriptions/SU1/cancel'), 
+            '/v1/subscriptions/{guid}/cancel',
+        )
@@ -0,0 +1,254 @@
+from __future__ import unicode_literals
+import os
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+import urlparse
+from StringIO import StringIO
+
+import mock
+
+from billy_client.api import BillyAPI
+from billy_client.api import Customer
+from billy_client.api import Invoice
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def make_get(self, count, fail_at=None, extra=None):
+        """Make a mock get method which serves count records by offset and 
+        limit, and raises an error when requesting offset fail_at. Records 
+        get fields in extra dict as well if it's given
+
+        """
+        def get(url, **kwargs):
+            o = urlparse.urlparse(url)
+            query = dict(urlparse.parse_qsl(o.query))
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', 2))
+            if offset == fail_at:
+                raise IOError('connection reset')
+            data = dict(
+                offset=offset,
+                limit=limit,
+                items=[
+                    dict(
+                        extra or {}, 
+                        guid='MOCK_GUID{}'.format(i), 
+                        title='T\xe9st {}'.format(i),
+                    )
+                    for i in range(offset, min(offset + limit, count))
+                ],
+            )
+            return mock.Mock(json=lambda: data, status_code=200)
+        return get
+
+    def main(self, argv):
+        from billy_client.export import main
+        self.stdout = StringIO()
+        self.stderr = StringIO()
+        return main(
+            ['--api-key', 'MOCK_API_KEY', '--endpoint', 'http://localhost'] + argv,
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
+
+    @mock.patch('requests.Session.get')
+    def test_ndjson(self, get_method):
+        get_method.side_effect = self.make_get(count=5)
+        self.assertEqual(self.main(['invoices']), 0)
+        lines = self.stdout.getvalue().splitlines()
+        self.assertEqual(
+            [json.loads(line)['guid'] for line in lines],
+            ['MOCK_GUID{}'.format(i) for i in range(5)],
+        )
+        url = get_method.call_args_list[0][0][0]
+        self.assertTrue(url.startswith('http://localhost/v1/invoices'))
+
+    @mock.patch('requests.Session.get')
+    def test_csv_gzip(self, get_method):
+        get_method.side_effect = self.make_get(count=3)
+        output = self.path('invoices.csv.gz')
+        self.main(['invoices', '-f', 'csv', '--gzip', '-o', output])
+        with gzip.open(output, 'rb') as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows, [
+            [b'guid', b'title'],
+            [b'MOCK_GUID0', 'T\xe9st 0'.encode('utf8')],
+            [b'MOCK_GUID1', 'T\xe9st 1'.encode('utf8')],
+            [b'MOCK_GUID2', 'T\xe9st 2'.encode('utf8')],
+        ])
+
+    @mock.patch('requests.Session.get')
+    def test_parent_and_external_id(self, get_method):
+        get_method.side_effect = self.make_get(count=1)
+        self.main([
+            'transactions', 
+            '--parent', 'customer:MOCK_CUSTOMER_GUID', 
+            '--external-id', 'MOCK_ID',
+        ])
+        o = urlparse.urlparse(get_method.call_args_list[0][0][0])
+        self.assertEqual(
+            o.path, 
+            '/v1/customers/MOCK_CUSTOMER_GUID/transactions',
+        )
+        self.assertEqual(urlparse.parse_qs(o.query), dict(
+            external_id=['MOCK_ID'],
+        ))
+
+    def test_invalid_parent(self):
+        from billy_client.export import make_page
+        from billy_client.export import parse_args
+        api = BillyAPI('MOCK_API_KEY', endpoint='http://localhost')
+        args = parse_args(['plans', '--parent', 'customer:MOCK_GUID'])
+        with self.assertRaises(ValueError):
+            make_page(api, args)
+        args = parse_args(['plans', '--parent', 'MOCK_GUID'])
+        with self.assertRaises(ValueError):
+            make_page(api, args)
+
+    @mock.patch('requests.Session.get')
+    def test_resume(self, get_method):
+        output = self.path('invoices.ndjson')
+        checkpoint = self.path('invoices.cursor')
+        argv = [
+            'invoices', 
+            '-o', output, 
+            '--page-size', '2', 
+            '--checkpoint', checkpoint,
+        ]
+        get_method.side_effect = self.make_get(count=7, fail_at=4)
+        with self.assertRaises(IOError):
+            self.main(argv)
+        with open(checkpoint, 'rb') as checkpoint_file:
+            cursor = json.load(checkpoint_file)['cursor']
+        self.assertEqual(cursor['offset'], 4)
+        self.assertEqual(cursor['limit'], 2)
+        # records written after the checkpoint are dropped when resuming
+        with open(output, 'ab') as ndjson_file:
+            ndjson_file.write(b'{"guid": "MOCK_GUID4"}\n{"gu')
+
+        get_method.side_effect = self.make_get(count=7)
+        self.main(argv + ['--resume'])
+        with open(output, 'rb') as ndjson_file:
+            lines = ndjson_file.read().splitlines()
+        self.assertEqual(
+            [json.loads(line)['guid'] for line in lines],
+            ['MOCK_GUID{}'.format(i) for i in range(7)],
+        )
+        o = urlparse.urlparse(get_method.call_args_list[-4][0][0])
+        self.assertEqual(urlparse.parse_qs(o.query), dict(
+            offset=['4'],
+            limit=['2'],
+        ))
+
+    @mock.patch('requests.Session.get')
+    def test_resume_csv(self, get_method):
+        output = self.path('invoices.csv')
+        checkpoint = self.path('invoices.cursor')
+        argv = [
+            'invoices', 
+            '-f', 'csv', 
+            '-o', output, 
+            '--page-size', '2', 
+            '--checkpoint', checkpoint,
+        ]
+        get_method.side_effect = self.make_get(count=4, fail_at=2)
+        with self.assertRaises(IOError):
+            self.main(argv)
+        # records have more fields after resuming
+        get_method.side_effect = self.make_get(count=4, extra=dict(amount=1))
+        self.main(argv + ['--resume'])
+        with open(output, 'rb') as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual([row[0] for row in rows], [
+            b'guid', b'MOCK_GUID0', b'MOCK_GUID1', b'MOCK_GUID2', b'MOCK_GUID3',
+        ])
+        self.assertEqual(set(len(row) for row in rows), set([2]))
+
+    @mock.patch('requests.Session.get')
+    def test_checkpoint_after_output_is_flushed(self, get_method):
+        output = self.path('invoices.ndjson')
+        checkpoint = self.path('invoices.cursor')
+        get_method.side_effect = self.make_get(count=5)
+        saved = []
+
+        def save_checkpoint(path, cursor, position, columns):
+            with open(output, 'rb') as ndjson_file:
+                lines = ndjson_file.read().splitlines()
+            saved.append((cursor['offset'], position, len(lines)))
+
+        with mock.patch(
+            'billy_client.export.save_checkpoint', 
+            save_checkpoint,
+        ):
+            self.main([
+                'invoices', 
+                '-o', output, 
+                '--page-size', '2', 
+                '--checkpoint', checkpoint,
+            ])
+        self.assertEqual([(offset, lines) for offset, _, lines in saved], [
+            (2, 2), (4, 4), (5, 5),
+        ])
+        self.assertEqual(saved[-1][1], os.path.getsize(output))
+
+    def test_resume_requires_checkpoint(self):
+        from billy_client.export import parse_args
+        with mock.patch('sys.stderr', StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_args(['invoices', '--resume', '-o', 'output'])
+            with self.assertRaises(SystemExit):
+                parse_args([
+                    'invoices', 
+                    '--resume', 
+                    '--gzip', 
+                    '-o', 'output', 
+                    '--checkpoint', 'cursor',
+                ])
+
+    def test_progress(self):
+        from billy_client.export import export
+        from billy_client.export import Progress
+        now = [0.0]
+        stderr = StringIO()
+        progress = Progress(stderr, interval=1.0, timer=lambda: now[0])
+        api = BillyAPI('MOCK_API_KEY', endpoint='http://localhost')
+
+        def records():
+            for i in range(4):
+                now[0] += 0.5
+                yield Invoice(api, dict(guid='MOCK_GUID{}'.format(i)))
+
+        count = export(records(), StringIO(), progress=progress)
+        self.assertEqual(count, 4)
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            '2 records, 2.0 records/s',
+            '4 records, 2.0 records/s',
+        ])
+
+    def test_export_customers_csv(self):
+        from billy_client.export import export
+        output = StringIO()
+        records = [
+            Customer(None, dict(guid='MOCK_GUID0', meta=dict(a=1))),
+            Customer(None, dict(guid='MOCK_GUID1', meta=None)),
+        ]
+        export(records, output, 'csv')
+        self.assertEqual(output.getvalue().splitlines(), [
+            'guid,meta',
+            'MOCK_GUID0,"{""a"": 1}"',
+            'MOCK_GUID1,',
+        ])
@@ -0,0 +1,284 @@
+from __future__ import unicode_literals
+import datetime
+import unittest
+
+import requests
+
+from billy_client.api import BillyAPI
+from billy_client.api import BillyError
+from billy_client.api import NotFoundError
+from billy_client.api import DuplicateExternalIDError
+from billy_client.api import Customer
+from billy_client.api import Invoice
+from billy_client.api import NO_RETRY
+
+
+class TestFakeBilly(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.fake import FakeBilly
+        return FakeBilly(*args, **kwargs)
+
+    def make_api(self, billy, api_key=None):
+        api = BillyAPI(
+            api_key,
+            endpoint='http://billy.test',
+            retry_policy=NO_RETRY,
+        )
+        billy.install(api)
+        return api
+
+    def make_company(self, billy):
+        api = self.make_api(billy)
+        company = api.create_company('MOCK_PROCESSOR_KEY')
+        return api, company
+
+    def test_create_and_get(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        self.assertEqual(api.api_key, company.api_key)
+        self.assertEqual(company.processor_key, 'MOCK_PROCESSOR_KEY')
+        self.assertEqual(api.get_company(company.guid).guid, company.guid)
+
+        customer = company.create_customer(processor_uri='/v1/customers/MOCK')
+        self.assertTrue(customer.guid.startswith('CU'))
+        self.assertEqual(customer.processor_uri, '/v1/customers/MOCK')
+        self.assertEqual(api.get_customer(customer.guid).guid, customer.guid)
+
+        invoice = customer.invoice(
+            amount=1000,
+            title='Foobar',
+            items=[dict(name='foo', amount=1200)],
+            adjustments=[dict(reason='discount', amount=-200)],
+        )
+        self.assertEqual(invoice.customer_guid, customer.guid)
+        self.assertEqual(invoice.title, 'Foobar')
+        self.assertEqual(invoice.items, [dict(name='foo', amount=1200)])
+        self.assertEqual(invoice.total_adjustment_amount, -200)
+        self.assertEqual(invoice.effective_amount, 800)
+        transactions = list(invoice.list_transactions())
+        self.assertEqual(len(transactions), 1)
+        self.assertEqual(transactions[0].transaction_type, 'debit')
+        self.assertEqual(transactions[0].amount, 800)
+
+        invoice.refund(amount=300)
+        transactions = list(invoice.list_transactions())
+        self.assertEqual(
+            [(t.transaction_type, t.amount) for t in transactions],
+            [('refund', 300), ('debit', 800)],
+        )
+        with self.assertRaises(BillyError):
+            invoice.refund(amount=600)
+
+    def test_subscribe_and_cancel(self):
+        now = datetime.datetime(2014, 1, 31)
+        billy = self.make_one(clock=lambda: now)
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        plan = company.create_plan(
+            plan_type='debit',
+            frequency='monthly',
+            amount=500,
+        )
+        subscription = plan.subscribe(customer_guid=customer.guid)
+        self.assertEqual(subscription.plan_guid, plan.guid)
+        self.assertEqual(subscription.invoice_count, 1)
+        self.assertEqual(
+            subscription.next_invoice_at,
+            '2014-02-28T00:00:00.000000',
+        )
+        invoices = list(subscription.list_invoices())
+        self.assertEqual(len(invoices), 1)
+        self.assertEqual(invoices[0].amount, 500)
+        self.assertEqual(len(list(plan.list_invoices())), 1)
+        self.assertEqual(len(list(plan.list_transactions())), 1)
+        self.assertEqual(len(list(customer.list_transactions())), 1)
+        self.assertEqual(
+            [c.guid for c in plan.list_customers()],
+            [customer.guid],
+        )
+
+        # subscriptions start later are not invoiced yet
+        later = plan.subscribe(
+            customer_guid=customer.guid,
+            started_at=datetime.datetime(2014, 3, 1),
+        )
+        self.assertEqual(later.invoice_count, 0)
+
+        canceled = subscription.cancel()
+        self.assertTrue(canceled.canceled)
+        self.assertTrue(api.get_subscription(subscription.guid).canceled)
+
+    def test_pagination(self):
+        billy = self.make_one(max_page_size=7)
+        api, company = self.make_company(billy)
+        guids = [company.create_customer().guid for _ in range(25)]
+
+        page = api.list_customers(page_size=10)
+        self.assertEqual(page.count(), 25)
+        # newest first
+        self.assertEqual([c.guid for c in page], list(reversed(guids)))
+        self.assertEqual(page[3:5][0].guid, guids[-4])
+
+    def test_duplicate_external_id(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        other = company.create_customer()
+        invoice = customer.invoice(amount=100, external_id='ext')
+        with self.assertRaises(DuplicateExternalIDError):
+            customer.invoice(amount=100, external_id='ext')
+        # external IDs are unique per customer
+        other.invoice(amount=100, external_id='ext')
+        self.assertEqual(
+            [i.guid for i in customer.list_invoices(external_id='ext')],
+            [invoice.guid],
+        )
+
+    def test_retry_invoice_created_before_connection_reset(self):
+        from billy_client.api import RetryPolicy
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        api.retry_policy = RetryPolicy(sleep=lambda delay: None)
+        adapter = api.session.get_adapter(api.endpoint)
+        send = adapter.send
+        resets = []
+
+        def send_and_reset(request, **kwargs):
+            resp = send(request, **kwargs)
+            # the server processed the first POST, but the response is lost
+            if request.path_url == '/v1/invoices' and not resets:
+                resets.append(request)
+                raise requests.ConnectionError('connection reset')
+            return resp
+
+        adapter.send = send_and_reset
+        customer = company.create_customer()
+        invoice = customer.invoice(amount=100, external_id='ext')
+        self.assertEqual(len(resets), 1)
+        self.assertEqual(
+            [i.guid for i in customer.list_invoices()],
+            [invoice.guid],
+        )
+        self.assertEqual(invoice.external_id, 'ext')
+        # not retried, so it's a real duplicate
+        with self.assertRaises(DuplicateExternalIDError):
+            customer.invoice(amount=100, external_id='ext')
+
+        del resets[:]
+        results = list(api.invoice_many([
+            dict(customer_guid=customer.guid, amount=100, external_id='ext2'),
+        ]))
+        self.assertEqual(len(resets), 1)
+        self.assertEqual(results[0].status, 'created')
+        self.assertEqual(results[0].invoice.external_id, 'ext2')
+
+    def test_not_found(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        with self.assertRaises(NotFoundError):
+            api.get_customer('CU_NOT_EXIST')
+        # guids of other collections are not found either
+        with self.assertRaises(NotFoundError):
+            api.get_invoice(customer.guid)
+        with self.assertRaises(NotFoundError):
+            list(Customer(api, dict(guid='CU_NOT_EXIST')).list_invoices())
+
+    def test_companies_are_isolated(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        other_api, _ = self.make_company(billy)
+        with self.assertRaises(NotFoundError):
+            other_api.get_customer(customer.guid)
+        self.assertEqual(list(other_api.list_customers()), [])
+
+    def test_invalid_api_key(self):
+        billy = self.make_one()
+        api = self.make_api(billy, api_key='INVALID_KEY')
+        with self.assertRaises(BillyError) as cm:
+            api.list_customers().count()
+        self.assertEqual(cm.exception.args[1], 403)
+
+    def test_invalid_values(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        with self.assertRaises(BillyError) as cm:
+            customer.invoice(amount='lots')
+        self.assertEqual(cm.exception.args[1], 400)
+        with self.assertRaises(BillyError) as cm:
+            customer.invoice(amount=100, items=[dict(amount='lots')])
+        self.assertEqual(cm.exception.args[1], 400)
+        with self.assertRaises(BillyError) as cm:
+            company.create_plan('debit', 'daily', amount=100, interval='x')
+        self.assertEqual(cm.exception.args[1], 400)
+        status, _ = billy.handle(
+            'GET', '/v1/customers', dict(offset='x'), {}, api.api_key,
+        )
+        self.assertEqual(status, 400)
+
+    def test_plan_customers(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        plan = company.create_plan('debit', 'daily', amount=100)
+        other_plan = company.create_plan('debit', 'daily', amount=100)
+        customers = [company.create_customer() for _ in range(3)]
+        for customer in customers:
+            plan.subscribe(customer_guid=customer.guid)
+        # subscribing again doesn't list the customer twice
+        plan.subscribe(customer_guid=customers[0].guid)
+        other_plan.subscribe(customer_guid=customers[1].guid)
+        self.assertEqual(
+            [c.guid for c in plan.list_customers()],
+            [c.guid for c in reversed(customers)],
+        )
+        self.assertEqual(
+            [c.guid for c in other_plan.list_customers()],
+            [customers[1].guid],
+        )
+        self.assertEqual(plan.list_invoices().count(), 4)
+        self.assertEqual(other_plan.list_transactions().count(), 1)
+
+    def test_get_many_and_invoice_many(self):
+        billy = self.make_one()
+        api, company = self.make_company(billy)
+        customer = company.create_customer()
+        specs = [
+            dict(customer_guid=customer.guid, amount=100, external_id=str(i))
+            for i in range(10)
+        ]
+        results = list(api.invoice_many(specs + specs[:3], workers=4))
+        statuses = [result.status for result in results]
+        self.assertEqual(statuses.count('created'), 10)
+        self.assertEqual(statuses.count('duplicate'), 3)
+
+        guids = [result.invoice.guid for result in results[:10]]
+        records = api.get_many(Invoice, guids + ['IV_NOT_EXIST'], workers=4)
+        self.assertEqual(
+            sorted(records[guid].external_id for guid in guids),
+            sorted(str(i) for i in range(10)),
+        )
+        self.assertIsInstance(records['IV_NOT_EXIST'], NotFoundError)
+
+    def test_server(self):
+        from billy_client.fake import FakeServer
+        billy = self.make_one()
+        with FakeServer(billy) as server:
+            api = BillyAPI(None, endpoint=server.endpoint)
+            try:
+                company = api.create_company('MOCK_PROCESSOR_KEY')
+                customer = company.create_customer()
+                customer.invoice(amount=100, external_id='ext')
+                with self.assertRaises(DuplicateExternalIDError):
+                    customer.invoice(amount=100, external_id='ext')
+                self.assertEqual(api.list_invoices().count(), 1)
+                with self.assertRaises(NotFoundError):
+                    api.get_invoice('IV_NOT_EXIST')
+                # invalid values get an error response over HTTP as well
+                with self.assertRaises(BillyError) as cm:
+                    customer.invoice(amount='lots')
+                self.assertEqual(cm.exception.args[1], 400)
+            finally:
+                api.close()
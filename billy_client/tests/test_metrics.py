@@ -0,0 +1,175 @@
+from __future__ import unicode_literals
+import json
+import unittest
+import threading
+
+import mock
+import requests
+
+from billy_client import BillyAPI
+from billy_client import BillyError
+from billy_client import NO_RETRY
+from billy_client.api import RequestEvent
+from billy_client.api import PageEvent
+
+
+class TestHistogram(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.metrics import Histogram
+        return Histogram(*args, **kwargs)
+
+    def test_observe(self):
+        histogram = self.make_one([1, 2, 4])
+        for value in [0.5, 1, 1.5, 3, 10]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+
+    def test_quantile(self):
+        histogram = self.make_one([1, 2, 4])
+        self.assertEqual(histogram.quantile(0.5), None)
+        for _ in range(50):
+            histogram.observe(0.5)
+        for _ in range(50):
+            histogram.observe(1.5)
+        self.assertEqual(histogram.quantile(0.5), 1.0)
+        self.assertEqual(histogram.quantile(0.25), 0.5)
+        self.assertEqual(histogram.quantile(0.99), 1.98)
+        histogram.observe(100)
+        # the +Inf bucket has no upper bound
+        self.assertEqual(histogram.quantile(1.0), 4)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        from billy_client import MetricsRegistry
+        return MetricsRegistry(*args, **kwargs)
+
+    def request_event(self, method_name, latency, status=200, error=None):
+        return RequestEvent(
+            method_name=method_name,
+            http_method='GET',
+            url_template='/v1/customers/{guid}',
+            url='http://localhost/v1/customers/MOCK_GUID',
+            retries=0,
+            status=status,
+            latency=latency,
+            request_size=0,
+            response_size=10,
+            error=error,
+        )
+
+    def test_render(self):
+        registry = self.make_one(buckets=[0.1, 1])
+        registry.on_response(self.request_event('get_customer', 0.05))
+        registry.on_response(self.request_event('get_customer', 0.5, status=503))
+        registry.on_error(self.request_event(
+            'get_customer', 
+            2, 
+            status=None, 
+            error=requests.ConnectionError(),
+        ))
+        registry.on_error(self.request_event(
+            'get_customer', 
+            None, 
+            status=None, 
+            error=BillyError(),
+        ))
+        registry.on_page(PageEvent(
+            method_name='list_invoices',
+            url='http://localhost/v1/invoices',
+            offset=0,
+            limit=10,
+            count=7,
+            latency=0.1,
+            size=100,
+        ))
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP billy_client_requests_total Requests sent to billy server',
+            '# TYPE billy_client_requests_total counter',
+            'billy_client_requests_total{operation="get_customer"} 3',
+            '# HELP billy_client_errors_total Failed requests by status code or exception',
+            '# TYPE billy_client_errors_total counter',
+            'billy_client_errors_total{operation="get_customer",reason="503"} 1',
+            'billy_client_errors_total{operation="get_customer",reason="BillyError"} 1',
+            'billy_client_errors_total{operation="get_customer",reason="ConnectionError"} 1',
+            '# HELP billy_client_request_duration_seconds Latency of requests to billy server',
+            '# TYPE billy_client_request_duration_seconds histogram',
+            'billy_client_request_duration_seconds_bucket{le="0.1",operation="get_customer"} 1',
+            'billy_client_request_duration_seconds_bucket{le="1.0",operation="get_customer"} 2',
+            'billy_client_request_duration_seconds_bucket{le="+Inf",operation="get_customer"} 3',
+            'billy_client_request_duration_seconds_sum{operation="get_customer"} 2.55',
+            'billy_client_request_duration_seconds_count{operation="get_customer"} 3',
+            '# HELP billy_client_pages_total Pages fetched by list operations',
+            '# TYPE billy_client_pages_total counter',
+            'billy_client_pages_total{operation="list_invoices"} 1',
+            '# HELP billy_client_page_records_total Records fetched by list operations',
+            '# TYPE billy_client_page_records_total counter',
+            'billy_client_page_records_total{operation="list_invoices"} 7',
+        ]) + '\n')
+
+    def test_escape_labels(self):
+        from billy_client.metrics import _labels
+        self.assertEqual(
+            _labels(operation='a"b\\c\nd'), 
+            '{operation="a\\"b\\\\c\\nd"}',
+        )
+
+    def test_threads(self):
+        registry = self.make_one()
+        event = self.request_event('get_customer', 0.01)
+
+        def run():
+            for _ in range(1000):
+                registry.on_response(event)
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['get_customer']['requests'], 4000)
+
+    @mock.patch('requests.Session.get')
+    def test_api_metrics(self, get_method):
+        results = [
+            dict(guid='MOCK_GUID'),
+            dict(offset=0, limit=2, items=[dict(guid='MOCK_GUID0')]),
+            dict(offset=2, limit=2, items=[]),
+        ]
+
+        def get(url, **kwargs):
+            json_data = results.pop(0)
+            return mock.Mock(
+                json=lambda: json_data,
+                status_code=200,
+                content=json.dumps(json_data),
+                headers={},
+            )
+        get_method.side_effect = get
+        registry = self.make_one()
+        api = BillyAPI(
+            'MOCK_API_KEY', 
+            endpoint='http://localhost', 
+            retry_policy=NO_RETRY, 
+            metrics=registry,
+        )
+        self.assertIs(api.metrics, registry)
+        api.get_customer('MOCK_GUID')
+        list(api.list_invoices())
+        snapshot = registry.snapshot()
+        self.assertEqual(sorted(snapshot), ['get_customer', 'list_invoices'])
+        self.assertEqual(snapshot['get_customer']['requests'], 1)
+        self.assertEqual(snapshot['get_customer']['errors'], {})
+        self.assertEqual(snapshot['list_invoices']['requests'], 2)
+        self.assertEqual(snapshot['list_invoices']['pages'], 2)
+        quantiles = registry.quantiles('get_customer')
+        self.assertEqual(sorted(quantiles), ['p50', 'p95', 'p99'])
+        self.assertTrue(0 <= quantiles['p50'] <= quantiles['p99'])
+        self.assertEqual(registry.quantiles('refund')['p50'], None)
+
+        registry.uninstall(api)
+        self.assertEqual(api.hooks['after_response'], [])
@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+import datetime
+import unittest
+import urlparse
+
+import mock
+
+from billy_client.api import BillyAPI
+from billy_client.api import Invoice
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.collections = dict(
+            customers=[],
+            plans=[],
+            subscriptions=[],
+            invoices=[],
+            transactions=[],
+        )
+
+    def make_one(self, *args, **kwargs):
+        from billy_client.mirror import Mirror
+        return Mirror(*args, **kwargs)
+
+    def make_api(self):
+        return BillyAPI('MOCK_API_KEY', endpoint='http://localhost')
+
+    def add(self, collection, **json_data):
+        """Add a record to the mock server, records are listed newest first
+
+        """
+        count = sum(len(records) for records in self.collections.values())
+        json_data.setdefault(
+            'created_at', 
+            '2014-01-{:02}T00:00:00.000000Z'.format(count + 1),
+        )
+        self.collections[collection].insert(0, json_data)
+
+    def mock_get(self, url, **kwargs):
+        o = urlparse.urlparse(url)
+        query = dict(urlparse.parse_qsl(o.query))
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 2))
+        records = self.collections[o.path.split('/')[-1]]
+        data = dict(
+            offset=offset,
+            limit=limit,
+            items=records[offset:offset + limit],
+        )
+        self.requested.append((o.path, offset))
+        return mock.Mock(json=lambda: data, status_code=200)
+
+    def sync(self, mirror, **kwargs):
+        self.requested = []
+        with mock.patch('requests.Session.get') as get_method:
+            get_method.side_effect = self.mock_get
+            return mirror.sync(**kwargs)
+
+    def test_sync(self):
+        self.add('customers', guid='CU1', external_id='ext1')
+        self.add('plans', guid='PL1', plan_type='charge', frequency='daily')
+        self.add('subscriptions', guid='SU1', customer_guid='CU1', plan_guid='PL1')
+        self.add('invoices', guid='IV1', customer_guid='CU1', subscription_guid='SU1', status='PROCESSED', amount=100)
+        self.add('invoices', guid='IV2', customer_guid='CU1', subscription_guid='SU1', status='FAILED', amount=100)
+        self.add('invoices', guid='IV3', customer_guid='CU1', status='FAILED', amount=200)
+        self.add('transactions', guid='TX1', invoice_guid='IV1', status='DONE', amount=100)
+        mirror = self.make_one(self.make_api())
+        self.assertEqual(mirror.last_synced('invoices'), None)
+        self.assertEqual(self.sync(mirror), dict(
+            customers=1,
+            plans=1,
+            subscriptions=1,
+            invoices=3,
+            transactions=1,
+        ))
+        self.assertTrue(isinstance(
+            mirror.last_synced('invoices'), 
+            datetime.datetime,
+        ))
+
+        invoices = mirror.find('invoices', status='FAILED')
+        self.assertEqual([i.guid for i in invoices], ['IV3', 'IV2'])
+        self.assertTrue(isinstance(invoices[0], Invoice))
+        self.assertEqual(mirror.count('invoices', customer_guid='CU1'), 3)
+        self.assertEqual(mirror.count('invoices', subscription_guid=None), 1)
+        self.assertEqual(mirror.get('customers', 'CU1').external_id, 'ext1')
+        self.assertEqual(mirror.get('customers', 'CU2'), None)
+        self.assertEqual(
+            [i.guid for i in mirror.find('invoices', limit=1)], 
+            ['IV3'],
+        )
+        self.assertEqual(
+            [i.guid for i in mirror.find(
+                'invoices', 
+                since='2014-01-05', 
+                until=datetime.datetime(2014, 1, 6),
+            )], 
+            ['IV2'],
+        )
+        self.assertEqual(
+            [i.guid for i in mirror.find_invoices_for_plan('PL1')], 
+            ['IV2', 'IV1'],
+        )
+        self.assertEqual(
+            [i.guid for i in mirror.find_invoices_for_plan(
+                'PL1', 
+                status='PROCESSED',
+            )], 
+            ['IV1'],
+        )
+        with self.assertRaises(ValueError):
+            mirror.find('plans', customer_guid='CU1')
+
+    def test_incremental_sync(self):
+        for i in range(5):
+            self.add('invoices', guid='IV{}'.format(i), status='STAGED')
+        mirror = self.make_one(self.make_api())
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=5,
+        ))
+        self.assertEqual(len(self.requested), 4)
+
+        # nothing changed, stop at the first record
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=0,
+        ))
+        self.assertEqual(self.requested, [('/v1/invoices', 0)])
+
+        # new records and a changed recent record
+        self.add('invoices', guid='IV5', status='STAGED')
+        self.add('invoices', guid='IV6', status='STAGED')
+        self.collections['invoices'][2]['status'] = 'PROCESSED'
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=3,
+        ))
+        self.assertEqual(self.requested, [
+            ('/v1/invoices', 0),
+            ('/v1/invoices', 2),
+        ])
+        self.assertEqual(mirror.get('invoices', 'IV4').status, 'PROCESSED')
+        self.assertEqual(mirror.count('invoices'), 7)
+
+        # changes to older records are only found by full sync
+        self.collections['invoices'][-1]['status'] = 'PROCESSED'
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=0,
+        ))
+        self.assertEqual(mirror.get('invoices', 'IV0').status, 'STAGED')
+        self.assertEqual(self.sync(
+            mirror, 
+            collections=['invoices'], 
+            full=True,
+        ), dict(invoices=1))
+        self.assertEqual(mirror.get('invoices', 'IV0').status, 'PROCESSED')
+
+    def test_incremental_sync_lookback(self):
+        # created on Jan 1 to Jan 6, listed newest first
+        for i in range(6):
+            self.add('invoices', guid='IV{}'.format(i), status='STAGED')
+        now = [datetime.datetime(2014, 1, 10)]
+        mirror = self.make_one(
+            self.make_api(),
+            lookback=datetime.timedelta(days=7, hours=12),
+            clock=lambda: now[0],
+        )
+        self.sync(mirror, collections=['invoices'])
+
+        # records created since Jan 2 12:00 are checked, so the change to 
+        # IV2 behind unchanged records is picked up, the sync stops at IV1
+        now[0] = datetime.datetime(2014, 1, 11)
+        self.collections['invoices'][3]['status'] = 'PROCESSED'
+        self.collections['invoices'][5]['status'] = 'PROCESSED'
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=1,
+        ))
+        self.assertEqual(mirror.get('invoices', 'IV2').status, 'PROCESSED')
+        self.assertEqual(mirror.get('invoices', 'IV0').status, 'STAGED')
+
+        # the window moves with the last sync, from Jan 3 12:00 now, so 
+        # the sync stops at IV2 before reaching the changed IV1
+        self.collections['invoices'][4]['status'] = 'FAILED'
+        self.assertEqual(self.sync(mirror, collections=['invoices']), dict(
+            invoices=0,
+        ))
+        self.assertEqual(mirror.get('invoices', 'IV1').status, 'STAGED')
+        self.assertEqual(self.requested, [
+            ('/v1/invoices', 0),
+            ('/v1/invoices', 2),
+        ])
+
+    def test_persistent(self):
+        import os
+        import shutil
+        import tempfile
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'billy.sqlite')
+        self.add('plans', guid='PL1', plan_type='charge', frequency='daily')
+        mirror = self.make_one(self.make_api(), path)
+        self.sync(mirror, collections=['plans'])
+        mirror.close()
+
+        mirror = self.make_one(self.make_api(), path)
+        self.assertEqual(mirror.get('plans', 'PL1').frequency, 'daily')
+        self.assertEqual(self.sync(mirror, collections=['plans']), dict(
+            plans=0,
+        ))
@@ -29,4 +29,9 @@ setup(
     zip_safe=False,
     install_requires=requires,
     tests_require=test_requires,
+    entry_points={
+        'console_scripts': [
+            'billy-export = billy_client.export:main',
+        ],
+    },
 )